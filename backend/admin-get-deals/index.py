@@ -1,14 +1,540 @@
+import base64
+import bisect
+import csv
+import functools
+import gzip
+import io
+import hashlib
 import json
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import psycopg2
-from datetime import datetime
+import urllib.request
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+from time import perf_counter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Ответы короче порога отдаются как есть: выигрыш меньше затрат на сжатие
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+# Поля ответа и их SQL-выражения; fields= сужает и SELECT, и ключи ответа
+DEAL_COLUMNS = {
+    'id': 'd.id',
+    'user_id': 'd.user_id',
+    'username': 'u.name',
+    'email': 'u.email',
+    'phone': 'u.phone',
+    'deal_type': 'd.deal_type',
+    'amount': 'COALESCE(d.amount, 0)::float8',
+    'rate': 'COALESCE(d.rate, 0)::float8',
+    'total': 'COALESCE(d.total, 0)::float8',
+    'status': 'd.status',
+    'partner_name': 'd.partner_name',
+    'created_at': 'd.created_at',
+    'updated_at': 'd.updated_at'
+}
+USER_FIELDS = {'username', 'email', 'phone'}
+DEAL_TYPES = ('buy', 'sell')
+DEAL_STATUSES = ('pending', 'completed', 'cancelled')
+
+# Постраничная выдача по (created_at, id): limit по умолчанию и верхняя граница
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 500
+# Ключ сортировки: created_at может быть NULL, такие сделки идут последними
+SORT_KEY = "COALESCE(d.created_at, 'epoch'::timestamp)"
+
+# Выгрузка: строки читаются именованным курсором пачками, память не растёт с объёмом истории
+EXPORT_FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', '2000'))
+# Выше этого числа строк выгрузка в теле ответа прерывается: нужен destination=file
+EXPORT_INLINE_MAX_ROWS = int(os.environ.get('EXPORT_INLINE_MAX_ROWS', '50000'))
+# Локальный каталог - заглушка объектного хранилища для больших выгрузок
+EXPORT_DIR = os.environ.get('EXPORT_DIR', '/tmp/exports')
+
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    """Requested fields in declaration order, id always included; raises ValueError on unknown names"""
+    if not value:
+        return list(DEAL_COLUMNS)
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(DEAL_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add('id')
+    return [name for name in DEAL_COLUMNS if name in requested]
+
+
+def parse_filters(params: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    """Conditions and parameters for status, deal_type, date_from/date_to (inclusive, YYYY-MM-DD),
+    amount_min/amount_max and user_id; raises ValueError on bad values"""
+    conditions = []
+    values: List[Any] = []
+    if params.get('status'):
+        if params['status'] not in DEAL_STATUSES:
+            raise ValueError(f"status must be one of {', '.join(DEAL_STATUSES)}")
+        conditions.append('d.status = %s')
+        values.append(params['status'])
+    if params.get('deal_type'):
+        if params['deal_type'] not in DEAL_TYPES:
+            raise ValueError(f"deal_type must be one of {', '.join(DEAL_TYPES)}")
+        conditions.append('d.deal_type = %s')
+        values.append(params['deal_type'])
+    if params.get('date_from'):
+        conditions.append('d.created_at >= %s')
+        values.append(date.fromisoformat(params['date_from']))
+    if params.get('date_to'):
+        conditions.append("d.created_at < %s::date + INTERVAL '1 day'")
+        values.append(date.fromisoformat(params['date_to']))
+    if params.get('amount_min'):
+        conditions.append('d.amount >= %s::numeric')
+        values.append(float(params['amount_min']))
+    if params.get('amount_max'):
+        conditions.append('d.amount <= %s::numeric')
+        values.append(float(params['amount_max']))
+    if params.get('user_id'):
+        conditions.append('d.user_id = %s')
+        values.append(int(params['user_id']))
+    return conditions, values
+
+
+def encode_cursor(created_at: datetime, deal_id: int) -> str:
+    """Opaque next-page cursor from the last row's (created_at, id)"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{deal_id}".encode()).decode()
+
+
+def decode_cursor(value: str) -> Tuple[datetime, int]:
+    """(created_at, id) from a cursor; raises ValueError if it was not produced by encode_cursor"""
+    created_at, _, deal_id = base64.urlsafe_b64decode(value.encode()).decode().partition('|')
+    return datetime.fromisoformat(created_at), int(deal_id)
+
+
+def parse_page(params: Dict[str, Any]) -> Tuple[Optional[int], Optional[Tuple[datetime, int]]]:
+    """Page size and decoded cursor; limit is None when the client did not ask for pagination"""
+    if not params.get('limit') and not params.get('cursor'):
+        return None, None
+    limit = int(params.get('limit') or PAGE_DEFAULT_LIMIT)
+    if not 1 <= limit <= PAGE_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {PAGE_MAX_LIMIT}')
+    try:
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    return limit, cursor
+
+
+def deals_query(fields: List[str], conditions: List[str], order: str, extra_columns: Tuple[str, ...] = ()) -> str:
+    """SELECT over deals with only the requested columns; users is joined only for user fields"""
+    # JOIN на users нужен только для полей пользователя; deals.user_id ссылается на users(id)
+    user_join = 'JOIN users u ON d.user_id = u.id' if USER_FIELDS.intersection(fields) else ''
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    return f"""
+        SELECT {', '.join([DEAL_COLUMNS[name] for name in fields] + list(extra_columns))}
+        FROM deals d
+        {user_join}
+        {where}
+        ORDER BY {order}
+    """
+
+
+def iter_deal_rows(conn, fields: List[str], conditions: List[str], values: List[Any]) -> Iterator[tuple]:
+    """Rows from a named server-side cursor, fetched EXPORT_CHUNK_ROWS at a time"""
+    cursor = conn.cursor(name='deals_export')
+    cursor.itersize = EXPORT_CHUNK_ROWS
+    try:
+        cursor.execute(deals_query(fields, conditions, f'{SORT_KEY}, d.id'), values)
+        while True:
+            chunk = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not chunk:
+                break
+            yield from chunk
+    finally:
+        cursor.close()
+
+
+def limited_rows(rows: Iterator[tuple], limit: int) -> Iterator[tuple]:
+    """Pass rows through, raising OverflowError once there are more than limit of them"""
+    for count, row in enumerate(rows, 1):
+        if count > limit:
+            raise OverflowError(f'Export exceeds {limit} rows, use destination=file or narrow the filters')
+        yield row
+
+
+def csv_value(value: Any) -> Any:
+    """CSV cell with the same date encoding as the JSON responses"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return value
+
+
+def export_chunks(rows: Iterator[tuple], fields: List[str], export_format: str) -> Iterator[str]:
+    """Encode rows as CSV (with header) or NDJSON, one text chunk per EXPORT_CHUNK_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if export_format == 'csv':
+        writer.writerow(fields)
+    pending = 0
+    for row in rows:
+        if export_format == 'csv':
+            writer.writerow([csv_value(value) for value in row])
+        else:
+            buffer.write(to_json(dict(zip(fields, row))))
+            buffer.write('\n')
+        pending += 1
+        if pending >= EXPORT_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_export(chunks: Iterator[str], export_format: str) -> Tuple[str, int]:
+    """Stream chunks into a new file under EXPORT_DIR; returns the path and its size in bytes"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"deals-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}.{export_format}")
+    size = 0
+    with open(path, 'w', encoding='utf-8', newline='') as target:
+        for chunk in chunks:
+            target.write(chunk)
+            size += len(chunk.encode())
+    return path, size
+
+
+def json_default(value: Any) -> Any:
+    """Encode values that come straight from rows: Decimal, datetime, date and time"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def to_json(payload: Any) -> str:
+    """Serialize with orjson when it is installed, falling back to json with the same encoding rules"""
+    started = perf_counter()
+    try:
+        if orjson is not None:
+            return orjson.dumps(payload, default=json_default).decode()
+        return json.dumps(payload, default=json_default)
+    finally:
+        trace_add('serialize', started)
+
+
+def accepted_encoding(event: Dict[str, Any]) -> Optional[str]:
+    """Best encoding the client accepts: br when brotli is installed, otherwise gzip"""
+    headers = event.get('headers') or {}
+    header = headers.get('Accept-Encoding') or headers.get('accept-encoding') or ''
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        params = params.strip().replace(' ', '')
+        try:
+            quality = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        if name.strip() and quality > 0:
+            accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_body(body: str, encoding: str) -> str:
+    """Compress the body and encode it as base64 for isBase64Encoded responses"""
+    data = body.encode()
+    packed = brotli.compress(data, quality=5) if encoding == 'br' else gzip.compress(data, compresslevel=6)
+    return base64.b64encode(packed).decode()
+
+
+def compressed_response(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    """Compress a 200 response body when the client accepts it and it is larger than COMPRESS_MIN_BYTES"""
+    response['headers']['Vary'] = 'Accept-Encoding'
+    encoding = accepted_encoding(event)
+    body = response.get('body') or ''
+    if response['statusCode'] != 200 or not encoding or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response['headers']['Content-Encoding'] = encoding
+    response['body'] = compress_body(body, encoding)
+    response['isBase64Encoded'] = True
+    return response
+
+
+def make_etag(*parts: Any) -> str:
+    """Weak ETag from validator parts"""
+    return 'W/"' + hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    """True if If-None-Match of the request lists this ETag"""
+    headers = event.get('headers') or {}
+    header = headers.get('If-None-Match') or headers.get('if-none-match') or ''
+    return any(tag.strip() in (etag, etag[2:], '*') for tag in header.split(','))
+
+
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'admin-get-deals'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg2.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg2.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+# Чтение с реплики: DATABASE_REPLICA_URL, пока её отставание не больше REPLICA_MAX_LAG_SECONDS.
+# Клиент после своей записи присылает X-Last-Write-Age (мс); такой запрос идёт на основную базу,
+# пока реплика не применила всё, что было до этой записи
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = 1.0
+_replica_lag: Dict[str, float] = {}
+
+
+def write_age_seconds(event: Dict[str, Any]) -> Optional[float]:
+    """Seconds since the client's own last mutation, None when it did not send X-Last-Write-Age"""
+    headers = event.get('headers') or {}
+    value = headers.get('X-Last-Write-Age') or headers.get('x-last-write-age')
+    try:
+        return max(float(value), 0.0) / 1000 if value else None
+    except ValueError:
+        return None
+
+
+def replica_lag(conn: Any) -> float:
+    """Upper bound of the replica's replay lag in seconds, measured at most once per REPLICA_LAG_CHECK_SECONDS"""
+    now = perf_counter()
+    if not _replica_lag or now - _replica_lag['checked_at'] >= REPLICA_LAG_CHECK_SECONDS:
+        cur = conn.cursor()
+        # Реплика без новых WAL не отстаёт, даже если последняя транзакция была давно
+        cur.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 'Infinity')
+            END
+        """)
+        _replica_lag.update(lag=float(cur.fetchone()[0]), checked_at=now)
+        cur.close()
+    return _replica_lag['lag'] + (now - _replica_lag['checked_at'])
+
+
+def read_connection(event: Dict[str, Any], dsn: str) -> Tuple[Any, bool]:
+    """Connection for read-only work and whether it is the replica; falls back to the primary dsn"""
+    age = write_age_seconds(event)
+    if DATABASE_REPLICA_URL and (age is None or age >= READ_YOUR_WRITES_SECONDS):
+        try:
+            conn = traced_connect(DATABASE_REPLICA_URL)
+        except psycopg2.OperationalError as e:
+            print(f"Replica unavailable, reading from primary: {e}")
+        else:
+            lag = replica_lag(conn)
+            if lag <= REPLICA_MAX_LAG_SECONDS and (age is None or lag < age):
+                return conn, True
+            conn.close()
+    return traced_connect(dsn), False
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Get all deals with user info for admin panel
-    Args: event with httpMethod
-    Returns: List of all deals with user details
+    Business: Get all deals with user info for admin panel, or export them as CSV/NDJSON
+    Args: event with httpMethod, optional queryStringParameters: fields (comma separated response fields),
+          filters status, deal_type, date_from/date_to (YYYY-MM-DD), amount_min/amount_max, user_id;
+          limit/cursor for keyset pagination; export (csv/ndjson), destination (file)
+    Returns: Deals with user details (a page plus next_cursor when limit or cursor is given),
+             an export body, or the path of the written export file
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,7 +544,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, X-Last-Write-Age',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -31,7 +557,25 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'error': 'Method not allowed'})
+            'body': traced_dumps({'error': 'Method not allowed'})
+        }
+    
+    params = event.get('queryStringParameters') or {}
+    export_format = params.get('export')
+    try:
+        fields = parse_fields(params.get('fields'))
+        conditions, values = parse_filters(params)
+        limit, page_cursor = parse_page(params)
+        if export_format and export_format not in EXPORT_FORMATS:
+            raise ValueError('export must be csv or ndjson')
+        if params.get('destination') not in (None, 'file') or (params.get('destination') and not export_format):
+            raise ValueError('destination=file requires export')
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': traced_dumps({'success': False, 'error': str(e)})
         }
     
     database_url = os.environ.get('DATABASE_URL')
@@ -42,68 +586,91 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'error': 'Database not configured'})
+            'body': traced_dumps({'error': 'Database not configured'})
         }
     
     conn = None
     try:
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor()
+        conn, _ = read_connection(event, database_url)
         
-        cursor.execute("""
-            SELECT 
-                d.id, 
-                d.user_id, 
-                u.name as username,
-                u.email,
-                u.phone,
-                d.deal_type, 
-                d.amount, 
-                d.rate, 
-                d.total, 
-                d.status,
-                d.partner_name,
-                d.created_at,
-                d.updated_at
-            FROM deals d
-            JOIN users u ON d.user_id = u.id
-            ORDER BY d.created_at DESC
-        """)
+        if export_format:
+            rows = iter_deal_rows(conn, fields, conditions, values)
+            if params.get('destination') == 'file':
+                path, size = write_export(export_chunks(rows, fields, export_format), export_format)
+                conn.close()
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': traced_dumps({'success': True, 'format': export_format, 'path': path, 'bytes': size})
+                }
+            
+            try:
+                body = ''.join(export_chunks(limited_rows(rows, EXPORT_INLINE_MAX_ROWS), fields, export_format))
+            except OverflowError as e:
+                conn.close()
+                return {
+                    'statusCode': 413,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': traced_dumps({'success': False, 'error': str(e)})
+                }
+            conn.close()
+            return compressed_response(event, {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': EXPORT_FORMATS[export_format],
+                    'Content-Disposition': f'attachment; filename="deals.{export_format}"',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': body
+            })
         
-        deals_data = cursor.fetchall()
+        cursor = conn.cursor()
+        cursor.execute("SELECT string_agg(name || ':' || version, ',' ORDER BY name) FROM cache_versions WHERE name IN ('deals', 'users')")
+        etag = make_etag('admin-deals', cursor.fetchone()[0], fields, conditions, values, limit, page_cursor)
+        etag_headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        }
+        if etag_matches(event, etag):
+            cursor.close()
+            conn.close()
+            return {'statusCode': 304, 'headers': etag_headers, 'isBase64Encoded': False, 'body': ''}
+        
+        if limit is None:
+            cursor.execute(deals_query(fields, conditions, f'{SORT_KEY} DESC'), values)
+            deals_data = cursor.fetchall()
+            payload = {'success': True, 'deals': [dict(zip(fields, deal)) for deal in deals_data]}
+        else:
+            # Keyset: страница читается диапазоном idx_deals_created_at_epoch_id (или idx_deals_user_created_at_epoch_id)
+            if page_cursor:
+                conditions = conditions + [f'({SORT_KEY}, d.id) < (%s, %s)']
+                values = values + list(page_cursor)
+            cursor.execute(
+                deals_query(fields, conditions, f'{SORT_KEY} DESC, d.id DESC', (SORT_KEY, 'd.id')) + ' LIMIT %s',
+                values + [limit + 1]
+            )
+            deals_data = cursor.fetchall()
+            has_more = len(deals_data) > limit
+            deals_data = deals_data[:limit]
+            payload = {
+                'success': True,
+                'deals': [dict(zip(fields, deal)) for deal in deals_data],
+                'next_cursor': encode_cursor(deals_data[-1][-2], deals_data[-1][-1]) if has_more else None
+            }
         cursor.close()
         conn.close()
         
-        deals = []
-        for deal in deals_data:
-            deals.append({
-                'id': deal[0],
-                'user_id': deal[1],
-                'username': deal[2],
-                'email': deal[3],
-                'phone': deal[4],
-                'deal_type': deal[5],
-                'amount': float(deal[6]) if deal[6] else 0,
-                'rate': float(deal[7]) if deal[7] else 0,
-                'total': float(deal[8]) if deal[8] else 0,
-                'status': deal[9],
-                'partner_name': deal[10],
-                'created_at': deal[11].isoformat() if deal[11] else None,
-                'updated_at': deal[12].isoformat() if deal[12] else None
-            })
-        
-        return {
+        return compressed_response(event, {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
+            'headers': {**etag_headers, 'Content-Type': 'application/json'},
             'isBase64Encoded': False,
-            'body': json.dumps({
-                'success': True,
-                'deals': deals
-            })
-        }
+            'body': to_json(payload)
+        })
     except Exception as e:
         if conn:
             conn.close()
@@ -113,5 +680,5 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'error': f'Failed to get deals: {str(e)}'})
+            'body': traced_dumps({'error': f'Failed to get deals: {str(e)}'})
         }
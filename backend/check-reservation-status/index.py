@@ -1,8 +1,202 @@
+import bisect
+import functools
 import json
 import os
 import psycopg
+import urllib.request
+import uuid
 from typing import Dict, Any
+from time import perf_counter
 
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'check-reservation-status'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Check reservation status for anonymous users
@@ -29,7 +223,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Method not allowed'})
+            'body': traced_dumps({'error': 'Method not allowed'})
         }
     
     params = event.get('queryStringParameters', {}) or {}
@@ -40,13 +234,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'success': False, 'error': 'Missing reservation_id'})
+            'body': traced_dumps({'success': False, 'error': 'Missing reservation_id'})
         }
     
     dsn = os.environ.get('DATABASE_URL')
     
     try:
-        with psycopg.connect(dsn, autocommit=True) as conn:
+        with traced_connect(dsn, autocommit=True) as conn:
             with conn.cursor() as cur:
                 cur.execute(f"""
                     SELECT status
@@ -61,7 +255,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'statusCode': 404,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'isBase64Encoded': False,
-                        'body': json.dumps({'success': False, 'error': 'Reservation not found'})
+                        'body': traced_dumps({'success': False, 'error': 'Reservation not found'})
                     }
                 
                 status = result[0]
@@ -70,7 +264,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'isBase64Encoded': False,
-                    'body': json.dumps({
+                    'body': traced_dumps({
                         'success': True,
                         'status': status
                     })
@@ -82,5 +276,5 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'success': False, 'error': 'Database error'})
+            'body': traced_dumps({'success': False, 'error': 'Database error'})
         }
@@ -1,14 +1,290 @@
+import bisect
+import functools
 import json
 import os
+import re
 import psycopg2
 import requests
-from typing import Dict, Any
-from datetime import datetime, timedelta
+import urllib.request
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+from time import perf_counter
 
+# Объявление может действовать не дольше двух недель вперёд
+MAX_VALID_DAYS = 14
+
+def normalize_office(name: str) -> str:
+    """Normalize office name the same way as offices.normalized_name"""
+    return re.sub(r'[\s.,]+', ' ', name.lower()).strip()
+
+def parse_offices(offices: Any, office_ids: Any) -> Tuple[List[str], Optional[List[int]]]:
+    """Client offices (names) and office_ids checked and converted; raises ValueError on anything else"""
+    if offices is None:
+        offices = []
+    if not isinstance(offices, list) or not all(isinstance(office, str) for office in offices):
+        raise ValueError('offices must be a list of names')
+    if office_ids is None:
+        return offices, None
+    if not isinstance(office_ids, list):
+        raise ValueError('office_ids must be a list of integers')
+    if any(isinstance(office_id, bool) or not isinstance(office_id, (int, str)) for office_id in office_ids):
+        raise ValueError('office_ids must be a list of integers')
+    try:
+        return offices, [int(office_id) for office_id in office_ids]
+    except ValueError:
+        raise ValueError('office_ids must be a list of integers')
+
+def resolve_offices(cursor, city: str, offices: List[str], office_ids: Optional[List[int]] = None) -> Tuple[List[int], List[str]]:
+    """Map office ids or names to registry ids and canonical names, registering unknown names"""
+    if office_ids:
+        cursor.execute('SELECT id, name FROM offices WHERE city = %s AND id = ANY(%s)', (city, office_ids))
+        found = dict(cursor.fetchall())
+        ids = [i for i in office_ids if i in found]
+        return ids, [found[i] for i in ids]
+    
+    normalized: List[str] = []
+    names: List[str] = []
+    for office in offices or []:
+        key = normalize_office(office)
+        if key and key not in normalized:
+            normalized.append(key)
+            names.append(office.strip())
+    if not normalized:
+        return [], []
+    
+    cursor.execute(
+        'SELECT normalized_name, id, name FROM offices WHERE city = %s AND normalized_name = ANY(%s)',
+        (city, normalized)
+    )
+    found = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    
+    missing = [(name, key) for name, key in zip(names, normalized) if key not in found]
+    if missing:
+        cursor.execute('''
+            INSERT INTO offices (city, name, normalized_name)
+            SELECT %s, n.name, n.normalized_name
+            FROM UNNEST(%s::text[], %s::text[]) AS n(name, normalized_name)
+            ON CONFLICT (city, normalized_name) DO UPDATE SET city = EXCLUDED.city
+            RETURNING normalized_name, id, name
+        ''', (city, [name for name, _ in missing], [key for _, key in missing]))
+        found.update({row[0]: (row[1], row[2]) for row in cursor.fetchall()})
+    
+    return [found[key][0] for key in normalized], [found[key][1] for key in normalized]
+
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'create-offer'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg2.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg2.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+def traced_http(call: Any, *args: Any, **kwargs: Any) -> Any:
+    """Outbound HTTP call (Telegram, Binance) counted as HTTP time"""
+    started = perf_counter()
+    failed = True
+    try:
+        result = call(*args, **kwargs)
+        failed = False
+        return result
+    finally:
+        metrics_observe('http', (perf_counter() - started) * 1000, error=failed)
+        trace_add('http', started)
+
+
+def offer_validity(valid_from: Optional[date], valid_until: Optional[date], today: date) -> Tuple[date, date]:
+    """First and last day the offer's daily window applies. NULL valid_from - already started,
+    NULL valid_until - today only: such an offer lives until EXPIRED_OFFERS or expires_at retires it"""
+    return valid_from or today, valid_until or today
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Create new offer with time slots for buying or selling USDT
-    Args: event with httpMethod, body containing user_id, offer_type, amount, rate, time_start, time_end
+    Args: event with httpMethod, body containing user_id, offer_type, amount, rate, time_start, time_end, city, offices (names) or office_ids,
+          optional valid_from / valid_until (YYYY-MM-DD) for offers spanning several days
     Returns: Success response with offer_id and created time slots
     '''
     method: str = event.get('httpMethod', 'POST')
@@ -32,7 +308,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Access-Control-Allow-Origin': '*',
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps({'error': 'Method not allowed'})
+            'body': traced_dumps({'error': 'Method not allowed'})
         }
     
     try:
@@ -44,7 +320,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         time_start = body_data.get('time_start')
         time_end = body_data.get('time_end')
         city = body_data.get('city', 'Москва')
-        offices = body_data.get('offices', [])
+        try:
+            offices, office_ids = parse_offices(body_data.get('offices', []), body_data.get('office_ids'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Content-Type': 'application/json'
+                },
+                'body': traced_dumps({'error': str(e)})
+            }
         
         if not all([user_id, offer_type, amount, rate, time_start, time_end]):
             return {
@@ -53,11 +339,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Access-Control-Allow-Origin': '*',
                     'Content-Type': 'application/json'
                 },
-                'body': json.dumps({'error': 'Missing required fields'})
+                'body': traced_dumps({'error': 'Missing required fields'})
+            }
+        
+        try:
+            valid_from = datetime.strptime(body_data['valid_from'], '%Y-%m-%d').date() if body_data.get('valid_from') else None
+            valid_until = datetime.strptime(body_data['valid_until'], '%Y-%m-%d').date() if body_data.get('valid_until') else None
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Content-Type': 'application/json'
+                },
+                'body': traced_dumps({'error': 'Invalid valid_from / valid_until, expected YYYY-MM-DD'})
+            }
+        
+        today = datetime.now().date()
+        first_day, last_day = offer_validity(valid_from, valid_until, today)
+        validity_error = None
+        if first_day < today:
+            validity_error = 'valid_from must not be in the past'
+        elif last_day < first_day:
+            validity_error = 'valid_until must not be before valid_from'
+        elif (last_day - first_day).days >= MAX_VALID_DAYS:
+            validity_error = f'Offer may span up to {MAX_VALID_DAYS} days'
+        if validity_error:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Content-Type': 'application/json'
+                },
+                'body': traced_dumps({'error': validity_error})
             }
         
         dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
+        conn = traced_connect(dsn)
         cursor = conn.cursor()
         
         cursor.execute('SELECT COALESCE(blocked, false) FROM users WHERE id = %s', (user_id,))
@@ -72,17 +390,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Access-Control-Allow-Origin': '*',
                     'Content-Type': 'application/json'
                 },
-                'body': json.dumps({'error': 'Вы заблокированы и не можете создавать объявления'})
+                'body': traced_dumps({'error': 'Вы заблокированы и не можете создавать объявления'})
             }
         
+        office_ids, offices = resolve_offices(cursor, city, offices, office_ids)
+        
         cursor.execute('''
             INSERT INTO offers 
-            (user_id, offer_type, amount, rate, meeting_time, time_start, time_end, city, offices, status, expires_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'active', NOW() + INTERVAL '24 hours')
+            (user_id, offer_type, amount, rate, meeting_time, time_start, time_end, city, offices, office_ids,
+             valid_from, valid_until, status, expires_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'active',
+                    COALESCE(%s::date + 1, NOW() + INTERVAL '24 hours'))
             RETURNING id
-        ''', (user_id, offer_type, float(amount), float(rate), f"{time_start}-{time_end}", time_start, time_end, city, offices))
+        ''', (user_id, offer_type, float(amount), float(rate), f"{time_start}-{time_end}", time_start, time_end, city, offices, office_ids,
+              valid_from, valid_until, valid_until))
         
         offer_id = cursor.fetchone()[0]
+        cursor.execute('UPDATE users SET offers_count = offers_count + 1 WHERE id = %s', (user_id,))
         
         # Генерируем временные слоты (каждые 15 минут)
         start_time = datetime.strptime(time_start, '%H:%M').time()
@@ -109,6 +433,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         username_result = cursor.fetchone()
         username = username_result[0] if username_result else 'Пользователь'
         
+        cursor.execute("UPDATE cache_versions SET version = version + 1, updated_at = NOW() WHERE name = 'offers'")
+        
         conn.commit()
         cursor.close()
         conn.close()
@@ -131,7 +457,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             try:
                 telegram_api_url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
-                requests.post(
+                traced_http(requests.post,
                     telegram_api_url,
                     json={'chat_id': chat_id, 'text': message},
                     timeout=5
@@ -146,7 +472,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json'
             },
             'isBase64Encoded': False,
-            'body': json.dumps({
+            'body': traced_dumps({
                 'success': True,
                 'offer_id': offer_id,
                 'slots_created': slots_created
@@ -160,5 +486,5 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Access-Control-Allow-Origin': '*',
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps({'error': str(e)})
+            'body': traced_dumps({'error': str(e)})
         }
\ No newline at end of file
@@ -1,12 +1,248 @@
+import bisect
+import functools
 import json
 import os
+import re
 import psycopg2
-from typing import Dict, Any
+import urllib.request
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+from time import perf_counter
 
+def normalize_office(name: str) -> str:
+    """Normalize office name the same way as offices.normalized_name"""
+    return re.sub(r'[\s.,]+', ' ', name.lower()).strip()
+
+def resolve_offices(cursor, city: str, offices: List[str], office_ids: Optional[List[int]] = None) -> Tuple[List[int], List[str]]:
+    """Map office ids or names to registry ids and canonical names, registering unknown names"""
+    if office_ids:
+        cursor.execute('SELECT id, name FROM offices WHERE city = %s AND id = ANY(%s)', (city, [int(i) for i in office_ids]))
+        found = dict(cursor.fetchall())
+        ids = [int(i) for i in office_ids if int(i) in found]
+        return ids, [found[i] for i in ids]
+    
+    normalized: List[str] = []
+    names: List[str] = []
+    for office in offices or []:
+        key = normalize_office(office)
+        if key and key not in normalized:
+            normalized.append(key)
+            names.append(office.strip())
+    if not normalized:
+        return [], []
+    
+    cursor.execute(
+        'SELECT normalized_name, id, name FROM offices WHERE city = %s AND normalized_name = ANY(%s)',
+        (city, normalized)
+    )
+    found = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    
+    missing = [(name, key) for name, key in zip(names, normalized) if key not in found]
+    if missing:
+        cursor.execute('''
+            INSERT INTO offices (city, name, normalized_name)
+            SELECT %s, n.name, n.normalized_name
+            FROM UNNEST(%s::text[], %s::text[]) AS n(name, normalized_name)
+            ON CONFLICT (city, normalized_name) DO UPDATE SET city = EXCLUDED.city
+            RETURNING normalized_name, id, name
+        ''', (city, [name for name, _ in missing], [key for _, key in missing]))
+        found.update({row[0]: (row[1], row[2]) for row in cursor.fetchall()})
+    
+    return [found[key][0] for key in normalized], [found[key][1] for key in normalized]
+
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'edit-offer'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg2.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg2.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Update offer details including slots, city and offices
-    Args: event with httpMethod, body containing offer_id, amount, rate, meeting_time, meeting_time_end, city, offices
+    Args: event with httpMethod, body containing offer_id, amount, rate, meeting_time, meeting_time_end, city, offices (names) or office_ids
     Returns: HTTP response with success status
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -27,7 +263,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return {
             'statusCode': 405,
             'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
+            'body': traced_dumps({'error': 'Method not allowed'})
         }
     
     try:
@@ -43,16 +279,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             meeting_time_end = meeting_time
         city = body.get('city', 'Москва')
         offices = body.get('offices', [])
+        office_ids = body.get('office_ids')
         
         if not offer_id or not user_id or not offer_type or not amount or not rate or not meeting_time:
             return {
                 'statusCode': 400,
                 'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Missing required fields'})
+                'body': traced_dumps({'error': 'Missing required fields'})
             }
         
         dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
+        conn = traced_connect(dsn)
         cur = conn.cursor()
         
         # Check if user owns this offer
@@ -65,7 +302,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 404,
                 'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Offer not found'})
+                'body': traced_dumps({'error': 'Offer not found'})
             }
         
         if result[0] != user_id:
@@ -74,25 +311,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 403,
                 'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Not authorized to edit this offer'})
+                'body': traced_dumps({'error': 'Not authorized to edit this offer'})
             }
         
-        # Escape strings for SQL
-        city_escaped = city.replace("'", "''")
-        offices_array = "{" + ",".join([f'"{o.replace(chr(34), chr(34)+chr(34))}"' for o in offices]) + "}"
+        office_ids, offices = resolve_offices(cur, city, offices, office_ids)
         
-        cur.execute(f'''
+        cur.execute('''
             UPDATE offers 
-            SET offer_type = '{offer_type}', 
-                amount = {amount}, 
-                rate = {rate}, 
-                meeting_time = '{meeting_time}',
-                time_start = '{meeting_time}',
-                time_end = '{meeting_time_end}',
-                city = '{city_escaped}',
-                offices = '{offices_array}'
-            WHERE id = {offer_id}
-        ''')
+            SET offer_type = %s, 
+                amount = %s, 
+                rate = %s, 
+                meeting_time = %s,
+                time_start = %s,
+                time_end = %s,
+                city = %s,
+                offices = %s,
+                office_ids = %s,
+                updated_at = NOW()
+            WHERE id = %s
+        ''', (offer_type, amount, rate, meeting_time, meeting_time, meeting_time_end, city, offices, office_ids, offer_id))
+        cur.execute("UPDATE cache_versions SET version = version + 1, updated_at = NOW() WHERE name = 'offers'")
         
         conn.commit()
         cur.close()
@@ -101,7 +339,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return {
             'statusCode': 200,
             'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'success': True, 'message': 'Offer updated successfully'})
+            'body': traced_dumps({'success': True, 'message': 'Offer updated successfully'})
         }
     
     except Exception as e:
@@ -111,5 +349,5 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return {
             'statusCode': 500,
             'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e), 'details': error_details})
+            'body': traced_dumps({'error': str(e), 'details': error_details})
         }
\ No newline at end of file
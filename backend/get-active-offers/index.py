@@ -1,13 +1,656 @@
+import base64
+import bisect
+import cProfile
+import functools
+import gzip
+import hashlib
+import hmac
 import json
 import os
+import random
+import time as clock
 import psycopg2
-from typing import Dict, Any
+import urllib.request
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from time import perf_counter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Ответы короче порога отдаются как есть: выигрыш меньше затрат на сжатие
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+# Сжатые варианты закэшированных ответов: ключ (ETag, кодировка)
+_compressed_bodies: Dict[Tuple[str, str], str] = {}
+
+MOSCOW_TZ = timezone(timedelta(hours=3))
+SLOT_MINUTES = 15
+# День офиса - 96 бит: бит i соответствует слоту, начинающемуся в i * 15 минут
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+SLOT_LABELS = [f"{i * SLOT_MINUTES // 60:02d}:{i * SLOT_MINUTES % 60:02d}" for i in range(SLOTS_PER_DAY)]
+MAX_CALENDAR_DAYS = 14
+
+# Кэш готовых ответов в памяти тёплого инстанса; RESPONSE_CACHE_SHARED=1 добавляет
+# общий уровень в UNLOGGED-таблице response_cache
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '30'))
+RESPONSE_CACHE_SHARED = os.environ.get('RESPONSE_CACHE_SHARED') == '1'
+RESPONSE_CACHE_MAX_ENTRIES = 256
+_response_cache: Dict[str, Tuple[str, float, str, str]] = {}
+
+# Поля ответа и их SQL-выражения: строки превращаются в dict через zip без поштучных
+# преобразований, а fields= сужает и SELECT, и ключи ответа
+OFFER_COLUMNS = {
+    'id': 'o.id',
+    'user_id': 'o.user_id',
+    'offer_type': 'o.offer_type',
+    'amount': 'o.amount::float8',
+    'rate': 'o.rate::float8',
+    'meeting_time': 'COALESCE(o.time_start::text, o.meeting_time)',
+    'meeting_time_end': 'o.time_end::text',
+    'created_at': 'o.created_at',
+    'username': """CASE
+                   WHEN o.is_anonymous THEN COALESCE(NULLIF(o.anonymous_name, ''), 'Аноним')
+                   WHEN u.first_name <> '' AND u.last_name <> '' THEN u.first_name || ' ' || u.last_name
+                   ELSE COALESCE(NULLIF(u.first_name, ''), NULLIF(u.username, ''), 'Пользователь')
+               END""",
+    'phone': "CASE WHEN o.is_anonymous THEN COALESCE(o.anonymous_phone, '') ELSE COALESCE(u.phone, '') END",
+    'is_anonymous': 'COALESCE(o.is_anonymous, false)',
+    'deals_count': 'CASE WHEN o.is_anonymous THEN 0 ELSE COALESCE(u.completed_deals, 0) END',
+    'city': 'o.city',
+    'offices': "COALESCE(o.offices, '{}')",
+    'office_ids': "COALESCE(o.office_ids, '{}')",
+    'time_start': "to_char(o.time_start, 'HH24:MI')",
+    'time_end': "to_char(o.time_end, 'HH24:MI')",
+    'valid_from': 'o.valid_from',
+    'valid_until': 'o.valid_until'
+}
+USER_FIELDS = {'username', 'phone', 'deals_count'}
+SLOT_FIELDS = ('available_slots', 'available_days')
+# Исходные колонки для расчёта слотов, добавляются в конец SELECT только когда слоты нужны
+SLOT_SOURCE_COLUMNS = ('o.time_start', 'o.time_end', "COALESCE(o.office_ids, '{}')", 'o.valid_from', 'o.valid_until')
+
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    """Requested fields in declaration order, id always included; raises ValueError on unknown names"""
+    if not value:
+        return list(OFFER_COLUMNS) + list(SLOT_FIELDS)
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(OFFER_COLUMNS) - set(SLOT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add('id')
+    return [name for name in list(OFFER_COLUMNS) + list(SLOT_FIELDS) if name in requested]
+
+
+def json_default(value: Any) -> Any:
+    """Encode values that come straight from rows: Decimal, datetime, date and time"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def to_json(payload: Any) -> str:
+    """Serialize with orjson when it is installed, falling back to json with the same encoding rules"""
+    started = perf_counter()
+    try:
+        if orjson is not None:
+            return orjson.dumps(payload, default=json_default).decode()
+        return json.dumps(payload, default=json_default)
+    finally:
+        trace_add('serialize', started)
+
+
+def window_mask(time_start: time, time_end: time) -> int:
+    """Bitmap of slots starting inside [time_start, time_end), 00:00 as end means midnight"""
+    start = -(-(time_start.hour * 60 + time_start.minute) // SLOT_MINUTES)
+    end_minutes = (time_end.hour or 24) * 60 + time_end.minute
+    end = min(-(-end_minutes // SLOT_MINUTES), SLOTS_PER_DAY)
+    if end <= start:
+        # Окно без длительности - один слот в time_start
+        end = min(start + 1, SLOTS_PER_DAY)
+    return ((1 << end) - 1) ^ ((1 << start) - 1)
+
+
+def slots_after(seconds: int) -> int:
+    """Bitmap of slots that start strictly after the given second of the day"""
+    first = seconds // (SLOT_MINUTES * 60) + 1
+    return FULL_DAY & ~((1 << first) - 1)
+
+
+def mask_to_slots(mask: int) -> List[str]:
+    """Decode a day bitmap into sorted HH:MM slot labels"""
+    slots = []
+    while mask:
+        low = mask & -mask
+        slots.append(SLOT_LABELS[low.bit_length() - 1])
+        mask ^= low
+    return slots
+
+
+def build_busy_calendar(reservations: Iterable[Tuple[date, time, int]]) -> Dict[Tuple[int, date], int]:
+    """Fold (meeting_date, meeting_time, office_id) rows into busy bitmaps per office-day"""
+    busy: Dict[Tuple[int, date], int] = {}
+    for meeting_date, meeting_time, office_id in reservations:
+        if meeting_date is None or meeting_time is None:
+            continue
+        key = (office_id, meeting_date)
+        busy[key] = busy.get(key, 0) | (1 << ((meeting_time.hour * 60 + meeting_time.minute) // SLOT_MINUTES))
+    return busy
+
+
+def offer_days(valid_from: Optional[date], valid_until: Optional[date], first_day: date, last_day: date) -> List[date]:
+    """Days inside the requested horizon when the offer window applies"""
+    first, last = offer_validity(valid_from, valid_until, first_day)
+    start = max(first, first_day)
+    end = min(last, last_day)
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def compute_book_slots(entries: List[Tuple], busy: Dict[Tuple[int, date], int], today: date, last_day: date,
+                       today_mask: int) -> List[List[Tuple[date, List[str]]]]:
+    """Free slots per day for every offer in one pass, sharing masks between offers with equal windows and offices"""
+    days = [today + timedelta(days=i) for i in range((last_day - today).days + 1)]
+    day_index = {day: i for i, day in enumerate(days)}
+    
+    # Занятость офиса - список масок по дням горизонта
+    office_days: Dict[int, List[int]] = {}
+    for (office_id, day), mask in busy.items():
+        if day in day_index:
+            office_days.setdefault(office_id, [0] * len(days))[day_index[day]] = mask
+    
+    windows: Dict[Tuple[time, time], int] = {}
+    taken_by_offices: Dict[Tuple[int, ...], List[int]] = {}
+    ranges: Dict[Tuple[Optional[date], Optional[date]], range] = {}
+    labels: Dict[int, List[str]] = {}
+    result = []
+    for time_start, time_end, office_ids, valid_from, valid_until in entries:
+        offer_slots = []
+        if time_start and time_end:
+            window = windows.get((time_start, time_end))
+            if window is None:
+                window = windows[(time_start, time_end)] = window_mask(time_start, time_end)
+            
+            offices_key = tuple(office_ids)
+            taken = taken_by_offices.get(offices_key)
+            if taken is None:
+                taken = [0] * len(days)
+                for office_id in offices_key:
+                    if office_id in office_days:
+                        taken = [a | b for a, b in zip(taken, office_days[office_id])]
+                taken_by_offices[offices_key] = taken
+            
+            indexes = ranges.get((valid_from, valid_until))
+            if indexes is None:
+                active = offer_days(valid_from, valid_until, today, last_day)
+                indexes = range(day_index[active[0]], day_index[active[-1]] + 1) if active else range(0)
+                ranges[(valid_from, valid_until)] = indexes
+            
+            for i in indexes:
+                free = window & ~taken[i]
+                if i == 0:
+                    free &= today_mask
+                if not free:
+                    continue
+                slots = labels.get(free)
+                if slots is None:
+                    slots = labels[free] = mask_to_slots(free)
+                offer_slots.append((days[i], slots))
+        result.append(offer_slots)
+    return result
+
+
+def get_versions(cur) -> str:
+    """Current offers, reservations and users versions, bumped by every handler that writes them"""
+    cur.execute("SELECT name, version FROM cache_versions WHERE name IN ('offers', 'reservations', 'users') ORDER BY name")
+    return ','.join(f"{name}:{version}" for name, version in cur.fetchall())
+
+
+def make_etag(*parts: Any) -> str:
+    """Weak ETag from validator parts"""
+    return 'W/"' + hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    """True if If-None-Match of the request lists this ETag"""
+    headers = event.get('headers') or {}
+    header = headers.get('If-None-Match') or headers.get('if-none-match') or ''
+    return any(tag.strip() in (etag, etag[2:], '*') for tag in header.split(','))
+
+
+def accepted_encoding(event: Dict[str, Any]) -> Optional[str]:
+    """Best encoding the client accepts: br when brotli is installed, otherwise gzip"""
+    headers = event.get('headers') or {}
+    header = headers.get('Accept-Encoding') or headers.get('accept-encoding') or ''
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        params = params.strip().replace(' ', '')
+        try:
+            quality = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        if name.strip() and quality > 0:
+            accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_body(body: str, encoding: str) -> str:
+    """Compress the body and encode it as base64 for isBase64Encoded responses"""
+    data = body.encode()
+    packed = brotli.compress(data, quality=5) if encoding == 'br' else gzip.compress(data, compresslevel=6)
+    return base64.b64encode(packed).decode()
+
+
+def offers_response(event: Dict[str, Any], body: str, etag: str, cache_status: str) -> Dict[str, Any]:
+    """200 with the body (compressed if accepted), or 304 without it when the client already has this ETag"""
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': 'no-cache',
+        'ETag': etag,
+        'Vary': 'Accept-Encoding',
+        'X-Cache': cache_status
+    }
+    if etag_matches(event, etag):
+        return {'statusCode': 304, 'headers': headers, 'isBase64Encoded': False, 'body': ''}
+    headers['Content-Type'] = 'application/json'
+    
+    encoding = accepted_encoding(event)
+    if not encoding or len(body) < COMPRESS_MIN_BYTES:
+        return {'statusCode': 200, 'headers': headers, 'isBase64Encoded': False, 'body': body}
+    
+    packed = _compressed_bodies.get((etag, encoding))
+    if packed is None:
+        if len(_compressed_bodies) >= RESPONSE_CACHE_MAX_ENTRIES:
+            _compressed_bodies.pop(next(iter(_compressed_bodies)))
+        packed = _compressed_bodies[(etag, encoding)] = compress_body(body, encoding)
+    headers['Content-Encoding'] = encoding
+    return {'statusCode': 200, 'headers': headers, 'isBase64Encoded': True, 'body': packed}
+
+
+def cache_get(cur, key: str, versions: str, shared: bool = True) -> Optional[Tuple[str, str]]:
+    """Cached (body, etag) for the key if it was built from the same versions and has not expired;
+    shared=False skips response_cache, which is UNLOGGED and cannot be read on a hot standby"""
+    entry = _response_cache.get(key)
+    if entry and entry[0] == versions and entry[1] > clock.time():
+        return entry[2], entry[3]
+    if not RESPONSE_CACHE_SHARED or not shared:
+        return None
+    
+    cur.execute("""
+        SELECT body, EXTRACT(EPOCH FROM expires_at - NOW())
+        FROM response_cache
+        WHERE cache_key = %s AND versions = %s AND expires_at > NOW()
+    """, (key, versions))
+    row = cur.fetchone()
+    if not row:
+        return None
+    etag = make_etag(row[0])
+    _response_cache[key] = (versions, clock.time() + float(row[1]), row[0], etag)
+    return row[0], etag
+
+
+def cache_put(cur, key: str, versions: str, body: str, etag: str, ttl: float, shared: bool = True) -> None:
+    """Store the body in process and, if enabled and the connection can write, in the shared response_cache table"""
+    if ttl <= 0:
+        return
+    if len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+        _response_cache.pop(next(iter(_response_cache)))
+    _response_cache[key] = (versions, clock.time() + ttl, body, etag)
+    
+    if RESPONSE_CACHE_SHARED and shared:
+        cur.execute("""
+            INSERT INTO response_cache (cache_key, versions, body, expires_at)
+            VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+            ON CONFLICT (cache_key) DO UPDATE
+            SET versions = EXCLUDED.versions, body = EXCLUDED.body, expires_at = EXCLUDED.expires_at
+        """, (key, versions, body, ttl))
+
+
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'get-active-offers'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg2.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg2.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+# Чтение с реплики: DATABASE_REPLICA_URL, пока её отставание не больше REPLICA_MAX_LAG_SECONDS.
+# Клиент после своей записи присылает X-Last-Write-Age (мс); такой запрос идёт на основную базу,
+# пока реплика не применила всё, что было до этой записи
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = 1.0
+_replica_lag: Dict[str, float] = {}
+
+
+def write_age_seconds(event: Dict[str, Any]) -> Optional[float]:
+    """Seconds since the client's own last mutation, None when it did not send X-Last-Write-Age"""
+    headers = event.get('headers') or {}
+    value = headers.get('X-Last-Write-Age') or headers.get('x-last-write-age')
+    try:
+        return max(float(value), 0.0) / 1000 if value else None
+    except ValueError:
+        return None
+
+
+def replica_lag(conn: Any) -> float:
+    """Upper bound of the replica's replay lag in seconds, measured at most once per REPLICA_LAG_CHECK_SECONDS"""
+    now = perf_counter()
+    if not _replica_lag or now - _replica_lag['checked_at'] >= REPLICA_LAG_CHECK_SECONDS:
+        cur = conn.cursor()
+        # Реплика без новых WAL не отстаёт, даже если последняя транзакция была давно
+        cur.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 'Infinity')
+            END
+        """)
+        _replica_lag.update(lag=float(cur.fetchone()[0]), checked_at=now)
+        cur.close()
+    return _replica_lag['lag'] + (now - _replica_lag['checked_at'])
+
+
+def read_connection(event: Dict[str, Any], dsn: str) -> Tuple[Any, bool]:
+    """Connection for read-only work and whether it is the replica; falls back to the primary dsn"""
+    age = write_age_seconds(event)
+    if DATABASE_REPLICA_URL and (age is None or age >= READ_YOUR_WRITES_SECONDS):
+        try:
+            conn = traced_connect(DATABASE_REPLICA_URL)
+        except psycopg2.OperationalError as e:
+            print(f"Replica unavailable, reading from primary: {e}")
+        else:
+            lag = replica_lag(conn)
+            if lag <= REPLICA_MAX_LAG_SECONDS and (age is None or lag < age):
+                return conn, True
+            conn.close()
+    return traced_connect(dsn), False
+
+
+def offer_validity(valid_from: Optional[date], valid_until: Optional[date], today: date) -> Tuple[date, date]:
+    """First and last day the offer's daily window applies. NULL valid_from - already started,
+    NULL valid_until - today only: such an offer lives until EXPIRED_OFFERS or expires_at retires it"""
+    return valid_from or today, valid_until or today
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+# Профилирование отдельных запросов: выборка PROFILE_SAMPLE_RATE (не больше PROFILE_MAX_RATE)
+# или заголовок X-Profile-Token, совпадающий с PROFILE_TOKEN. Результат - .prof-файлы cProfile
+PROFILE_MAX_RATE = 0.01
+PROFILE_SAMPLE_RATE = min(float(os.environ.get('PROFILE_SAMPLE_RATE', '0')), PROFILE_MAX_RATE)
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+# Предел файлов на инстанс, чтобы не заполнить /tmp
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '50'))
+_profiles_written = 0
+
+
+def profile_requested(event: Dict[str, Any]) -> bool:
+    """Sampled share of requests, or an explicit request carrying the profiling token"""
+    if _profiles_written >= PROFILE_MAX_FILES:
+        return False
+    if PROFILE_TOKEN:
+        headers = event.get('headers') or {}
+        token = headers.get('X-Profile-Token') or headers.get('x-profile-token') or ''
+        if token and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()):
+            return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def profiled(handler_func):
+    """Handler decorator: run selected requests under cProfile and dump stats to PROFILE_DIR"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        global _profiles_written
+        if not profile_requested(event):
+            return handler_func(event, context)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Уже работает другой профилировщик (например, локальный запуск под cProfile)
+            return handler_func(event, context)
+        started = perf_counter()
+        try:
+            return handler_func(event, context)
+        finally:
+            profiler.disable()
+            elapsed_ms = (perf_counter() - started) * 1000
+            request_id = getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId')
+            path = os.path.join(PROFILE_DIR, f"{TRACE_FUNCTION}-{int(clock.time())}-{request_id or uuid.uuid4().hex[:8]}.prof")
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                profiler.dump_stats(path)
+                _profiles_written += 1
+                print(json.dumps({'profile': TRACE_FUNCTION, 'request_id': request_id, 'path': path,
+                                  'total_ms': round(elapsed_ms, 2)}))
+            except OSError as e:
+                print(f"Profile dump failed: {e}")
+    return wrapper
+
+
+# Объявления, у которых истёк срок или время на сегодня
+EXPIRED_OFFERS = """
+    status = 'active'
+    AND (
+        valid_until < CURRENT_DATE
+        OR (COALESCE(valid_until, CURRENT_DATE) <= CURRENT_DATE
+            AND time_end IS NOT NULL
+            AND time_end < CURRENT_TIME)
+    )
+"""
+
+
+def has_expired_offers(cur) -> bool:
+    """Whether the expiry UPDATE has anything to do; lets a replica request skip the primary"""
+    cur.execute(f"SELECT EXISTS (SELECT 1 FROM offers WHERE {EXPIRED_OFFERS})")
+    return cur.fetchone()[0]
+
+
+@traced
+@profiled
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Get all active offers with available time slots
-    Args: event with queryStringParameters (optional offer_type filter, offer_id for single offer); context with request_id
-    Returns: JSON list of active offers with user info and available time slots
+    Args: event with queryStringParameters (optional offer_type, city, office_id filters, offer_id for single offer, days horizon up to 14,
+          fields - comma separated response fields); context with request_id
+    Returns: JSON list of active offers with user info, today's available slots and per-day slots for the horizon
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -17,7 +660,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, X-Profile-Token, X-Last-Write-Age',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -27,21 +670,80 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     offer_type = params.get('offer_type')
     city = params.get('city')
     single_offer_id = params.get('offer_id')
+    office_id = params.get('office_id')
+    
+    try:
+        calendar_days = min(max(int(params.get('days') or 1), 1), MAX_CALENDAR_DAYS)
+    except ValueError:
+        calendar_days = 1
+    
+    # Идентификаторы подставляются в запрос, поэтому проверяем их до подключения к БД
+    try:
+        office_id = int(office_id) if office_id else None
+        single_offer_id = int(single_offer_id) if single_offer_id else None
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': traced_dumps({'success': False, 'error': 'office_id and offer_id must be integers'})
+        }
+    
+    try:
+        fields = parse_fields(params.get('fields'))
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': traced_dumps({'success': False, 'error': str(e)})
+        }
+    columns = [name for name in fields if name in OFFER_COLUMNS]
+    with_slots = any(name in SLOT_FIELDS for name in fields)
+    
+    now = datetime.now(MOSCOW_TZ)
+    today = now.date()
+    last_day = today + timedelta(days=calendar_days - 1)
+    today_mask = slots_after(now.hour * 3600 + now.minute * 60 + now.second)
+    
+    # Ответ меняется только на границе 15-минутного слота, поэтому слот входит в ключ
+    key = json.dumps([
+        offer_type or None, city or None, single_offer_id or None, office_id or None, calendar_days,
+        fields, today.isoformat(), (now.hour * 60 + now.minute) // SLOT_MINUTES
+    ], ensure_ascii=False)
     
     dsn = os.environ.get('DATABASE_URL')
     
-    conn = psycopg2.connect(dsn)
+    conn, on_replica = read_connection(event, dsn)
     cur = conn.cursor()
     
-    # Автоматически деактивируем объявления, у которых истекло время
-    cur.execute("""
-        UPDATE offers
-        SET status = 'inactive'
-        WHERE status = 'active' 
-        AND time_end IS NOT NULL 
-        AND time_end < CURRENT_TIME
-    """)
-    conn.commit()
+    versions = get_versions(cur)
+    cached = cache_get(cur, key, versions, shared=not on_replica)
+    if cached is not None:
+        cur.close()
+        conn.close()
+        return offers_response(event, cached[0], cached[1], 'HIT')
+    
+    # Автоматически деактивируем объявления, у которых истекло время. Это запись, поэтому
+    # запрос с реплики переходит на основную базу, только если такие объявления есть
+    if on_replica and has_expired_offers(cur):
+        cur.close()
+        conn.close()
+        conn, on_replica = traced_connect(dsn), False
+        cur = conn.cursor()
+        versions = get_versions(cur)
+    if not on_replica:
+        cur.execute(f"""
+            UPDATE offers
+            SET status = 'inactive', updated_at = NOW()
+            WHERE {EXPIRED_OFFERS}
+        """)
+        expired_count = cur.rowcount
+        if expired_count > 0:
+            cur.execute("UPDATE cache_versions SET version = version + 1, updated_at = NOW() WHERE name = 'offers'")
+        conn.commit()
+        if expired_count > 0:
+            versions = get_versions(cur)
     
     where_conditions = ["o.status = 'active'"]
     
@@ -54,134 +756,67 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if city:
         where_conditions.append(f"o.city = '{city}'")
     
+    if office_id:
+        # Поиск по офису идёт через GIN-индекс idx_offers_office_ids
+        where_conditions.append(f"o.office_ids @> ARRAY[{office_id}]")
+    
     where_clause = " AND ".join(where_conditions)
     
+    select_list = [OFFER_COLUMNS[name] for name in columns] + (list(SLOT_SOURCE_COLUMNS) if with_slots else [])
+    users_join = 'LEFT JOIN users u ON o.user_id = u.id' if USER_FIELDS.intersection(columns) else ''
+    
     cur.execute(f"""
-        SELECT o.id, o.user_id, o.offer_type, o.amount, o.rate, o.meeting_time, o.created_at, 
-               u.username, u.phone, o.is_anonymous, o.anonymous_name, o.anonymous_phone, o.city, o.offices,
-               u.first_name, u.last_name, o.time_start, o.time_end
+        SELECT {', '.join(select_list)}
         FROM offers o 
-        LEFT JOIN users u ON o.user_id = u.id 
+        {users_join}
         WHERE {where_clause}
         ORDER BY o.created_at DESC
     """)
     
     rows = cur.fetchall()
     
-    offers = []
-    for row in rows:
-        offer_id = row[0]
-        is_anonymous = row[9] if len(row) > 9 and row[9] else False
-        
-        first_name = row[14] if len(row) > 14 else None
-        last_name = row[15] if len(row) > 15 else None
-        time_start = row[16] if len(row) > 16 else None
-        time_end = row[17] if len(row) > 17 else None
-        
-        if is_anonymous:
-            username = row[10] if row[10] else 'Аноним'
-            phone = row[11] if row[11] else ''
-        else:
-            if first_name and last_name:
-                username = f"{first_name} {last_name}"
-            elif first_name:
-                username = first_name
-            else:
-                username = row[7] if row[7] else 'Пользователь'
-            phone = row[8] if row[8] else ''
-        
-        # Генерируем временные слоты из диапазона time_start - time_end
-        from datetime import datetime, timezone, timedelta, time as dt_time
-        moscow_tz = timezone(timedelta(hours=3))
-        current_time = datetime.now(moscow_tz).time()
+    ttl = RESPONSE_CACHE_TTL
+    book_slots = [[] for _ in rows]
+    if with_slots:
+        slot_sources = [row[len(columns):] for row in rows]
         
-        city = row[12] if len(row) > 12 else 'Москва'
-        offices = row[13] if len(row) > 13 and row[13] else []
+        # Бронирования всех офисов из выдачи за горизонт календаря - одним запросом
+        all_office_ids = sorted({oid for source in slot_sources for oid in source[2]})
+        busy = {}
+        if all_office_ids:
+            cur.execute("""
+                SELECT r.meeting_date, r.meeting_time, r.meeting_office_id,
+                       EXTRACT(EPOCH FROM r.expires_at - NOW())
+                FROM reservations r
+                WHERE r.meeting_office_id = ANY(%s)
+                AND r.meeting_date BETWEEN %s AND %s
+                AND r.status IN ('pending', 'confirmed')
+                AND r.expires_at > NOW()
+            """, (all_office_ids, today, last_day))
+            reservation_rows = cur.fetchall()
+            busy = build_busy_calendar(res_row[:3] for res_row in reservation_rows)
+            # Бронь освобождает слот по expires_at без записи в БД - кэш живёт не дольше
+            if reservation_rows:
+                ttl = min(ttl, min(float(res_row[3]) for res_row in reservation_rows))
         
-        # Получаем все забронированные слоты в этом городе и офисах с подтверждённым статусом
-        reserved_slots = set()
-        if offices:
-            for office in offices:
-                cur.execute("""
-                    SELECT r.meeting_time, r.meeting_office
-                    FROM reservations r
-                    JOIN offers o ON r.offer_id = o.id
-                    WHERE o.city = %s 
-                    AND r.meeting_office = %s 
-                    AND r.status IN ('pending', 'confirmed')
-                    AND r.expires_at > NOW()
-                """, (city, office))
-                
-                for res_row in cur.fetchall():
-                    reserved_slots.add(f"{res_row[0]}|{res_row[1]}")
-        
-        # Генерируем слоты с интервалом 15 минут
-        available_slots = []
-        if time_start and time_end:
-            start_hour = time_start.hour
-            start_minute = time_start.minute
-            end_hour = time_end.hour if time_end.hour > 0 else 24
-            end_minute = time_end.minute
-            
-            current_hour = start_hour
-            current_minute = start_minute
-            
-            while True:
-                slot_time = dt_time(current_hour % 24, current_minute)
-                
-                # Проверяем что слот в будущем
-                if slot_time > current_time:
-                    # Проверяем что слот не забронирован ни в одном офисе
-                    is_available = True
-                    for office in offices:
-                        if f"{slot_time.strftime('%H:%M')}|{office}" in reserved_slots:
-                            is_available = False
-                            break
-                    
-                    if is_available:
-                        available_slots.append(slot_time.strftime('%H:%M'))
-                
-                # Переходим к следующему слоту (+15 минут)
-                current_minute += 15
-                if current_minute >= 60:
-                    current_minute = 0
-                    current_hour += 1
-                
-                # Проверяем достигли ли конца
-                if current_hour > end_hour or (current_hour == end_hour and current_minute >= end_minute):
-                    break
-                if current_hour >= 24:
-                    break
-        
-        offers.append({
-            'id': offer_id,
-            'user_id': row[1],
-            'offer_type': row[2],
-            'amount': float(row[3]),
-            'rate': float(row[4]),
-            'meeting_time': str(time_start) if time_start else row[5],
-            'meeting_time_end': str(time_end) if time_end else None,
-            'created_at': row[6].isoformat() if row[6] else None,
-            'username': username,
-            'phone': phone,
-            'is_anonymous': is_anonymous,
-            'deals_count': 0,
-            'city': row[12] if len(row) > 12 else 'Москва',
-            'offices': row[13] if len(row) > 13 and row[13] else [],
-            'time_start': time_start.strftime('%H:%M') if time_start else None,
-            'time_end': time_end.strftime('%H:%M') if time_end else None,
-            'available_slots': available_slots
-        })
+        # Слоты всех объявлений считаются одним проходом до сборки ответа
+        book_slots = compute_book_slots(slot_sources, busy, today, last_day, today_mask)
+    
+    offers = []
+    for row, slot_days in zip(rows, book_slots):
+        offer = dict(zip(columns, row))
+        if 'available_slots' in fields:
+            offer['available_slots'] = slot_days[0][1] if slot_days and slot_days[0][0] == today else []
+        if 'available_days' in fields:
+            offer['available_days'] = [{'date': day, 'slots': slots} for day, slots in slot_days]
+        offers.append(offer)
     
+    body = to_json({'success': True, 'offers': offers})
+    # ETag по содержимому: совпадает у всех инстансов, даже без общего кэша
+    etag = make_etag(body)
+    cache_put(cur, key, versions, body, etag, ttl, shared=not on_replica)
+    conn.commit()
     cur.close()
     conn.close()
     
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'isBase64Encoded': False,
-        'body': json.dumps({'success': True, 'offers': offers})
-    }
\ No newline at end of file
+    return offers_response(event, body, etag, 'MISS')
\ No newline at end of file
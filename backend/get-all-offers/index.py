@@ -1,12 +1,400 @@
+import base64
+import bisect
+import functools
+import gzip
+import hashlib
 import json
 import os
 import psycopg2
-from typing import Dict, Any
+import urllib.request
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, Any, List, Optional, Tuple
+from time import perf_counter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Ответы короче порога отдаются как есть: выигрыш меньше затрат на сжатие
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+# Поля ответа и их SQL-выражения; fields= сужает и SELECT, и ключи ответа
+OFFER_COLUMNS = {
+    'id': 'o.id',
+    'offer_type': 'o.offer_type',
+    'amount': 'o.amount::float8',
+    'rate': 'o.rate::float8',
+    'meeting_time': 'COALESCE(o.time_start::text, o.meeting_time)',
+    'meeting_time_end': 'o.time_end::text',
+    'status': 'o.status',
+    'created_at': 'o.created_at',
+    'username': 'u.username',
+    'phone': 'u.phone',
+    'city': 'o.city',
+    'offices': "COALESCE(o.offices, '{}')",
+    'email': 'u.email',
+    'user_id': 'o.user_id'
+}
+
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    """Requested fields in declaration order, id always included; raises ValueError on unknown names"""
+    known = list(OFFER_COLUMNS) + ['reservations']
+    if not value:
+        return known
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(known)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add('id')
+    return [name for name in known if name in requested]
+
+
+def json_default(value: Any) -> Any:
+    """Encode values that come straight from rows: Decimal, datetime, date and time"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def to_json(payload: Any) -> str:
+    """Serialize with orjson when it is installed, falling back to json with the same encoding rules"""
+    started = perf_counter()
+    try:
+        if orjson is not None:
+            return orjson.dumps(payload, default=json_default).decode()
+        return json.dumps(payload, default=json_default)
+    finally:
+        trace_add('serialize', started)
+
+
+def accepted_encoding(event: Dict[str, Any]) -> Optional[str]:
+    """Best encoding the client accepts: br when brotli is installed, otherwise gzip"""
+    headers = event.get('headers') or {}
+    header = headers.get('Accept-Encoding') or headers.get('accept-encoding') or ''
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        params = params.strip().replace(' ', '')
+        try:
+            quality = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        if name.strip() and quality > 0:
+            accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_body(body: str, encoding: str) -> str:
+    """Compress the body and encode it as base64 for isBase64Encoded responses"""
+    data = body.encode()
+    packed = brotli.compress(data, quality=5) if encoding == 'br' else gzip.compress(data, compresslevel=6)
+    return base64.b64encode(packed).decode()
+
+
+def compressed_response(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    """Compress a 200 response body when the client accepts it and it is larger than COMPRESS_MIN_BYTES"""
+    response['headers']['Vary'] = 'Accept-Encoding'
+    encoding = accepted_encoding(event)
+    body = response.get('body') or ''
+    if response['statusCode'] != 200 or not encoding or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response['headers']['Content-Encoding'] = encoding
+    response['body'] = compress_body(body, encoding)
+    response['isBase64Encoded'] = True
+    return response
+
+
+def make_etag(*parts: Any) -> str:
+    """Weak ETag from validator parts"""
+    return 'W/"' + hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    """True if If-None-Match of the request lists this ETag"""
+    headers = event.get('headers') or {}
+    header = headers.get('If-None-Match') or headers.get('if-none-match') or ''
+    return any(tag.strip() in (etag, etag[2:], '*') for tag in header.split(','))
+
+
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'get-all-offers'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg2.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg2.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+# Чтение с реплики: DATABASE_REPLICA_URL, пока её отставание не больше REPLICA_MAX_LAG_SECONDS.
+# Клиент после своей записи присылает X-Last-Write-Age (мс); такой запрос идёт на основную базу,
+# пока реплика не применила всё, что было до этой записи
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = 1.0
+_replica_lag: Dict[str, float] = {}
+
+
+def write_age_seconds(event: Dict[str, Any]) -> Optional[float]:
+    """Seconds since the client's own last mutation, None when it did not send X-Last-Write-Age"""
+    headers = event.get('headers') or {}
+    value = headers.get('X-Last-Write-Age') or headers.get('x-last-write-age')
+    try:
+        return max(float(value), 0.0) / 1000 if value else None
+    except ValueError:
+        return None
+
+
+def replica_lag(conn: Any) -> float:
+    """Upper bound of the replica's replay lag in seconds, measured at most once per REPLICA_LAG_CHECK_SECONDS"""
+    now = perf_counter()
+    if not _replica_lag or now - _replica_lag['checked_at'] >= REPLICA_LAG_CHECK_SECONDS:
+        cur = conn.cursor()
+        # Реплика без новых WAL не отстаёт, даже если последняя транзакция была давно
+        cur.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 'Infinity')
+            END
+        """)
+        _replica_lag.update(lag=float(cur.fetchone()[0]), checked_at=now)
+        cur.close()
+    return _replica_lag['lag'] + (now - _replica_lag['checked_at'])
+
+
+def read_connection(event: Dict[str, Any], dsn: str) -> Tuple[Any, bool]:
+    """Connection for read-only work and whether it is the replica; falls back to the primary dsn"""
+    age = write_age_seconds(event)
+    if DATABASE_REPLICA_URL and (age is None or age >= READ_YOUR_WRITES_SECONDS):
+        try:
+            conn = traced_connect(DATABASE_REPLICA_URL)
+        except psycopg2.OperationalError as e:
+            print(f"Replica unavailable, reading from primary: {e}")
+        else:
+            lag = replica_lag(conn)
+            if lag <= REPLICA_MAX_LAG_SECONDS and (age is None or lag < age):
+                return conn, True
+            conn.close()
+    return traced_connect(dsn), False
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+# Объявления, у которых истёк срок или время на сегодня
+EXPIRED_OFFERS = """
+    status = 'active'
+    AND (
+        valid_until < CURRENT_DATE
+        OR (COALESCE(valid_until, CURRENT_DATE) <= CURRENT_DATE
+            AND time_end IS NOT NULL
+            AND time_end < CURRENT_TIME)
+    )
+"""
+
+
+def has_expired_offers(cur) -> bool:
+    """Whether the expiry UPDATE has anything to do; lets a replica request skip the primary"""
+    cur.execute(f"SELECT EXISTS (SELECT 1 FROM offers WHERE {EXPIRED_OFFERS})")
+    return cur.fetchone()[0]
+
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Get all offers including inactive for admin panel
-    Args: event with httpMethod; context with request_id
+    Args: event with httpMethod, optional queryStringParameters.fields (comma separated response fields); context with request_id
     Returns: JSON list of all offers with user info
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -17,71 +405,96 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, X-Last-Write-Age',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
     if method == 'GET':
+        try:
+            fields = parse_fields((event.get('queryStringParameters') or {}).get('fields'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': traced_dumps({'success': False, 'error': str(e)})
+            }
+        columns = [name for name in fields if name in OFFER_COLUMNS]
+        
         dsn = os.environ.get('DATABASE_URL')
         
-        conn = psycopg2.connect(dsn)
+        conn, on_replica = read_connection(event, dsn)
         cur = conn.cursor()
         
-        # Автоматически деактивируем объявления, у которых истекло время
-        cur.execute("""
-            UPDATE offers
-            SET status = 'inactive'
-            WHERE status = 'active' 
-            AND time_end IS NOT NULL 
-            AND time_end < CURRENT_TIME
-        """)
-        conn.commit()
+        # Валидатор: версии объявлений и пользователей плюс 15-минутный слот,
+        # на границе которого истекают объявления
+        now = datetime.now(timezone(timedelta(hours=3)))
+        slot_bucket = f"{now.date()}:{(now.hour * 60 + now.minute) // 15}"
+        cur.execute("SELECT string_agg(name || ':' || version, ',' ORDER BY name) FROM cache_versions WHERE name IN ('offers', 'users')")
+        etag = make_etag('all-offers', cur.fetchone()[0], slot_bucket, fields)
+        etag_headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        }
+        if etag_matches(event, etag):
+            cur.close()
+            conn.close()
+            return {'statusCode': 304, 'headers': etag_headers, 'isBase64Encoded': False, 'body': ''}
+        
+        # Автоматически деактивируем объявления, у которых истекло время. Это запись, поэтому
+        # запрос с реплики переходит на основную базу, только если такие объявления есть
+        switched = False
+        if on_replica and has_expired_offers(cur):
+            cur.close()
+            conn.close()
+            conn, on_replica, switched = traced_connect(dsn), False, True
+            cur = conn.cursor()
+        if not on_replica:
+            cur.execute(f"""
+                UPDATE offers
+                SET status = 'inactive', updated_at = NOW()
+                WHERE {EXPIRED_OFFERS}
+            """)
+            expired_count = cur.rowcount
+            if expired_count > 0:
+                cur.execute("UPDATE cache_versions SET version = version + 1, updated_at = NOW() WHERE name = 'offers'")
+            conn.commit()
+            if expired_count > 0 or switched:
+                cur.execute("SELECT string_agg(name || ':' || version, ',' ORDER BY name) FROM cache_versions WHERE name IN ('offers', 'users')")
+                etag = make_etag('all-offers', cur.fetchone()[0], slot_bucket, fields)
+                etag_headers['ETag'] = etag
         
-        cur.execute(
-            "SELECT o.id, o.offer_type, o.amount, o.rate, o.meeting_time, o.time_start, o.time_end, o.status, o.created_at, u.username, u.phone, o.city, o.offices, u.email, o.user_id FROM offers o JOIN users u ON o.user_id = u.id ORDER BY o.created_at DESC"
-        )
+        cur.execute(f"""
+            SELECT {', '.join(OFFER_COLUMNS[name] for name in columns)}
+            FROM offers o
+            JOIN users u ON o.user_id = u.id
+            ORDER BY o.created_at DESC
+        """)
         
         rows = cur.fetchall()
         
-        offers = []
-        for row in rows:
-            offer_id = row[0]
-            offers.append({
-                'id': offer_id,
-                'offer_type': row[1],
-                'amount': float(row[2]),
-                'rate': float(row[3]),
-                'meeting_time': str(row[5]) if row[5] else row[4],
-                'meeting_time_end': str(row[6]) if row[6] else None,
-                'status': row[7],
-                'created_at': row[8].isoformat() if row[8] else None,
-                'username': row[9],
-                'phone': row[10],
-                'city': row[11],
-                'offices': row[12] if row[12] else [],
-                'email': row[13],
-                'user_id': row[14],
-                'reservations': []
-            })
+        offers = [dict(zip(columns, row)) for row in rows]
+        if 'reservations' in fields:
+            for offer in offers:
+                offer['reservations'] = []
         
         cur.close()
         conn.close()
         
-        return {
+        return compressed_response(event, {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
+            'headers': {**etag_headers, 'Content-Type': 'application/json'},
             'isBase64Encoded': False,
-            'body': json.dumps({'success': True, 'offers': offers})
-        }
+            'body': to_json({'success': True, 'offers': offers})
+        })
     
     return {
         'statusCode': 405,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
         'isBase64Encoded': False,
-        'body': json.dumps({'success': False, 'error': 'Method not allowed'})
+        'body': traced_dumps({'success': False, 'error': 'Method not allowed'})
     }
\ No newline at end of file
@@ -1,13 +1,359 @@
+import base64
+import bisect
+import functools
+import gzip
 import json
 import os
 import psycopg2
-from typing import Dict, Any
+import urllib.request
+import uuid
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from time import perf_counter
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Ответы короче порога отдаются как есть: выигрыш меньше затрат на сжатие
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+# Постраничная выдача по (created_at, id): limit по умолчанию и верхняя граница
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 500
+
+# Агрегаты строки: сделки и объявления из счётчиков users (rebuild-user-counters)
+STATS_COLUMNS = """,
+    u.completed_deals, u.completed_volume::float8, u.offers_count"""
+
+# Ключ сортировки страниц: created_at может быть NULL, такие пользователи идут последними
+SORT_KEY = "COALESCE(u.created_at, 'epoch'::timestamp)"
+
+
+def encode_cursor(created_at: datetime, user_id: int) -> str:
+    """Opaque next-page cursor from the last row's (created_at, id)"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{user_id}".encode()).decode()
+
+
+def decode_cursor(value: str) -> Tuple[datetime, int]:
+    """(created_at, id) from a cursor; raises ValueError if it was not produced by encode_cursor"""
+    created_at, _, user_id = base64.urlsafe_b64decode(value.encode()).decode().partition('|')
+    return datetime.fromisoformat(created_at), int(user_id)
+
+
+def parse_page(params: Dict[str, Any]) -> Tuple[Optional[int], Optional[Tuple[datetime, int]]]:
+    """Page size and decoded cursor; limit is None when the client did not ask for pagination"""
+    if not params.get('limit') and not params.get('cursor'):
+        return None, None
+    limit = int(params.get('limit') or PAGE_DEFAULT_LIMIT)
+    if not 1 <= limit <= PAGE_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {PAGE_MAX_LIMIT}')
+    try:
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    return limit, cursor
+
+
+def search_condition(query: str) -> Tuple[str, List[Any]]:
+    """Prefix match on name, email or phone; each branch is served by a text_pattern_ops index"""
+    prefix = query.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return (
+        '(lower(u.name) LIKE %s OR lower(u.email) LIKE %s OR u.phone LIKE %s)',
+        [prefix.lower(), prefix.lower(), prefix]
+    )
+
+
+def accepted_encoding(event: Dict[str, Any]) -> Optional[str]:
+    """Best encoding the client accepts: br when brotli is installed, otherwise gzip"""
+    headers = event.get('headers') or {}
+    header = headers.get('Accept-Encoding') or headers.get('accept-encoding') or ''
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        params = params.strip().replace(' ', '')
+        try:
+            quality = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        if name.strip() and quality > 0:
+            accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_body(body: str, encoding: str) -> str:
+    """Compress the body and encode it as base64 for isBase64Encoded responses"""
+    data = body.encode()
+    packed = brotli.compress(data, quality=5) if encoding == 'br' else gzip.compress(data, compresslevel=6)
+    return base64.b64encode(packed).decode()
+
+
+def compressed_response(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    """Compress a 200 response body when the client accepts it and it is larger than COMPRESS_MIN_BYTES"""
+    response['headers']['Vary'] = 'Accept-Encoding'
+    encoding = accepted_encoding(event)
+    body = response.get('body') or ''
+    if response['statusCode'] != 200 or not encoding or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response['headers']['Content-Encoding'] = encoding
+    response['body'] = compress_body(body, encoding)
+    response['isBase64Encoded'] = True
+    return response
+
+
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'get-all-users'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg2.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg2.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+# Чтение с реплики: DATABASE_REPLICA_URL, пока её отставание не больше REPLICA_MAX_LAG_SECONDS.
+# Клиент после своей записи присылает X-Last-Write-Age (мс); такой запрос идёт на основную базу,
+# пока реплика не применила всё, что было до этой записи
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = 1.0
+_replica_lag: Dict[str, float] = {}
+
+
+def write_age_seconds(event: Dict[str, Any]) -> Optional[float]:
+    """Seconds since the client's own last mutation, None when it did not send X-Last-Write-Age"""
+    headers = event.get('headers') or {}
+    value = headers.get('X-Last-Write-Age') or headers.get('x-last-write-age')
+    try:
+        return max(float(value), 0.0) / 1000 if value else None
+    except ValueError:
+        return None
+
+
+def replica_lag(conn: Any) -> float:
+    """Upper bound of the replica's replay lag in seconds, measured at most once per REPLICA_LAG_CHECK_SECONDS"""
+    now = perf_counter()
+    if not _replica_lag or now - _replica_lag['checked_at'] >= REPLICA_LAG_CHECK_SECONDS:
+        cur = conn.cursor()
+        # Реплика без новых WAL не отстаёт, даже если последняя транзакция была давно
+        cur.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 'Infinity')
+            END
+        """)
+        _replica_lag.update(lag=float(cur.fetchone()[0]), checked_at=now)
+        cur.close()
+    return _replica_lag['lag'] + (now - _replica_lag['checked_at'])
+
+
+def read_connection(event: Dict[str, Any], dsn: str) -> Tuple[Any, bool]:
+    """Connection for read-only work and whether it is the replica; falls back to the primary dsn"""
+    age = write_age_seconds(event)
+    if DATABASE_REPLICA_URL and (age is None or age >= READ_YOUR_WRITES_SECONDS):
+        try:
+            conn = traced_connect(DATABASE_REPLICA_URL)
+        except psycopg2.OperationalError as e:
+            print(f"Replica unavailable, reading from primary: {e}")
+        else:
+            lag = replica_lag(conn)
+            if lag <= REPLICA_MAX_LAG_SECONDS and (age is None or lag < age):
+                return conn, True
+            conn.close()
+    return traced_connect(dsn), False
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Get all registered users for admin panel
-    Args: event with httpMethod; context with request_id
-    Returns: JSON list of all users
+    Business: Get registered users for admin panel, optionally paginated and searched by prefix
+    Args: event with httpMethod, optional queryStringParameters: q (name, email or phone prefix),
+          limit/cursor for keyset pagination, with_stats=1 for deal and offer aggregates; context with request_id
+    Returns: JSON list of users (a page plus next_cursor when limit or cursor is given)
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -17,51 +363,95 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Last-Write-Age',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
     if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        try:
+            limit, page_cursor = parse_page(params)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': traced_dumps({'success': False, 'error': str(e)})
+            }
+        with_stats = params.get('with_stats') in ('1', 'true')
+        
+        conditions = []
+        values: List[Any] = []
+        if (params.get('q') or '').strip():
+            condition, search_values = search_condition(params['q'])
+            conditions.append(condition)
+            values.extend(search_values)
+        if page_cursor:
+            conditions.append(f'({SORT_KEY}, u.id) < (%s, %s)')
+            values.extend(page_cursor)
+        
         dsn = os.environ.get('DATABASE_URL')
         
-        conn = psycopg2.connect(dsn)
+        conn, _ = read_connection(event, dsn)
         cur = conn.cursor()
         
         cur.execute(
-            "SELECT id, name, email, phone, created_at, COALESCE(blocked, false) FROM users ORDER BY created_at DESC"
+            f"""
+            SELECT u.id, u.name, u.email, u.phone, u.created_at, COALESCE(u.blocked, false), {SORT_KEY}
+                   {STATS_COLUMNS if with_stats else ''}
+            FROM users u
+            {('WHERE ' + ' AND '.join(conditions)) if conditions else ''}
+            ORDER BY {SORT_KEY} DESC, u.id DESC
+            {'LIMIT %s' if limit else ''}
+            """,
+            values + ([limit + 1] if limit else [])
         )
         
         rows = cur.fetchall()
         
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][6], rows[-1][0])
+        
         users = []
         for row in rows:
-            users.append({
+            user = {
                 'id': row[0],
                 'name': row[1],
                 'email': row[2],
                 'phone': row[3],
                 'created_at': row[4].isoformat() if row[4] else None,
                 'blocked': row[5]
-            })
+            }
+            if with_stats:
+                user['deals_count'] = row[7]
+                user['deals_volume'] = row[8]
+                user['offers_count'] = row[9]
+            users.append(user)
         
         cur.close()
         conn.close()
         
-        return {
+        payload = {'success': True, 'users': users}
+        if limit:
+            payload['next_cursor'] = next_cursor
+        
+        return compressed_response(event, {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
             'isBase64Encoded': False,
-            'body': json.dumps({'success': True, 'users': users})
-        }
+            'body': traced_dumps(payload)
+        })
     
     return {
         'statusCode': 405,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
         'isBase64Encoded': False,
-        'body': json.dumps({'success': False, 'error': 'Method not allowed'})
+        'body': traced_dumps({'success': False, 'error': 'Method not allowed'})
     }
\ No newline at end of file
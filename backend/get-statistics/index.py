@@ -4,18 +4,47 @@ Args: event - HTTP event with queryStringParameters: period, user_id, start_date
       context - execution context with request_id
 Returns: HTTP response with statistics data
 '''
+import bisect
+import functools
+import hashlib
 import json
 import os
 from datetime import datetime, timedelta, timezone
 import psycopg2
-from typing import Dict, Any, Optional
+import urllib.request
+import uuid
+from typing import Dict, Any, Optional, Tuple
+from time import perf_counter
 
-def get_db_connection():
-    """Get database connection using environment variable"""
+def get_db_connection(event: Dict[str, Any]) -> Tuple[Any, bool]:
+    """Get a read connection (the replica when it is fresh enough) using environment variables"""
     dsn = os.environ.get('DATABASE_URL')
     if not dsn:
         raise ValueError('DATABASE_URL not found in environment')
-    return psycopg2.connect(dsn)
+    return read_connection(event, dsn)
+
+def make_etag(*parts: Any) -> str:
+    """Weak ETag from validator parts"""
+    return 'W/"' + hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:20] + '"'
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    """True if If-None-Match of the request lists this ETag"""
+    headers = event.get('headers') or {}
+    header = headers.get('If-None-Match') or headers.get('if-none-match') or ''
+    return any(tag.strip() in (etag, etag[2:], '*') for tag in header.split(','))
+
+def statistics_etag(conn, user_id: Optional[str], period_start: str, period_end: str) -> str:
+    """ETag from data versions, the period and the hour: cached rows are trusted for one hour"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT string_agg(name || ':' || version, ',' ORDER BY name)
+        FROM cache_versions
+        WHERE name IN ('offers', 'deals', 'users', 'statistics')
+    """)
+    versions = cursor.fetchone()[0]
+    cursor.close()
+    hour = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H')
+    return make_etag('statistics', user_id or 'global', period_start, period_end, versions, hour)
 
 def get_date_range(period: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> tuple:
     """Calculate date range based on period type"""
@@ -188,6 +217,248 @@ def get_global_statistics(conn, period_start: str, period_end: str) -> Dict[str,
         'sellVolume': float(deal_stats[6])
     }
 
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'get-statistics'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg2.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg2.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+# Чтение с реплики: DATABASE_REPLICA_URL, пока её отставание не больше REPLICA_MAX_LAG_SECONDS.
+# Клиент после своей записи присылает X-Last-Write-Age (мс); такой запрос идёт на основную базу,
+# пока реплика не применила всё, что было до этой записи
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = 1.0
+_replica_lag: Dict[str, float] = {}
+
+
+def write_age_seconds(event: Dict[str, Any]) -> Optional[float]:
+    """Seconds since the client's own last mutation, None when it did not send X-Last-Write-Age"""
+    headers = event.get('headers') or {}
+    value = headers.get('X-Last-Write-Age') or headers.get('x-last-write-age')
+    try:
+        return max(float(value), 0.0) / 1000 if value else None
+    except ValueError:
+        return None
+
+
+def replica_lag(conn: Any) -> float:
+    """Upper bound of the replica's replay lag in seconds, measured at most once per REPLICA_LAG_CHECK_SECONDS"""
+    now = perf_counter()
+    if not _replica_lag or now - _replica_lag['checked_at'] >= REPLICA_LAG_CHECK_SECONDS:
+        cur = conn.cursor()
+        # Реплика без новых WAL не отстаёт, даже если последняя транзакция была давно
+        cur.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 'Infinity')
+            END
+        """)
+        _replica_lag.update(lag=float(cur.fetchone()[0]), checked_at=now)
+        cur.close()
+    return _replica_lag['lag'] + (now - _replica_lag['checked_at'])
+
+
+def read_connection(event: Dict[str, Any], dsn: str) -> Tuple[Any, bool]:
+    """Connection for read-only work and whether it is the replica; falls back to the primary dsn"""
+    age = write_age_seconds(event)
+    if DATABASE_REPLICA_URL and (age is None or age >= READ_YOUR_WRITES_SECONDS):
+        try:
+            conn = traced_connect(DATABASE_REPLICA_URL)
+        except psycopg2.OperationalError as e:
+            print(f"Replica unavailable, reading from primary: {e}")
+        else:
+            lag = replica_lag(conn)
+            if lag <= REPLICA_MAX_LAG_SECONDS and (age is None or lag < age):
+                return conn, True
+            conn.close()
+    return traced_connect(dsn), False
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Main handler for getting statistics"""
     method = event.get('httpMethod', 'GET')
@@ -199,7 +470,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, If-None-Match, X-Last-Write-Age',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -211,11 +482,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     start_date = params.get('start_date')
     end_date = params.get('end_date')
     
-    conn = get_db_connection()
+    conn, _ = get_db_connection(event)
     
     try:
         period_start, period_end = get_date_range(period, start_date, end_date)
         
+        etag = statistics_etag(conn, user_id, period_start, period_end)
+        etag_headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        }
+        if etag_matches(event, etag):
+            return {'statusCode': 304, 'headers': etag_headers, 'body': ''}
+        
         if user_id:
             # Get user-specific statistics
             stats = get_user_statistics(conn, int(user_id), period_start, period_end)
@@ -225,11 +506,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         return {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
+            'headers': {**etag_headers, 'Content-Type': 'application/json'},
+            'body': traced_dumps({
                 'success': True,
                 'period': period,
                 'periodStart': period_start,
@@ -245,7 +523,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
+            'body': traced_dumps({
                 'success': False,
                 'error': str(e)
             })
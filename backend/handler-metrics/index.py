@@ -0,0 +1,315 @@
+import hmac
+import json
+import os
+import psycopg2
+from typing import Dict, Any, List, Optional, Tuple
+
+# Виды гистограмм, которые присылают обработчики: длительность запроса, время в БД за запрос,
+# отдельные исходящие HTTP-вызовы и открытие соединений с БД
+METRIC_KINDS = {
+    'request': ('handler_request_duration_seconds', 'Handler latency from the traced decorator'),
+    'db': ('handler_db_time_seconds', 'Total database time per request'),
+    'http': ('handler_http_call_duration_seconds', 'Outbound HTTP call latency (Telegram, Binance)'),
+    'connect': ('handler_db_connect_duration_seconds', 'Time to open a database connection')
+}
+MAX_BUCKETS = 64
+# Инстанс считается живым, если присылал метрики за это время
+LIVE_INSTANCE_SECONDS = 300
+RETENTION_DAYS = int(os.environ.get('METRICS_RETENTION_DAYS', '7'))
+# Строка функции, в которую складываются значения удалённых инстансов: без неё сумма по функции
+# падала бы при очистке, и Prometheus считал бы это сбросом счётчика
+RETIRED_INSTANCE = 'retired'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+
+
+def get_db_connection():
+    """Get database connection using environment variable"""
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise ValueError('DATABASE_URL not found in environment')
+    return psycopg2.connect(dsn)
+
+
+def json_response(status: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
+        'isBase64Encoded': False,
+        'body': json.dumps(payload)
+    }
+
+
+def authorized(event: Dict[str, Any]) -> bool:
+    """Without METRICS_TOKEN the endpoint is open; with it, X-Metrics-Token or a Bearer token must match"""
+    if not METRICS_TOKEN:
+        return True
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    token = headers.get('x-metrics-token') or ''
+    if not token and headers.get('authorization', '').startswith('Bearer '):
+        token = headers['authorization'][len('Bearer '):]
+    return hmac.compare_digest(token.encode(), METRICS_TOKEN.encode())
+
+
+def parse_push(body: Dict[str, Any]) -> Tuple[str, str, List[float], Dict[str, Dict[str, Any]]]:
+    """Validate a push from the traced decorator; raises ValueError with the reason"""
+    function = body.get('function')
+    instance = body.get('instance')
+    bounds = body.get('bounds')
+    series = body.get('series')
+    if not isinstance(function, str) or not function or len(function) > 100:
+        raise ValueError('function is required')
+    if not isinstance(instance, str) or not instance or len(instance) > 64:
+        raise ValueError('instance is required')
+    if instance == RETIRED_INSTANCE:
+        raise ValueError(f'instance {RETIRED_INSTANCE} is reserved')
+    if not isinstance(bounds, list) or not 0 < len(bounds) <= MAX_BUCKETS:
+        raise ValueError('bounds must be a non-empty list')
+    if any(not isinstance(bound, (int, float)) for bound in bounds) or bounds != sorted(bounds):
+        raise ValueError('bounds must be ascending numbers')
+    if not isinstance(series, dict):
+        raise ValueError('series must be an object')
+    for kind, values in series.items():
+        if kind not in METRIC_KINDS:
+            raise ValueError(f'Unknown kind {kind}')
+        buckets = values.get('buckets') if isinstance(values, dict) else None
+        if not isinstance(buckets, list) or len(buckets) != len(bounds) + 1:
+            raise ValueError(f'{kind}: buckets must have len(bounds) + 1 entries')
+        if any(not isinstance(count, int) or count < 0 for count in buckets):
+            raise ValueError(f'{kind}: bucket counts must be non-negative integers')
+    return function, instance, [float(bound) for bound in bounds], series
+
+
+def store_push(conn, function: str, instance: str, bounds: List[float], series: Dict[str, Dict[str, Any]]) -> None:
+    """Upsert cumulative values of one instance: a repeated push replaces, never adds"""
+    cur = conn.cursor()
+    for kind, values in series.items():
+        cur.execute(
+            """
+            INSERT INTO handler_metrics
+                (function_name, instance_id, kind, bucket_bounds, bucket_counts, count, sum_ms, errors)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (function_name, instance_id, kind) DO UPDATE SET
+                bucket_bounds = EXCLUDED.bucket_bounds,
+                bucket_counts = EXCLUDED.bucket_counts,
+                count = EXCLUDED.count,
+                sum_ms = EXCLUDED.sum_ms,
+                errors = EXCLUDED.errors,
+                updated_at = NOW()
+            """,
+            (function, instance, kind, bounds, values['buckets'], sum(values['buckets']),
+             float(values.get('sum_ms') or 0), int(values.get('errors') or 0))
+        )
+    retire_instances(cur)
+    cur.close()
+
+
+def retire_instances(cur) -> None:
+    """Delete rows of instances silent for RETENTION_DAYS, adding their values to the function's retired row"""
+    cur.execute(
+        """
+        DELETE FROM handler_metrics
+        WHERE instance_id <> %s AND updated_at < NOW() - make_interval(days => %s)
+        RETURNING function_name, kind, bucket_bounds, bucket_counts, count, sum_ms, errors
+        """,
+        (RETIRED_INSTANCE, RETENTION_DAYS)
+    )
+    retired: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for function, kind, bounds, counts, count, sum_ms, errors in cur.fetchall():
+        item = retired.get((function, kind))
+        if item is None or list(bounds) != item['bounds']:
+            retired[(function, kind)] = {'bounds': list(bounds), 'buckets': list(counts), 'count': count,
+                                         'sum_ms': sum_ms, 'errors': errors}
+            continue
+        item['buckets'] = [a + b for a, b in zip(item['buckets'], counts)]
+        item['count'] += count
+        item['sum_ms'] += sum_ms
+        item['errors'] += errors
+    # Складываем в SQL, чтобы параллельные очистки не затёрли друг друга; при смене шкалы корзин
+    # накопленное обнуляется, как и при сложении инстансов в load_series
+    for (function, kind), item in retired.items():
+        cur.execute(
+            """
+            INSERT INTO handler_metrics
+                (function_name, instance_id, kind, bucket_bounds, bucket_counts, count, sum_ms, errors)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (function_name, instance_id, kind) DO UPDATE SET
+                bucket_counts = CASE WHEN handler_metrics.bucket_bounds = EXCLUDED.bucket_bounds
+                    THEN ARRAY(SELECT a + b FROM unnest(handler_metrics.bucket_counts, EXCLUDED.bucket_counts) AS t(a, b))
+                    ELSE EXCLUDED.bucket_counts END,
+                count = CASE WHEN handler_metrics.bucket_bounds = EXCLUDED.bucket_bounds
+                    THEN handler_metrics.count + EXCLUDED.count ELSE EXCLUDED.count END,
+                sum_ms = CASE WHEN handler_metrics.bucket_bounds = EXCLUDED.bucket_bounds
+                    THEN handler_metrics.sum_ms + EXCLUDED.sum_ms ELSE EXCLUDED.sum_ms END,
+                errors = CASE WHEN handler_metrics.bucket_bounds = EXCLUDED.bucket_bounds
+                    THEN handler_metrics.errors + EXCLUDED.errors ELSE EXCLUDED.errors END,
+                bucket_bounds = EXCLUDED.bucket_bounds,
+                updated_at = NOW()
+            """,
+            (function, RETIRED_INSTANCE, kind, item['bounds'], item['buckets'], item['count'],
+             item['sum_ms'], item['errors'])
+        )
+
+
+def load_series(conn) -> Tuple[Dict[Tuple[str, str], Dict[str, Any]], Dict[str, int]]:
+    """Sum instances per (function, kind); also count live instances per function"""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT function_name, kind, bucket_bounds, bucket_counts, count, sum_ms, errors,
+               updated_at > NOW() - make_interval(secs => %s) AS live, instance_id
+        FROM handler_metrics
+        ORDER BY updated_at DESC
+        """,
+        (LIVE_INSTANCE_SECONDS,)
+    )
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    live: Dict[str, set] = {}
+    for function, kind, bounds, counts, count, sum_ms, errors, is_live, instance in cur.fetchall():
+        if is_live and instance != RETIRED_INSTANCE:
+            live.setdefault(function, set()).add(instance)
+        item = merged.get((function, kind))
+        if item is None:
+            merged[(function, kind)] = {'bounds': list(bounds), 'buckets': list(counts), 'count': count,
+                                        'sum_ms': sum_ms, 'errors': errors}
+            continue
+        # После смены шкалы корзин старые инстансы не складываются с новыми; первой идёт свежая запись
+        if list(bounds) != item['bounds']:
+            continue
+        item['buckets'] = [a + b for a, b in zip(item['buckets'], counts)]
+        item['count'] += count
+        item['sum_ms'] += sum_ms
+        item['errors'] += errors
+    cur.close()
+    return merged, {function: len(instances) for function, instances in live.items()}
+
+
+def quantile(bounds: List[float], buckets: List[int], q: float) -> Optional[float]:
+    """Estimate a quantile in ms by linear interpolation inside the bucket that holds it"""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(buckets):
+        if count and seen + count >= rank:
+            lower = bounds[index - 1] if index > 0 else 0.0
+            if index == len(bounds):
+                return lower
+            return lower + (bounds[index] - lower) * (rank - seen) / count
+        seen += count
+    return bounds[-1]
+
+
+def label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(merged: Dict[Tuple[str, str], Dict[str, Any]], live: Dict[str, int]) -> str:
+    """Prometheus text exposition: cumulative histograms in seconds, error counters, live instances"""
+    lines = []
+    for kind, (name, description) in METRIC_KINDS.items():
+        keys = sorted(key for key in merged if key[1] == kind)
+        if not keys:
+            continue
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for key in keys:
+            item = merged[key]
+            function = label(key[0])
+            cumulative = 0
+            for bound, count in zip(item['bounds'], item['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{{function="{function}",le="{bound / 1000:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{function="{function}",le="+Inf"}} {item["count"]}')
+            lines.append(f'{name}_sum{{function="{function}"}} {item["sum_ms"] / 1000:.6f}')
+            lines.append(f'{name}_count{{function="{function}"}} {item["count"]}')
+
+    lines.append('# HELP handler_errors_total Failed requests (status >= 500), HTTP calls and connects')
+    lines.append('# TYPE handler_errors_total counter')
+    for (function, kind), item in sorted(merged.items()):
+        lines.append(f'handler_errors_total{{function="{label(function)}",kind="{kind}"}} {item["errors"]}')
+
+    lines.append(f'# HELP handler_live_instances Instances that pushed metrics in the last {LIVE_INSTANCE_SECONDS}s')
+    lines.append('# TYPE handler_live_instances gauge')
+    for function, instances in sorted(live.items()):
+        lines.append(f'handler_live_instances{{function="{label(function)}"}} {instances}')
+    return '\n'.join(lines) + '\n'
+
+
+def render_summary(merged: Dict[Tuple[str, str], Dict[str, Any]], live: Dict[str, int]) -> Dict[str, Any]:
+    """Percentiles in ms per function and kind, for capacity planning without a Prometheus server"""
+    functions: Dict[str, Dict[str, Any]] = {}
+    for (function, kind), item in sorted(merged.items()):
+        entry = functions.setdefault(function, {'live_instances': live.get(function, 0)})
+        entry[kind] = {
+            'count': item['count'],
+            'errors': item['errors'],
+            'mean_ms': round(item['sum_ms'] / item['count'], 2) if item['count'] else None,
+            **{
+                name: round(value, 2) if value is not None else None
+                for name, value in (
+                    (f'p{int(q * 100)}_ms', quantile(item['bounds'], item['buckets'], q))
+                    for q in (0.5, 0.95, 0.99)
+                )
+            }
+        }
+    return {'success': True, 'functions': functions}
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Collect latency histograms pushed by handler instances and expose them for Prometheus
+    Args: event with httpMethod; POST body is a push from the traced decorator (function, instance, bounds, series),
+          GET takes optional queryStringParameters format=json for percentiles instead of Prometheus text
+    Returns: 204 on accepted push, Prometheus text exposition or JSON percentiles on GET
+    '''
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Metrics-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+
+    if method not in ('GET', 'POST'):
+        return json_response(405, {'success': False, 'error': 'Method not allowed'})
+
+    if not authorized(event):
+        return json_response(401, {'success': False, 'error': 'Invalid metrics token'})
+
+    if method == 'POST':
+        try:
+            function, instance, bounds, series = parse_push(json.loads(event.get('body') or '{}'))
+        except (json.JSONDecodeError, AttributeError, ValueError) as e:
+            return json_response(400, {'success': False, 'error': str(e) or 'Invalid JSON'})
+        conn = get_db_connection()
+        try:
+            store_push(conn, function, instance, bounds, series)
+            conn.commit()
+        finally:
+            conn.close()
+        return {'statusCode': 204, 'headers': CORS_HEADERS, 'body': ''}
+
+    conn = get_db_connection()
+    try:
+        merged, live = load_series(conn)
+    finally:
+        conn.close()
+
+    params = event.get('queryStringParameters') or {}
+    if params.get('format') == 'json':
+        return json_response(200, render_summary(merged, live))
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8', **CORS_HEADERS},
+        'isBase64Encoded': False,
+        'body': render_prometheus(merged, live)
+    }
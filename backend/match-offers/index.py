@@ -0,0 +1,556 @@
+import functools
+import json
+import math
+import os
+import time
+import bisect
+import psycopg2
+import urllib.request
+import uuid
+from datetime import date, datetime, timezone, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+from time import perf_counter
+
+SLOT_MINUTES = 15
+DAY_MINUTES = 24 * 60
+SYNC_INTERVAL_SECONDS = float(os.environ.get('MATCH_SYNC_INTERVAL', '2'))
+# Перекрытие окна синхронизации: транзакции, начатые до прошлой синхронизации,
+# могли закоммититься позже неё
+SYNC_OVERLAP = timedelta(seconds=5)
+
+OFFER_COLUMNS = """
+    o.id, o.user_id, o.offer_type, o.amount, o.rate, o.city, o.office_ids,
+    o.time_start, o.time_end, o.meeting_time, o.created_at, o.is_anonymous, o.status,
+    o.valid_from, o.valid_until
+"""
+
+
+def to_minutes(value: Any, is_end: bool = False) -> Optional[int]:
+    """Convert time or 'HH:MM' string to minutes since midnight (end 00:00 means 24:00)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        try:
+            hours, minutes = value.split(':')[:2]
+            total = int(hours) * 60 + int(minutes)
+        except ValueError:
+            return None
+    else:
+        total = value.hour * 60 + value.minute
+    if is_end and total == 0:
+        return DAY_MINUTES
+    return total
+
+
+def format_minutes(minutes: int) -> str:
+    """Format minutes since midnight as HH:MM"""
+    return f"{(minutes // 60) % 24:02d}:{minutes % 60:02d}"
+
+
+class BookEntry:
+    """Offer snapshot kept in the in-memory order book"""
+    __slots__ = ('id', 'user_id', 'side', 'amount', 'rate', 'city', 'offices',
+                 'start', 'end', 'created', 'is_anonymous', 'valid_from', 'valid_until', 'key')
+
+    def __init__(self, offer_id: Optional[int], user_id: Optional[int], side: str, amount: float,
+                 rate: float, city: str, offices: List[int], start: Optional[int],
+                 end: Optional[int], created: float, is_anonymous: bool = False,
+                 valid_from: Optional[date] = None, valid_until: Optional[date] = None):
+        self.id = offer_id
+        self.user_id = user_id
+        self.side = side
+        self.amount = amount
+        self.rate = rate
+        self.city = city
+        self.offices = frozenset(offices or ())
+        if start is not None and (end is None or end <= start):
+            end = start + SLOT_MINUTES if end is None else DAY_MINUTES
+        self.start = start
+        self.end = end
+        self.created = created
+        self.is_anonymous = is_anonymous
+        # Дни действия как в offers; NULL толкует offer_validity
+        self.valid_from = valid_from
+        self.valid_until = valid_until
+        # Приоритет цена-время: продажи по возрастанию курса, покупки по убыванию,
+        # при равном курсе раньше размещённое объявление идёт первым
+        price_key = rate if side == 'sell' else -rate
+        self.key = (price_key, created, offer_id or 0)
+
+    @classmethod
+    def from_row(cls, row: tuple) -> 'BookEntry':
+        """Build entry from a row selected with OFFER_COLUMNS"""
+        start = to_minutes(row[7])
+        end = to_minutes(row[8], is_end=True)
+        if start is None:
+            # Анонимные объявления хранят одно время встречи в meeting_time
+            start, end = to_minutes(row[9]), None
+        created = row[10].timestamp() if row[10] else 0.0
+        return cls(row[0], row[1], row[2], float(row[3]), float(row[4]), row[5] or 'Москва',
+                   row[6] or [], start, end, created, bool(row[11]), row[13], row[14])
+
+    def valid_on(self, day: date) -> bool:
+        """Whether the window applies on day, which is today for every match (same rule as get-active-offers)"""
+        first, last = offer_validity(self.valid_from, self.valid_until, day)
+        return first <= day <= last
+
+
+class OrderBook:
+    """Price-time priority books per (city, offer_type) with incremental updates"""
+
+    def __init__(self):
+        self.books: Dict[Tuple[str, str], List[tuple]] = {}
+        self.entries: Dict[int, BookEntry] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def upsert(self, entry: BookEntry):
+        """Insert or replace offer in its book"""
+        self.remove(entry.id)
+        book = self.books.setdefault((entry.city, entry.side), [])
+        bisect.insort(book, entry.key)
+        self.entries[entry.id] = entry
+
+    def remove(self, offer_id: int) -> bool:
+        """Remove offer from the book, returns False if it was not there"""
+        entry = self.entries.pop(offer_id, None)
+        if entry is None:
+            return False
+        book = self.books.get((entry.city, entry.side), [])
+        index = bisect.bisect_left(book, entry.key)
+        if index < len(book) and book[index] == entry.key:
+            book.pop(index)
+        return True
+
+    def match(self, entry: BookEntry, day: date, limit: int = 10, not_before: int = 0) -> List[Dict[str, Any]]:
+        """Return best counter-offers for entry valid on day, ranked by price-time priority"""
+        counter_side = 'sell' if entry.side == 'buy' else 'buy'
+        book = self.books.get((entry.city, counter_side))
+        if not book or entry.start is None or not entry.valid_on(day):
+            return []
+
+        window_floor = max(entry.start, not_before)
+        matches: List[Dict[str, Any]] = []
+        for key in book:
+            rate = key[0] if counter_side == 'sell' else -key[0]
+            # Книга отсортирована по курсу, дальше совместимых курсов не будет
+            if (counter_side == 'sell' and rate > entry.rate) or (counter_side == 'buy' and rate < entry.rate):
+                break
+
+            candidate = self.entries[key[2]]
+            if candidate.id == entry.id or candidate.start is None or not candidate.valid_on(day):
+                continue
+            if entry.user_id is not None and candidate.user_id == entry.user_id and not entry.is_anonymous:
+                continue
+
+            window_start = max(window_floor, candidate.start)
+            window_end = min(entry.end, candidate.end)
+            if window_start >= window_end:
+                continue
+
+            if entry.offices and candidate.offices:
+                common_offices = entry.offices & candidate.offices
+                if not common_offices:
+                    continue
+            else:
+                # Без офисов объявление готово встретиться в любом офисе контрагента
+                common_offices = entry.offices or candidate.offices
+
+            matches.append({
+                'offer_id': candidate.id,
+                'user_id': candidate.user_id,
+                'offer_type': candidate.side,
+                'rate': candidate.rate,
+                'amount': candidate.amount,
+                'match_amount': min(entry.amount, candidate.amount),
+                'city': candidate.city,
+                'is_anonymous': candidate.is_anonymous,
+                'common_office_ids': sorted(common_offices),
+                'window_start': window_start,
+                'window_end': window_end
+            })
+            if len(matches) >= limit:
+                break
+
+        return matches
+
+
+_book = OrderBook()
+_watermark: Optional[datetime] = None
+_last_sync = 0.0
+
+
+def sync_book(cur) -> None:
+    """Load the book on cold start, then apply offers changed since the last sync"""
+    global _watermark, _last_sync
+
+    if _watermark is not None and time.monotonic() - _last_sync < SYNC_INTERVAL_SECONDS:
+        return
+
+    cur.execute("SELECT LOCALTIMESTAMP")
+    db_now = cur.fetchone()[0]
+
+    if _watermark is None:
+        cur.execute(f"SELECT {OFFER_COLUMNS} FROM offers o WHERE o.status = 'active'")
+        for row in cur.fetchall():
+            _book.upsert(BookEntry.from_row(row))
+    else:
+        cur.execute(f"SELECT {OFFER_COLUMNS} FROM offers o WHERE o.updated_at > %s",
+                    (_watermark - SYNC_OVERLAP,))
+        for row in cur.fetchall():
+            if row[12] == 'active':
+                _book.upsert(BookEntry.from_row(row))
+            else:
+                _book.remove(row[0])
+
+        # Удалённые объявления не оставляют следов в updated_at, сверяем количество
+        cur.execute("SELECT COUNT(*) FROM offers WHERE status = 'active'")
+        if cur.fetchone()[0] != len(_book):
+            cur.execute("SELECT id FROM offers WHERE status = 'active'")
+            active_ids = {row[0] for row in cur.fetchall()}
+            for offer_id in [offer_id for offer_id in _book.entries if offer_id not in active_ids]:
+                _book.remove(offer_id)
+
+    _watermark = db_now
+    _last_sync = time.monotonic()
+
+
+def attach_available_slots(cur, matches: List[Dict[str, Any]], day: date, not_before: int) -> List[Dict[str, Any]]:
+    """Fill office names and day's available_slots for matches with two queries, drop fully booked ones"""
+    office_ids = sorted({office_id for match in matches for office_id in match['common_office_ids']})
+    reserved = set()
+    office_names: Dict[int, str] = {}
+    if office_ids:
+        cur.execute("SELECT id, name FROM offices WHERE id = ANY(%s)", (office_ids,))
+        office_names = dict(cur.fetchall())
+
+        cur.execute("""
+            SELECT r.meeting_time, r.meeting_office_id
+            FROM reservations r
+            WHERE r.meeting_office_id = ANY(%s)
+            AND r.meeting_date = %s
+            AND r.status IN ('pending', 'confirmed')
+            AND r.expires_at > NOW()
+        """, (office_ids, day))
+        for meeting_time, office_id in cur.fetchall():
+            minutes = to_minutes(meeting_time)
+            if minutes is not None:
+                reserved.add((office_id, minutes))
+
+    result = []
+    for match in matches:
+        first_slot = max(match['window_start'], not_before)
+        first_slot += -first_slot % SLOT_MINUTES
+        slots = []
+        for minutes in range(first_slot, match['window_end'], SLOT_MINUTES):
+            free_offices = [office_id for office_id in match['common_office_ids']
+                            if (office_id, minutes) not in reserved]
+            if free_offices or not match['common_office_ids']:
+                slots.append(format_minutes(minutes))
+        if not slots:
+            continue
+        match['common_offices'] = [office_names.get(office_id) for office_id in match['common_office_ids']]
+        match['window_start'] = format_minutes(match['window_start'])
+        match['window_end'] = format_minutes(match['window_end'])
+        match['available_slots'] = slots
+        result.append(match)
+    return result
+
+
+def entry_from_params(params: Dict[str, Any]) -> BookEntry:
+    """Build an ad-hoc entry from query parameters, ValueError on non-numeric rate, amount or office_ids"""
+    offices = [int(office_id) for office_id in (params.get('office_ids') or '').split(',') if office_id.strip()]
+    rate = float(params['rate'])
+    amount = float(params.get('amount') or 0)
+    if not math.isfinite(rate) or not math.isfinite(amount):
+        raise ValueError('rate and amount must be finite numbers')
+    start = to_minutes(params.get('time_start'))
+    end = to_minutes(params.get('time_end'), is_end=True)
+    return BookEntry(None, None, params['offer_type'], amount, rate, params.get('city') or 'Москва', offices,
+                     start, end, time.time(), is_anonymous=True)
+
+
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'match-offers'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg2.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg2.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+def offer_validity(valid_from: Optional[date], valid_until: Optional[date], today: date) -> Tuple[date, date]:
+    """First and last day the offer's daily window applies. NULL valid_from - already started,
+    NULL valid_until - today only: such an offer lives until EXPIRED_OFFERS or expires_at retires it"""
+    return valid_from or today, valid_until or today
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+@traced
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Find compatible counter-offers for an offer using the in-memory order book
+    Args: event with queryStringParameters (offer_id, or offer_type + rate + city + office_ids + time_start + time_end; optional limit)
+          context with request_id
+    Returns: JSON list of ranked match candidates with common offices and free slots
+    '''
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': traced_dumps({'success': False, 'error': 'Method not allowed'})
+        }
+
+    params = event.get('queryStringParameters') or {}
+
+    if not params.get('offer_id') and not (params.get('offer_type') in ('buy', 'sell') and params.get('rate')):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': traced_dumps({'success': False, 'error': 'offer_id or offer_type and rate are required'})
+        }
+
+    # Все числа разбираем до подключения к БД: мусор в параметрах - это 400, а не 500
+    try:
+        limit = min(max(int(params.get('limit') or 10), 1), 50)
+        offer_id = int(params['offer_id']) if params.get('offer_id') else None
+        adhoc_entry = entry_from_params(params) if offer_id is None else None
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': traced_dumps({'success': False, 'error': 'Invalid limit, offer_id, rate, amount or office_ids'})
+        }
+
+    dsn = os.environ.get('DATABASE_URL')
+    conn = traced_connect(dsn)
+    cur = conn.cursor()
+
+    try:
+        sync_book(cur)
+
+        if offer_id is not None:
+            entry = _book.entries.get(offer_id)
+            if entry is None:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': traced_dumps({'success': False, 'error': 'Offer not found or not active'})
+                }
+        else:
+            entry = adhoc_entry
+
+        moscow_now = datetime.now(timezone(timedelta(hours=3)))
+        not_before = moscow_now.hour * 60 + moscow_now.minute + 1
+
+        # Берём кандидатов с запасом: часть может отсеяться по занятым слотам
+        today = moscow_now.date()
+        candidates = _book.match(entry, today, limit=limit * 2, not_before=not_before)
+        matches = attach_available_slots(cur, candidates, today, not_before)[:limit]
+    finally:
+        cur.close()
+        conn.close()
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': traced_dumps({'success': True, 'offer_id': entry.id, 'book_size': len(_book), 'matches': matches})
+    }
@@ -1,13 +1,252 @@
+import bisect
+import functools
 import json
 import os
+import random
+import re
 import psycopg
 import requests
-from typing import Dict, Any
+import urllib.request
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+from time import perf_counter
 
+MOSCOW_TZ = timezone(timedelta(hours=3))
+
+def normalize_office(name: str) -> str:
+    """Normalize office name the same way as offices.normalized_name"""
+    return re.sub(r'[\s.,]+', ' ', name.lower()).strip()
+
+def find_meeting_office(cursor, city: str, offer_office_ids: List[int], office: Optional[str],
+                        office_id: Optional[int]) -> Optional[Tuple[int, str]]:
+    """Registry id and name of the buyer's meeting office, read-only: it must be one of the offer's offices,
+    or any office of the offer's city when the offer lists none"""
+    if office_id:
+        condition, value = 'id = %s', office_id
+    else:
+        condition, value = 'normalized_name = %s', normalize_office(office or '')
+    if offer_office_ids:
+        cursor.execute(f'SELECT id, name FROM offices WHERE {condition} AND id = ANY(%s)', (value, offer_office_ids))
+    else:
+        cursor.execute(f'SELECT id, name FROM offices WHERE {condition} AND city = %s', (value, city))
+    return cursor.fetchone()
+
+# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit
+# Трассировка: одна JSON-строка в лог на запрос с разбивкой времени на БД, HTTP и сериализацию
+TRACE_FUNCTION = 'reserve-offer'
+TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') != '0'
+_trace: Dict[str, Any] = {}
+
+# Метрики: гистограммы задержек в памяти инстанса. С METRICS_PUSH_URL накопленные значения
+# периодически отправляются в функцию handler-metrics; повторная отправка ничего не удваивает
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL')
+METRICS_PUSH_SECONDS = float(os.environ.get('METRICS_PUSH_SECONDS', '30'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин в мс: логарифмическая шкала с шагом x1.5 от 1 мс до ~57 с
+LATENCY_BUCKETS_MS = tuple(round(1.5 ** i, 2) for i in range(28))
+INSTANCE_ID = uuid.uuid4().hex[:16]
+_metrics: Dict[str, Any] = {'pushed_at': perf_counter(), 'series': {}}
+
+
+def metrics_observe(kind: str, elapsed_ms: float, error: bool = False) -> None:
+    """Count one observation into this instance's histogram of kind (request, db, http, connect)"""
+    series = _metrics['series'].get(kind)
+    if series is None:
+        series = _metrics['series'][kind] = {
+            'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'count': 0, 'sum_ms': 0.0, 'errors': 0
+        }
+    series['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+    series['count'] += 1
+    series['sum_ms'] += elapsed_ms
+    if error:
+        series['errors'] += 1
+
+
+def metrics_push() -> None:
+    """POST the cumulative histograms to METRICS_PUSH_URL at most every METRICS_PUSH_SECONDS; failures are only logged"""
+    if not METRICS_PUSH_URL or perf_counter() - _metrics['pushed_at'] < METRICS_PUSH_SECONDS:
+        return
+    _metrics['pushed_at'] = perf_counter()
+    payload = json.dumps({
+        'function': TRACE_FUNCTION,
+        'instance': INSTANCE_ID,
+        'bounds': LATENCY_BUCKETS_MS,
+        'series': _metrics['series']
+    }).encode()
+    request = urllib.request.Request(METRICS_PUSH_URL, data=payload, method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-Metrics-Token': METRICS_TOKEN})
+    try:
+        urllib.request.urlopen(request, timeout=1).close()
+    except Exception as e:
+        print(f"Metrics push failed: {e}")
+
+
+# Доля запросов, для которых в лог пишутся отладочные дампы (0 - никогда)
+DEBUG_SAMPLE_RATE = float(os.environ.get('DEBUG_SAMPLE_RATE', '0'))
+
+
+def debug_sampled() -> bool:
+    """True for the sampled share of requests; checked before any debug dump is formatted"""
+    return DEBUG_SAMPLE_RATE > 0 and random.random() < DEBUG_SAMPLE_RATE
+
+
+def trace_add(kind: str, started: float, statement: Any = None) -> None:
+    """Add time since started to the request's db/http/serialize total; statements also update count and slowest"""
+    if not _trace:
+        return
+    elapsed = (perf_counter() - started) * 1000
+    _trace[kind] += elapsed
+    if statement is not None:
+        _trace['queries'] += 1
+        if elapsed > _trace['slowest_ms']:
+            _trace['slowest_ms'] = elapsed
+            _trace['slowest'] = statement
+
+
+class TracedCursor:
+    """Cursor proxy that times every statement"""
+
+    def __init__(self, cursor: Any):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return self._cursor.execute(query, *args, **kwargs)
+        finally:
+            trace_add('db', started, query)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy handing out traced cursors; connect and commit count as DB time"""
+
+    def __init__(self, conn: Any):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self, *args: Any, **kwargs: Any) -> TracedCursor:
+        return TracedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self) -> None:
+        started = perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            trace_add('db', started)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc: Any):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+
+def traced_connect(*args: Any, **kwargs: Any) -> TracedConnection:
+    """psycopg.connect with the connection time counted as DB time"""
+    started = perf_counter()
+    failed = True
+    try:
+        conn = psycopg.connect(*args, **kwargs)
+        failed = False
+    finally:
+        metrics_observe('connect', (perf_counter() - started) * 1000, error=failed)
+    trace_add('db', started)
+    return TracedConnection(conn)
+
+
+def traced_http(call: Any, *args: Any, **kwargs: Any) -> Any:
+    """Outbound HTTP call (Telegram, Binance) counted as HTTP time"""
+    started = perf_counter()
+    failed = True
+    try:
+        result = call(*args, **kwargs)
+        failed = False
+        return result
+    finally:
+        metrics_observe('http', (perf_counter() - started) * 1000, error=failed)
+        trace_add('http', started)
+
+
+def traced_dumps(payload: Any, **kwargs: Any) -> str:
+    """json.dumps counted as serialization time"""
+    started = perf_counter()
+    try:
+        return json.dumps(payload, **kwargs)
+    finally:
+        trace_add('serialize', started)
+
+
+def traced(handler_func):
+    """Handler decorator: latency metrics for every request and, unless TRACE_ENABLED=0, one JSON log line
+    with total, DB, HTTP and serialization time"""
+    @functools.wraps(handler_func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _trace.update(db=0.0, http=0.0, serialize=0.0, queries=0, slowest_ms=0.0, slowest=None)
+        started = perf_counter()
+        status = 500
+        try:
+            response = handler_func(event, context)
+            status = response.get('statusCode', 200)
+            return response
+        finally:
+            total_ms = (perf_counter() - started) * 1000
+            metrics_observe('request', total_ms, error=status >= 500)
+            if _trace['queries']:
+                metrics_observe('db', _trace['db'])
+            if TRACE_ENABLED:
+                report_trace(event, context, status, total_ms)
+            _trace.clear()
+            metrics_push()
+    return wrapper
+
+
+def report_trace(event: Dict[str, Any], context: Any, status: int, total_ms: float) -> None:
+    """Print the request's trace line"""
+    slowest = _trace['slowest']
+    print(json.dumps({
+        'trace': TRACE_FUNCTION,
+        'request_id': getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId'),
+        'method': event.get('httpMethod'),
+        'status': status,
+        'total_ms': round(total_ms, 2),
+        'db_ms': round(_trace['db'], 2),
+        'http_ms': round(_trace['http'], 2),
+        'serialize_ms': round(_trace['serialize'], 2),
+        'queries': _trace['queries'],
+        'slowest_ms': round(_trace['slowest_ms'], 2),
+        'slowest': ' '.join(str(slowest).split())[:200] if slowest is not None else None
+    }, ensure_ascii=False))
+# <<< end of generated block
+
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Reserve specific time slot for offer and notify owner via Telegram
-    Args: event with httpMethod, body containing offer_id, slot_time, user_id, username
+    Args: event with httpMethod, body containing offer_id, slot_time, optional slot_date (YYYY-MM-DD, default today), user_id, username, meeting_office or meeting_office_id
           context with request_id
     Returns: HTTP response with success status
     '''
@@ -30,7 +269,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Method not allowed'})
+            'body': traced_dumps({'error': 'Method not allowed'})
         }
     
     body_str = event.get('body', '{}')
@@ -40,42 +279,72 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     try:
         body_data = json.loads(body_str)
     except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}, body: {body_str}")
+        # Тело может содержать телефон покупателя: целиком пишем только в отладочной выборке
+        print(f"JSON decode error: {e}")
+        if debug_sampled():
+            print(f"Rejected body: {body_str}")
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'success': False, 'error': 'Invalid JSON in request body'})
+            'body': traced_dumps({'success': False, 'error': 'Invalid JSON in request body'})
         }
     
-    print(f"Received body_data: {body_data}")
+    if debug_sampled():
+        print(f"Received body_data: {body_data}")
     
     offer_id = body_data.get('offer_id')
     slot_time = body_data.get('slot_time')
+    slot_date = body_data.get('slot_date')
     user_id = body_data.get('user_id')
     username = body_data.get('username')
     buyer_name = body_data.get('buyer_name')
     buyer_phone = body_data.get('buyer_phone')
     meeting_office = body_data.get('meeting_office')
+    meeting_office_id = body_data.get('meeting_office_id')
     requested_amount = body_data.get('amount')
     is_anonymous = body_data.get('is_anonymous', False)
     
-    print(f"Parsed values - offer_id: {offer_id}, slot_time: {slot_time}, is_anonymous: {is_anonymous}, buyer_name: {buyer_name}, buyer_phone: {buyer_phone}, meeting_office: {meeting_office}")
+    if debug_sampled():
+        print(f"Parsed values - offer_id: {offer_id}, slot_time: {slot_time}, is_anonymous: {is_anonymous}, buyer_name: {buyer_name}, buyer_phone: {buyer_phone}, meeting_office: {meeting_office}")
     
     if not offer_id or not slot_time:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'success': False, 'error': 'Missing offer_id or slot_time'})
+            'body': traced_dumps({'success': False, 'error': 'Missing offer_id or slot_time'})
         }
     
-    if not meeting_office:
+    # Слот сравниваем как TIME, а не как строку
+    today = datetime.now(MOSCOW_TZ).date()
+    try:
+        slot_time = datetime.strptime(str(slot_time).strip(), '%H:%M').time()
+        slot_date = datetime.strptime(str(slot_date).strip(), '%Y-%m-%d').date() if slot_date else today
+    except ValueError:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'success': False, 'error': 'Missing meeting_office'})
+            'body': traced_dumps({'success': False, 'error': 'Invalid slot_time or slot_date, expected HH:MM and YYYY-MM-DD'})
+        }
+    
+    if not meeting_office and not meeting_office_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': traced_dumps({'success': False, 'error': 'Missing meeting_office'})
+        }
+    
+    try:
+        meeting_office_id = int(meeting_office_id) if meeting_office_id else None
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': traced_dumps({'success': False, 'error': 'Invalid meeting_office_id'})
         }
     
     if is_anonymous:
@@ -84,7 +353,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'isBase64Encoded': False,
-                'body': json.dumps({'success': False, 'error': 'Missing buyer_name or buyer_phone'})
+                'body': traced_dumps({'success': False, 'error': 'Missing buyer_name or buyer_phone'})
             }
     else:
         if not user_id or not username:
@@ -92,23 +361,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'isBase64Encoded': False,
-                'body': json.dumps({'success': False, 'error': 'Missing user_id or username'})
+                'body': traced_dumps({'success': False, 'error': 'Missing user_id or username'})
             }
     
     dsn = os.environ.get('DATABASE_URL')
     
     try:
-        def escape_sql(value):
-            if value is None:
-                return 'NULL'
-            return f"'{str(value).replace(chr(39), chr(39)+chr(39))}'"
-        
-        with psycopg.connect(dsn, autocommit=False) as conn:
+        with traced_connect(dsn, autocommit=False) as conn:
             conn.autocommit = True
             with conn.cursor() as cur:
                 cur.execute(f"""
                     SELECT o.user_id, o.amount, o.rate, o.offer_type, 
-                           u.telegram_id, u.username as owner_username, o.is_anonymous
+                           u.telegram_id, u.username as owner_username, o.is_anonymous, o.city,
+                           o.valid_from, o.valid_until, o.office_ids
                     FROM offers o
                     JOIN users u ON o.user_id = u.id
                     WHERE o.id = {offer_id}
@@ -121,21 +386,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'statusCode': 404,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'isBase64Encoded': False,
-                        'body': json.dumps({'success': False, 'error': 'Offer not found or not active'})
+                        'body': traced_dumps({'success': False, 'error': 'Offer not found or not active'})
+                    }
+                
+                owner_id, amount, rate, offer_type, telegram_id, owner_username, offer_is_anonymous, offer_city, valid_from, valid_until, offer_office_ids = result
+                
+                # Без valid_until объявление действует только сегодня
+                if slot_date < max(valid_from or today, today) or slot_date > (valid_until or today):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': traced_dumps({'success': False, 'error': 'slot_date is outside of offer validity'})
                     }
                 
-                owner_id, amount, rate, offer_type, telegram_id, owner_username, offer_is_anonymous = result
+                # Офис встречи ищем в справочнике только на чтение: новые офисы заводит продавец
+                # в create-offer/edit-offer, покупатель выбирает из офисов объявления
+                office = find_meeting_office(cur, offer_city, offer_office_ids or [], meeting_office, meeting_office_id)
+                if office is None:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': traced_dumps({'success': False, 'error': 'Unknown meeting_office or not served by this offer'})
+                    }
+                meeting_office_id, meeting_office = office
                 
                 # Проверяем, что слот не забронирован через таблицу reservations
-                cur.execute(f"""
+                cur.execute("""
                     SELECT COUNT(*) 
                     FROM reservations
-                    WHERE offer_id = {offer_id} 
-                    AND meeting_time = '{slot_time}' 
-                    AND meeting_office = {escape_sql(meeting_office)}
+                    WHERE offer_id = %s 
+                    AND meeting_office_id = %s
+                    AND meeting_date = %s
+                    AND meeting_time = %s 
                     AND status IN ('pending', 'confirmed')
                     AND expires_at > NOW()
-                """)
+                """, (offer_id, meeting_office_id, slot_date, slot_time))
                 
                 reserved_count = cur.fetchone()[0]
                 if reserved_count > 0:
@@ -143,7 +430,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'isBase64Encoded': False,
-                        'body': json.dumps({'success': False, 'error': 'Time slot already reserved'})
+                        'body': traced_dumps({'success': False, 'error': 'Time slot already reserved'})
                     }
                 
                 if not is_anonymous and owner_id == user_id:
@@ -151,24 +438,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'isBase64Encoded': False,
-                        'body': json.dumps({'success': False, 'error': 'Cannot reserve own offer'})
+                        'body': traced_dumps({'success': False, 'error': 'Cannot reserve own offer'})
                     }
                 
                 display_name = buyer_name if is_anonymous else username
                 
-                buyer_name_sql = escape_sql(buyer_name) if is_anonymous else 'NULL'
-                buyer_phone_sql = escape_sql(buyer_phone) if is_anonymous else 'NULL'
-                user_id_sql = user_id if not is_anonymous else 'NULL'
                 amount_sql = requested_amount if requested_amount else amount
                 
-                cur.execute(f"""
+                cur.execute("""
                     INSERT INTO reservations 
-                    (offer_id, buyer_name, buyer_phone, buyer_user_id, meeting_office, meeting_time, amount, status) 
-                    VALUES ({offer_id}, {buyer_name_sql}, {buyer_phone_sql}, {user_id_sql}, {escape_sql(meeting_office)}, '{slot_time}', {amount_sql}, 'pending')
+                    (offer_id, buyer_name, buyer_phone, buyer_user_id, meeting_office, meeting_office_id, meeting_date, meeting_time, amount, status) 
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'pending')
                     RETURNING id
-                """)
+                """, (
+                    offer_id,
+                    buyer_name if is_anonymous else None,
+                    buyer_phone if is_anonymous else None,
+                    None if is_anonymous else user_id,
+                    meeting_office,
+                    meeting_office_id,
+                    slot_date,
+                    slot_time,
+                    amount_sql
+                ))
                 
                 reservation_id = cur.fetchone()[0]
+                cur.execute("UPDATE cache_versions SET version = version + 1, updated_at = NOW() WHERE name = 'reservations'")
                 
                 display_amount = amount_sql
                 total_amount = float(display_amount) * float(rate)
@@ -183,12 +478,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 ⚡ Операция: {offer_type_text}
 💰 Сумма: {display_amount} USDT × {rate} ₽ = {total_amount:.2f} ₽
 📍 Место встречи: {meeting_office}
-🕐 Время: {slot_time}
+🕐 Время: {slot_date.strftime('%d.%m')} {slot_time.strftime('%H:%M')}
 
 ⏳ Зайдите в личный кабинет чтобы подтвердить или отклонить заявку."""
                     
                     try:
-                        response = requests.post(
+                        response = traced_http(requests.post,
                             'https://functions.poehali.dev/bc217044-2303-41d4-9dfe-440055bdac02',
                             json={
                                 'telegram_id': telegram_id,
@@ -196,7 +491,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             },
                             timeout=5
                         )
-                        print(f"Telegram notification response: {response.status_code}, {response.text}")
+                        if debug_sampled():
+                            print(f"Telegram notification response: {response.status_code}, {response.text}")
                     except Exception as e:
                         print(f"Failed to send owner notification: {e}")
                 
@@ -211,11 +507,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 ⚡ Операция: {offer_type_text}
 💰 Сумма: {display_amount} USDT × {rate} ₽ = {float(display_amount) * float(rate):,.2f} ₽
 📍 Место: {meeting_office}
-🕐 Время: {slot_time}"""
+🕐 Время: {slot_date.strftime('%d.%m')} {slot_time.strftime('%H:%M')}"""
                     
                     try:
                         telegram_api_url = f'https://api.telegram.org/bot{bot_token_deals}/sendMessage'
-                        requests.post(
+                        traced_http(requests.post,
                             telegram_api_url,
                             json={
                                 'chat_id': chat_id,
@@ -231,7 +527,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'success': True, 'reservation_id': reservation_id})
+            'body': traced_dumps({'success': True, 'reservation_id': reservation_id})
         }
     
     except Exception as e:
@@ -240,5 +536,5 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'success': False, 'error': str(e)})
+            'body': traced_dumps({'success': False, 'error': str(e)})
         }
\ No newline at end of file
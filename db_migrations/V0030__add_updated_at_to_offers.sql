@@ -0,0 +1,7 @@
+-- Время последнего изменения объявления: по нему движок сопоставления
+-- (match-offers) подтягивает изменения инкрементально
+ALTER TABLE offers ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+
+UPDATE offers SET updated_at = COALESCE(created_at, NOW()) WHERE updated_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_offers_updated_at ON offers(updated_at);
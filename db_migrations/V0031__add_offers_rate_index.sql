@@ -0,0 +1,5 @@
+-- Индекс для лучших курсов и глубины рынка: равенство по статусу, городу и типу,
+-- дальше уже отсортировано по курсу. amount и time_end включены в индекс,
+-- чтобы стакан считался index-only scan без чтения таблицы
+CREATE INDEX IF NOT EXISTS idx_offers_status_city_type_rate
+ON offers(status, city, offer_type, rate) INCLUDE (amount, time_end);
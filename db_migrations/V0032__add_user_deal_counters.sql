@@ -0,0 +1,20 @@
+-- Денормализованные счётчики завершённых сделок пользователя для репутации
+-- в ленте объявлений. Поддерживаются admin-complete-deal и update-offer-status,
+-- пересчитываются функцией rebuild-user-counters
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS completed_deals INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS completed_volume NUMERIC(18, 2) NOT NULL DEFAULT 0;
+
+UPDATE users u
+SET completed_deals = d.deals_count,
+    completed_volume = d.volume
+FROM (
+    SELECT user_id, COUNT(*) AS deals_count, COALESCE(SUM(amount), 0) AS volume
+    FROM deals
+    WHERE status = 'completed'
+    GROUP BY user_id
+) d
+WHERE u.id = d.user_id;
+
+COMMENT ON COLUMN users.completed_deals IS 'Количество завершённых сделок пользователя';
+COMMENT ON COLUMN users.completed_volume IS 'Объём завершённых сделок пользователя в USDT';
@@ -0,0 +1,60 @@
+-- Справочник офисов: у каждого офиса числовой id и город. normalized_name
+-- убирает расхождения в написании (регистр, пробелы, точки и запятые)
+CREATE TABLE IF NOT EXISTS offices (
+    id SERIAL PRIMARY KEY,
+    city VARCHAR(50) NOT NULL,
+    name TEXT NOT NULL,
+    normalized_name TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE(city, normalized_name)
+);
+
+INSERT INTO offices (city, name, normalized_name)
+SELECT DISTINCT ON (city, normalized_name) city, name, normalized_name
+FROM (
+    SELECT o.city, TRIM(office) AS name,
+           TRIM(REGEXP_REPLACE(LOWER(office), '[[:space:].,]+', ' ', 'g')) AS normalized_name
+    FROM offers o, UNNEST(o.offices) AS office
+    UNION ALL
+    SELECT o.city, TRIM(r.meeting_office),
+           TRIM(REGEXP_REPLACE(LOWER(r.meeting_office), '[[:space:].,]+', ' ', 'g'))
+    FROM reservations r
+    JOIN offers o ON r.offer_id = o.id
+    WHERE r.meeting_office IS NOT NULL AND TRIM(r.meeting_office) <> ''
+) names
+WHERE normalized_name <> ''
+ORDER BY city, normalized_name, name
+ON CONFLICT (city, normalized_name) DO NOTHING;
+
+-- Связь объявление-офис: массив id с GIN-индексом для поиска по офису
+ALTER TABLE offers ADD COLUMN IF NOT EXISTS office_ids INTEGER[] NOT NULL DEFAULT '{}';
+
+UPDATE offers o
+SET office_ids = ids.office_ids
+FROM (
+    SELECT o2.id, ARRAY_AGG(f.id ORDER BY u.ord) AS office_ids
+    FROM offers o2
+    CROSS JOIN LATERAL UNNEST(o2.offices) WITH ORDINALITY AS u(office, ord)
+    JOIN offices f ON f.city = o2.city
+        AND f.normalized_name = TRIM(REGEXP_REPLACE(LOWER(u.office), '[[:space:].,]+', ' ', 'g'))
+    GROUP BY o2.id
+) ids
+WHERE o.id = ids.id;
+
+CREATE INDEX IF NOT EXISTS idx_offers_office_ids ON offers USING GIN (office_ids);
+
+-- Бронирования ссылаются на офис по id
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS meeting_office_id INTEGER REFERENCES offices(id);
+
+UPDATE reservations r
+SET meeting_office_id = f.id
+FROM offers o, offices f
+WHERE r.offer_id = o.id
+AND f.city = o.city
+AND f.normalized_name = TRIM(REGEXP_REPLACE(LOWER(r.meeting_office), '[[:space:].,]+', ' ', 'g'))
+AND r.meeting_office_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_reservations_meeting_office_id ON reservations(meeting_office_id);
+
+COMMENT ON TABLE offices IS 'Справочник офисов для встреч';
+COMMENT ON COLUMN offers.office_ids IS 'Офисы объявления (id из offices), порядок совпадает с offers.offices';
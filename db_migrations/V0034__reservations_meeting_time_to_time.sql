@@ -0,0 +1,10 @@
+-- Время встречи хранилось строкой 'HH:MM': сравнения шли по тексту и индекс
+-- не помогал при выборке диапазона. Переводим колонку в TIME
+ALTER TABLE reservations
+    ALTER COLUMN meeting_time TYPE TIME
+    USING NULLIF(TRIM(meeting_time), '')::time;
+
+-- Составной индекс (офис, время) покрывает и точную проверку слота,
+-- и диапазоны вида "что занято с 14:00 до 16:00 в офисе X"
+DROP INDEX IF EXISTS idx_reservations_meeting_office_id;
+CREATE INDEX IF NOT EXISTS idx_reservations_office_time ON reservations(meeting_office_id, meeting_time);
@@ -0,0 +1,17 @@
+-- Многодневные объявления: окно time_start - time_end повторяется каждый день
+-- с valid_from по valid_until. NULL в valid_until - объявление только на сегодня
+ALTER TABLE offers ADD COLUMN IF NOT EXISTS valid_from DATE;
+ALTER TABLE offers ADD COLUMN IF NOT EXISTS valid_until DATE;
+
+-- Бронь относится к конкретному дню; старые брони считаем сделанными на день создания
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS meeting_date DATE;
+UPDATE reservations SET meeting_date = created_at::date WHERE meeting_date IS NULL;
+ALTER TABLE reservations ALTER COLUMN meeting_date SET DEFAULT CURRENT_DATE;
+
+-- Календарь офиса за день читается одним диапазоном индекса
+DROP INDEX IF EXISTS idx_reservations_office_time;
+CREATE INDEX IF NOT EXISTS idx_reservations_office_date_time ON reservations(meeting_office_id, meeting_date, meeting_time);
+
+COMMENT ON COLUMN offers.valid_from IS 'Первый день действия объявления (NULL - с момента создания)';
+COMMENT ON COLUMN offers.valid_until IS 'Последний день действия объявления (NULL - только день создания)';
+COMMENT ON COLUMN reservations.meeting_date IS 'День встречи';
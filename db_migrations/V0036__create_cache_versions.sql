@@ -0,0 +1,22 @@
+-- Версии данных для инвалидации кэшей: каждый обработчик, меняющий
+-- объявления или брони, увеличивает версию в той же транзакции
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+INSERT INTO cache_versions (name) VALUES ('offers'), ('reservations')
+ON CONFLICT (name) DO NOTHING;
+
+-- Общий кэш готовых ответов между инстансами функций. UNLOGGED: не пишется
+-- в WAL и теряется при сбое, что для кэша допустимо
+CREATE UNLOGGED TABLE IF NOT EXISTS response_cache (
+    cache_key TEXT PRIMARY KEY,
+    versions TEXT NOT NULL,
+    body TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+COMMENT ON TABLE cache_versions IS 'Счётчики версий для инвалидации кэшей ответов';
+COMMENT ON TABLE response_cache IS 'Кэш сериализованных ответов get-active-offers (опционально, RESPONSE_CACHE_SHARED=1)';
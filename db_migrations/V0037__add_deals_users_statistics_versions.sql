@@ -0,0 +1,3 @@
+-- Версии для ETag у обработчиков чтения сделок, пользователей и статистики
+INSERT INTO cache_versions (name) VALUES ('deals'), ('users'), ('statistics')
+ON CONFLICT (name) DO NOTHING;
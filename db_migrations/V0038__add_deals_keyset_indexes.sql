@@ -0,0 +1,3 @@
+-- Постраничная выдача сделок по (created_at, id): общий список админки и история пользователя
+CREATE INDEX IF NOT EXISTS idx_deals_created_at_id ON deals(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_deals_user_created_at_id ON deals(user_id, created_at, id);
@@ -0,0 +1,8 @@
+-- Поиск пользователей в админке по префиксу имени, email и телефона.
+-- text_pattern_ops нужен, чтобы LIKE 'abc%' использовал индекс при любой collation
+CREATE INDEX IF NOT EXISTS idx_users_name_prefix ON users(lower(name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_email_prefix ON users(lower(email) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_phone_prefix ON users(phone text_pattern_ops);
+
+-- Постраничная выдача списка пользователей по (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_users_created_at_id ON users(created_at, id);
@@ -0,0 +1,20 @@
+-- Гистограммы задержек обработчиков. Каждый инстанс функции периодически присылает
+-- накопленные значения в handler-metrics, строка на (функция, инстанс, вид метрики)
+CREATE TABLE IF NOT EXISTS handler_metrics (
+    function_name VARCHAR(100) NOT NULL,
+    instance_id VARCHAR(64) NOT NULL,
+    kind VARCHAR(20) NOT NULL,
+    bucket_bounds DOUBLE PRECISION[] NOT NULL,
+    bucket_counts BIGINT[] NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    errors BIGINT NOT NULL DEFAULT 0,
+    started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (function_name, instance_id, kind)
+);
+
+-- Очистка строк давно остановленных инстансов
+CREATE INDEX IF NOT EXISTS idx_handler_metrics_updated_at ON handler_metrics(updated_at);
+
+COMMENT ON TABLE handler_metrics IS 'Накопленные гистограммы задержек по инстансам функций (METRICS_PUSH_URL)';
@@ -0,0 +1,38 @@
+-- Индексы под горячие условия броней и активных объявлений. CONCURRENTLY не блокирует
+-- запись на время построения; такие операторы Flyway выполняет вне транзакции, поэтому
+-- в файле нет ничего, кроме них. Если построение прервалось, индекс остаётся INVALID:
+-- удалить его через DROP INDEX CONCURRENTLY и накатить миграцию заново
+
+-- reserve-offer: проверка занятости слота объявления. Частичный индекс держит только
+-- живые брони, expires_at проверяется по индексу без обращения к таблице
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservations_live_offer_slot
+    ON reservations(offer_id, meeting_date, meeting_time, meeting_office_id)
+    INCLUDE (expires_at)
+    WHERE status IN ('pending', 'confirmed');
+
+-- get-active-offers и match-offers: занятость офисов за период, те же условия по статусу
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservations_live_office_date_time
+    ON reservations(meeting_office_id, meeting_date, meeting_time)
+    INCLUDE (expires_at)
+    WHERE status IN ('pending', 'confirmed');
+
+-- Полный индекс по офису больше никем не читается: все запросы по офису смотрят только живые брони
+DROP INDEX CONCURRENTLY IF EXISTS idx_reservations_office_date_time;
+
+-- get-user-offers: брони пользователя как покупателя
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservations_buyer_user_id
+    ON reservations(buyer_user_id);
+
+-- get-user-offers (брони по своим объявлениям, новые сверху), admin-complete-deal, cancel-reservation
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservations_offer_id_created_at
+    ON reservations(offer_id, created_at);
+
+-- Автодеактивация в get-active-offers и get-all-offers: условие через OR по двум колонкам
+-- читается BitmapOr по двум частичным индексам вместо прохода по всем активным объявлениям
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_offers_active_valid_until
+    ON offers(valid_until)
+    WHERE status = 'active';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_offers_active_time_end
+    ON offers(time_end)
+    WHERE status = 'active';
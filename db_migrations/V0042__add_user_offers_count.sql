@@ -0,0 +1,21 @@
+-- Денормализованный счётчик объявлений пользователя для списка в админке.
+-- Поддерживается create-offer, create-anonymous-offer и delete-offer,
+-- пересчитывается функцией rebuild-user-counters
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS offers_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE users u
+SET offers_count = o.offers_count
+FROM (
+    SELECT user_id, COUNT(*) AS offers_count
+    FROM offers
+    GROUP BY user_id
+) o
+WHERE u.id = o.user_id;
+
+COMMENT ON COLUMN users.offers_count IS 'Количество объявлений пользователя';
+
+-- users.created_at допускает NULL: get-all-users сортирует и строит курсор
+-- по COALESCE(created_at, 'epoch'), индекс повторяет это выражение
+DROP INDEX IF EXISTS idx_users_created_at_id;
+CREATE INDEX IF NOT EXISTS idx_users_created_at_epoch_id ON users((COALESCE(created_at, 'epoch'::timestamp)), id);
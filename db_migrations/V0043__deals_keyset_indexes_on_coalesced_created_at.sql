@@ -0,0 +1,6 @@
+-- deals.created_at допускает NULL: admin-get-deals и get-user-deals сортируют и строят
+-- курсор по COALESCE(created_at, 'epoch'), индексы повторяют это выражение
+DROP INDEX IF EXISTS idx_deals_created_at_id;
+DROP INDEX IF EXISTS idx_deals_user_created_at_id;
+CREATE INDEX IF NOT EXISTS idx_deals_created_at_epoch_id ON deals((COALESCE(created_at, 'epoch'::timestamp)), id);
+CREATE INDEX IF NOT EXISTS idx_deals_user_created_at_epoch_id ON deals(user_id, (COALESCE(created_at, 'epoch'::timestamp)), id);
@@ -0,0 +1,9 @@
+-- get-best-rates и get-market-depth фильтруют по окну действия объявления (valid_from,
+-- valid_until). Без этих колонок в INCLUDE стакан читает таблицу, новый индекс снова даёт
+-- index-only scan. CONCURRENTLY не блокирует запись; такие операторы Flyway выполняет вне
+-- транзакции, поэтому в файле нет ничего, кроме них
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_offers_status_city_type_rate_validity
+    ON offers(status, city, offer_type, rate)
+    INCLUDE (amount, time_end, valid_from, valid_until);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_offers_status_city_type_rate;
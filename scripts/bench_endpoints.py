@@ -0,0 +1,256 @@
+'''
+Business: End-to-end benchmark of backend handlers against seeded databases: latency percentiles, throughput, queries per request
+Args: --database label=DSN (repeat per dataset scale, default DATABASE_URL), --requests, --warmup, --concurrency,
+      --only (comma separated scenarios), --skip-writes, --output (JSON file), --compare (previous JSON), --seed
+Returns: Prints a table per dataset and writes JSON results that can be diffed between commits
+'''
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import db_instrumentation
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT_DIR / 'backend'
+
+def load_function(name: str):
+    """Import backend/<name>/index.py as a module"""
+    spec = importlib.util.spec_from_file_location(f"bench_{name.replace('-', '_')}", BACKEND_DIR / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class OfflineRequests:
+    """Stand-in for requests in handlers that notify Telegram: the benchmark must not call external services"""
+
+    @staticmethod
+    def post(*args, **kwargs):
+        return SimpleNamespace(status_code=200, ok=True, text='{}', json=lambda: {})
+
+    get = post
+
+
+def sample_context(dsn: str, rng: random.Random) -> dict:
+    """Ids the scenarios draw from: users, active offers with their windows and offices, reservations"""
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT id, COALESCE(username, name) FROM users WHERE COALESCE(blocked, false) = false ORDER BY random() LIMIT 2000")
+    users = cur.fetchall()
+    cur.execute("""
+        SELECT id, city, office_ids, time_start, time_end, COALESCE(valid_from, CURRENT_DATE), COALESCE(valid_until, CURRENT_DATE)
+        FROM offers
+        WHERE status = 'active' AND time_start IS NOT NULL AND cardinality(office_ids) > 0
+        ORDER BY random() LIMIT 2000
+    """)
+    offers = cur.fetchall()
+    cur.execute("SELECT id FROM reservations ORDER BY id DESC LIMIT 2000")
+    reservations = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT DISTINCT lower(left(name, 3)) FROM users LIMIT 200")
+    prefixes = [row[0] for row in cur.fetchall() if row[0]]
+    cur.close()
+    conn.close()
+    if not users or not offers:
+        raise SystemExit('Dataset has no users or active offers, run scripts/seed_data.py first')
+    return {'users': users, 'offers': offers, 'reservations': reservations or [0], 'prefixes': prefixes or ['a'],
+            'cities': sorted({offer[1] for offer in offers}), 'rng': rng}
+
+
+def get(params: dict) -> dict:
+    return {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': {k: str(v) for k, v in params.items()}}
+
+
+def post(body: dict) -> dict:
+    return {'httpMethod': 'POST', 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(body)}
+
+
+def reserve_event(ctx: dict) -> dict:
+    rng = ctx['rng']
+    offer_id, _, office_ids, time_start, time_end, valid_from, valid_until = rng.choice(ctx['offers'])
+    user_id, username = rng.choice(ctx['users'])
+    start = time_start.hour * 60 + time_start.minute
+    end = time_end.hour * 60 + time_end.minute
+    minutes = rng.randrange(start, max(end, start + 15), 15)
+    first_day = max(valid_from, date.today())
+    day = first_day + timedelta(days=rng.randint(0, max((valid_until - first_day).days, 0)))
+    return post({'offer_id': offer_id, 'slot_time': f"{minutes // 60:02d}:{minutes % 60:02d}",
+                 'slot_date': day.isoformat(), 'user_id': user_id, 'username': username,
+                 'meeting_office_id': rng.choice(office_ids), 'amount': 100})
+
+
+# name -> (function, writes, event builder)
+SCENARIOS = {
+    'get-active-offers': ('get-active-offers', False, lambda ctx: get({'city': ctx['rng'].choice(ctx['cities'])})),
+    'get-active-offers-3d': ('get-active-offers', False,
+                             lambda ctx: get({'city': ctx['rng'].choice(ctx['cities']), 'days': 3})),
+    'get-active-offers-narrow': ('get-active-offers', False,
+                                 lambda ctx: get({'city': ctx['rng'].choice(ctx['cities']), 'fields': 'rate,amount,offer_type'})),
+    'get-all-offers': ('get-all-offers', False, lambda ctx: get({})),
+    'get-user-offers': ('get-user-offers', False, lambda ctx: get({'user_id': ctx['rng'].choice(ctx['users'])[0]})),
+    'get-user-deals': ('get-user-deals', False,
+                       lambda ctx: get({'user_id': ctx['rng'].choice(ctx['users'])[0], 'limit': 50})),
+    'get-statistics': ('get-statistics', False, lambda ctx: get({'period': ctx['rng'].choice(('all_time', 'today', 'week'))})),
+    'get-statistics-user': ('get-statistics', False,
+                            lambda ctx: get({'period': 'week', 'user_id': ctx['rng'].choice(ctx['users'])[0]})),
+    'admin-get-deals-page': ('admin-get-deals', False, lambda ctx: get({'limit': 100})),
+    'admin-get-deals-filtered': ('admin-get-deals', False,
+                                 lambda ctx: get({'limit': 100, 'status': 'completed', 'deal_type': ctx['rng'].choice(('buy', 'sell')),
+                                                  'date_from': (date.today() - timedelta(days=30)).isoformat()})),
+    'get-all-users-search': ('get-all-users', False,
+                             lambda ctx: get({'q': ctx['rng'].choice(ctx['prefixes']), 'limit': 50, 'with_stats': 1})),
+    'get-best-rates': ('get-best-rates', False, lambda ctx: get({'city': ctx['rng'].choice(ctx['cities'])})),
+    'get-market-depth': ('get-market-depth', False, lambda ctx: get({'city': ctx['rng'].choice(ctx['cities'])})),
+    'match-offers': ('match-offers', False, lambda ctx: get({'offer_id': ctx['rng'].choice(ctx['offers'])[0]})),
+    'check-reservation-status': ('check-reservation-status', False,
+                                 lambda ctx: get({'reservation_id': ctx['rng'].choice(ctx['reservations'])})),
+    'reserve-offer': ('reserve-offer', True, reserve_event),
+}
+
+
+def percentile(values: list, p: float) -> float:
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def run_scenario(handler, build_event, ctx: dict, requests: int, warmup: int, concurrency: int) -> dict:
+    """Warm the function, then time requests; a 5xx or an exception counts as an error"""
+    for _ in range(warmup):
+        handler(build_event(ctx), SimpleNamespace(request_id='warmup'))
+
+    events = [build_event(ctx) for _ in range(requests)]
+    statuses = {}
+    lock = threading.Lock()
+
+    def call(event):
+        db_instrumentation.start_request()
+        started = time.perf_counter()
+        try:
+            status = handler(event, SimpleNamespace(request_id='bench')).get('statusCode', 200)
+        except Exception:
+            status = 'exception'
+        elapsed = (time.perf_counter() - started) * 1000
+        queries = len(db_instrumentation.finish_request())
+        with lock:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return elapsed, queries
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(call, events))
+    else:
+        samples = [call(event) for event in events]
+    wall = time.perf_counter() - started
+
+    latencies = sorted(sample[0] for sample in samples)
+    errors = sum(count for status, count in statuses.items() if status == 'exception' or status.startswith('5'))
+    return {
+        'requests': requests,
+        'errors': errors,
+        'statuses': statuses,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(latencies[-1], 3),
+        'throughput_rps': round(requests / wall, 1),
+        'queries_per_request': round(sum(sample[1] for sample in samples) / len(samples), 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_comparison(results: dict, baseline: dict):
+    """Relative change of p95 and queries per request against a previous run"""
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('created_at')})")
+    for label, scenarios in results.items():
+        for name, current in scenarios.items():
+            previous = baseline.get('results', {}).get(label, {}).get(name)
+            if not previous:
+                continue
+            p95_change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0
+            print(f"  {label:<10} {name:<26} p95 {previous['p95_ms']:8.2f} -> {current['p95_ms']:8.2f}ms ({p95_change:+6.1f}%)"
+                  f"  queries {previous['queries_per_request']:.1f} -> {current['queries_per_request']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database', action='append', default=[], help='label=DSN, one per dataset scale')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--skip-writes', action='store_true', help='skip scenarios that insert rows (reserve-offer)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='JSON results path, default bench_results/<commit>.json')
+    parser.add_argument('--compare', help='previous JSON results to diff against')
+    args = parser.parse_args()
+
+    databases = [value.split('=', 1) for value in args.database] or [['default', os.environ.get('DATABASE_URL')]]
+    if any(not dsn for _, dsn in databases):
+        raise SystemExit('Pass --database label=DSN or set DATABASE_URL')
+    selected = args.only.split(',') if args.only else list(SCENARIOS)
+    unknown = set(selected) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.skip_writes:
+        selected = [name for name in selected if not SCENARIOS[name][1]]
+
+    db_instrumentation.install()
+    results = {}
+    for label, dsn in databases:
+        os.environ['DATABASE_URL'] = dsn
+        ctx = sample_context(dsn, random.Random(args.seed))
+        print(f"{label}: {len(ctx['users'])} sampled users, {len(ctx['offers'])} sampled active offers")
+        print(f"  {'scenario':<26}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>9}{'queries':>9}  statuses")
+        results[label] = {}
+        for name in selected:
+            function, _, build_event = SCENARIOS[name]
+            # Свежий модуль на каждый набор данных: кэши в памяти не переносятся между масштабами
+            module = load_function(function)
+            if hasattr(module, 'requests'):
+                module.requests = OfflineRequests
+            ctx['rng'] = random.Random(f"{args.seed}:{name}")
+            stats = run_scenario(module.handler, build_event, ctx, args.requests, args.warmup, args.concurrency)
+            results[label][name] = stats
+            print(f"  {name:<26}{stats['p50_ms']:9.2f}{stats['p95_ms']:9.2f}{stats['p99_ms']:9.2f}"
+                  f"{stats['throughput_rps']:9.1f}{stats['queries_per_request']:9.1f}  {stats['statuses']}")
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'results': results,
+    }
+    output = Path(args.output) if args.output else ROOT_DIR / 'bench_results' / f"{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"\nResults written to {output}", file=sys.stderr)
+
+    if args.compare:
+        print_comparison(results, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == '__main__':
+    main()
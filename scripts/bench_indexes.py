@@ -0,0 +1,117 @@
+'''
+Business: Measure what an index migration buys the handlers it targets: benchmark without its indexes, apply it, benchmark again
+Args: --database DSN (seeded throwaway database, default DATABASE_URL), --migration (default the latest index pack),
+      --only, --requests, --warmup, --seed
+Returns: Prints p50/p95 and the change per scenario; the database is left with the migration applied
+'''
+import argparse
+import os
+import random
+import re
+import sys
+from pathlib import Path
+
+import bench_endpoints
+import db_instrumentation
+
+MIGRATIONS_DIR = bench_endpoints.ROOT_DIR / 'db_migrations'
+DEFAULT_MIGRATION = MIGRATIONS_DIR / 'V0041__add_live_reservation_and_active_offer_indexes.sql'
+# Сценарии, чьи запросы затрагивает V0041
+DEFAULT_SCENARIOS = ('reserve-offer', 'get-user-offers', 'get-active-offers', 'get-active-offers-3d', 'match-offers')
+
+CREATED = re.compile(r'CREATE\s+INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)', re.I)
+DROPPED = re.compile(r'DROP\s+INDEX\s+CONCURRENTLY\s+IF\s+EXISTS\s+(\w+)', re.I)
+
+
+def statements(path: Path) -> list:
+    """SQL statements of a migration file without comments"""
+    text = re.sub(r'--[^\n]*', '', path.read_text())
+    return [statement.strip() for statement in text.split(';') if statement.strip()]
+
+
+def previous_definition(name: str, before: Path) -> str:
+    """CREATE INDEX of an index that the migration drops, from the migration that introduced it"""
+    pattern = re.compile(rf'CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?{name}\b[^;]*;', re.I)
+    for path in sorted(MIGRATIONS_DIR.glob('V*.sql'), reverse=True):
+        if path.name >= before.name:
+            continue
+        match = pattern.search(path.read_text())
+        if match:
+            return match.group(0)
+    raise SystemExit(f'No earlier migration creates {name}')
+
+
+def run(conn, sql_statements: list):
+    cur = conn.cursor()
+    for sql in sql_statements:
+        cur.execute(sql)
+    cur.execute('ANALYZE reservations')
+    cur.execute('ANALYZE offers')
+    cur.close()
+
+
+def bench(selected: list, ctx: dict, args) -> dict:
+    results = {}
+    for name in selected:
+        function, _, build_event = bench_endpoints.SCENARIOS[name]
+        module = bench_endpoints.load_function(function)
+        if hasattr(module, 'requests'):
+            module.requests = bench_endpoints.OfflineRequests
+        ctx['rng'] = random.Random(f"{args.seed}:{name}")
+        results[name] = bench_endpoints.run_scenario(module.handler, build_event, ctx, args.requests, args.warmup, 1)
+        print(f"  {name:<26}{results[name]['p50_ms']:9.2f}{results[name]['p95_ms']:9.2f}  {results[name]['statuses']}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database', default=os.environ.get('DATABASE_URL'), help='seeded database, see seed_data.py')
+    parser.add_argument('--migration', default=str(DEFAULT_MIGRATION))
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if not args.database:
+        raise SystemExit('Pass --database DSN or set DATABASE_URL')
+    migration = Path(args.migration)
+    apply = statements(migration)
+    created = [name for sql in apply for name in CREATED.findall(sql)]
+    dropped = [name for sql in apply for name in DROPPED.findall(sql)]
+    # Состояние до миграции: без её индексов и с теми, что она удаляет
+    revert = [f'DROP INDEX CONCURRENTLY IF EXISTS {name}' for name in created]
+    revert += [previous_definition(name, migration).rstrip(';') for name in dropped]
+    selected = args.only.split(',') if args.only else list(DEFAULT_SCENARIOS)
+
+    import psycopg2
+
+    os.environ['DATABASE_URL'] = args.database
+    # Ответы get-active-offers не должны приходить из кэша, иначе запросы к броням не выполняются
+    os.environ['RESPONSE_CACHE_TTL'] = '0'
+    db_instrumentation.install()
+    conn = psycopg2.connect(args.database)
+    conn.autocommit = True
+    ctx = bench_endpoints.sample_context(args.database, random.Random(args.seed))
+    header = f"  {'scenario':<26}{'p50':>9}{'p95':>9}  statuses"
+    try:
+        run(conn, revert)
+        print(f"Without {migration.name}\n{header}")
+        before = bench(selected, ctx, args)
+        run(conn, apply)
+        print(f"With {migration.name}\n{header}")
+        after = bench(selected, ctx, args)
+    finally:
+        conn.close()
+
+    print(f"\n  {'scenario':<26}{'p50 before/after':>24}{'p95 before/after':>24}{'p95 change':>12}")
+    for name in selected:
+        old, new = before[name], after[name]
+        change = (new['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0
+        print(f"  {name:<26}{old['p50_ms']:11.2f} /{new['p50_ms']:10.2f}{old['p95_ms']:13.2f} /{new['p95_ms']:10.2f}"
+              f"{change:+11.1f}%")
+    print(f"\n{migration.name} is applied on {args.database.rsplit('@', 1)[-1]}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
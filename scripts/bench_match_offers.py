@@ -0,0 +1,86 @@
+'''
+Business: Benchmark match-offers order book queries on a synthetic book
+Args: --offers (book size, default 100000), --queries, --seed
+Returns: Prints build time and per-query latency percentiles in microseconds
+'''
+import argparse
+import importlib.util
+import random
+import statistics
+import time
+from datetime import date
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+CITIES = ['Москва', 'Кемерово', 'Новокузнецк', 'Новосибирск', 'Томск', 'Барнаул', 'Красноярск', 'Омск']
+OFFICES_PER_CITY = 6
+
+
+def load_match_offers():
+    """Import backend/match-offers/index.py as a module"""
+    spec = importlib.util.spec_from_file_location('match_offers', BACKEND_DIR / 'match-offers' / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_entry(module, rng: random.Random, offer_id: int):
+    """Generate an offer with realistic skew: a few big cities, rates around 95 RUB"""
+    city_index = min(int(rng.expovariate(0.6)), len(CITIES) - 1)
+    city = CITIES[city_index]
+    side = rng.choice(('buy', 'sell'))
+    rate = round(rng.gauss(95.0, 1.5), 2)
+    first_office_id = city_index * OFFICES_PER_CITY + 1
+    offices = rng.sample(range(first_office_id, first_office_id + OFFICES_PER_CITY), rng.randint(1, 3))
+    start = rng.randrange(8 * 60, 20 * 60, 15)
+    end = min(start + rng.choice((60, 120, 180, 240, 480)), 24 * 60)
+    return module.BookEntry(offer_id, rng.randrange(1, 20000), side, float(rng.randrange(100, 20000, 50)),
+                            rate, city, offices, start, end, 1_700_000_000 + offer_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--offers', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=2_000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    module = load_match_offers()
+    rng = random.Random(args.seed)
+
+    entries = [random_entry(module, rng, offer_id) for offer_id in range(1, args.offers + 1)]
+    book = module.OrderBook()
+    started = time.perf_counter()
+    for entry in entries:
+        book.upsert(entry)
+    build_seconds = time.perf_counter() - started
+
+    probes = [entries[rng.randrange(len(entries))] for _ in range(args.queries)]
+    latencies = []
+    found = 0
+    for entry in probes:
+        started = time.perf_counter()
+        found += len(book.match(entry, date.today(), limit=args.limit, not_before=9 * 60))
+        latencies.append((time.perf_counter() - started) * 1_000_000)
+
+    updates = []
+    for entry in probes[:500]:
+        started = time.perf_counter()
+        book.remove(entry.id)
+        book.upsert(entry)
+        updates.append((time.perf_counter() - started) * 1_000_000)
+
+    latencies.sort()
+    percentile = lambda values, p: values[min(int(len(values) * p), len(values) - 1)]
+    print(f"book: {len(book)} offers in {len(book.books)} books, built in {build_seconds:.2f}s")
+    print(f"match: {args.queries} queries, {found / args.queries:.1f} candidates avg")
+    print(f"  mean {statistics.mean(latencies):.1f}us  p50 {percentile(latencies, 0.5):.1f}us  "
+          f"p95 {percentile(latencies, 0.95):.1f}us  p99 {percentile(latencies, 0.99):.1f}us  "
+          f"max {latencies[-1]:.1f}us")
+    print(f"update (remove + upsert): mean {statistics.mean(updates):.1f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''
+Business: Benchmark admin-get-deals response building: per-field conversion + json.dumps vs column map + to_json
+Args: --rows (comma separated sizes, default 10000,100000), --repeat
+Returns: Prints best time per approach and the speedup over the old loop
+'''
+import argparse
+import importlib.util
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+
+def load_admin_get_deals():
+    """Import backend/admin-get-deals/index.py as a module"""
+    spec = importlib.util.spec_from_file_location('admin_get_deals', BACKEND_DIR / 'admin-get-deals' / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_rows(count: int, numeric_as_float: bool):
+    """Deal rows as psycopg2 returns them: NUMERIC as Decimal, or float8 after the SQL cast"""
+    rng = random.Random(42)
+    started = datetime(2025, 1, 1)
+    rows = []
+    for deal_id in range(1, count + 1):
+        amount = Decimal(rng.randrange(100, 20000, 50))
+        rate = Decimal(f"{rng.uniform(90, 100):.2f}")
+        total = (amount * rate).quantize(Decimal('0.01'))
+        if numeric_as_float:
+            amount, rate, total = float(amount), float(rate), float(total)
+        created = started + timedelta(seconds=deal_id * 37)
+        rows.append((deal_id, rng.randrange(1, 5000), f"Пользователь {deal_id % 977}", f"user{deal_id}@mail.ru",
+                     '+79990000000', rng.choice(('buy', 'sell')), amount, rate, total, 'completed',
+                     'Партнёр', created, created))
+    return rows
+
+
+def legacy(rows):
+    """What admin-get-deals did before: convert every field, then json.dumps"""
+    deals = []
+    for deal in rows:
+        deals.append({
+            'id': deal[0],
+            'user_id': deal[1],
+            'username': deal[2],
+            'email': deal[3],
+            'phone': deal[4],
+            'deal_type': deal[5],
+            'amount': float(deal[6]) if deal[6] else 0,
+            'rate': float(deal[7]) if deal[7] else 0,
+            'total': float(deal[8]) if deal[8] else 0,
+            'status': deal[9],
+            'partner_name': deal[10],
+            'created_at': deal[11].isoformat() if deal[11] else None,
+            'updated_at': deal[12].isoformat() if deal[12] else None
+        })
+    return json.dumps({'success': True, 'deals': deals})
+
+
+def best_of(repeat: int, func, *args) -> float:
+    """Best wall time in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', default='10000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    module = load_admin_get_deals()
+    orjson = module.orjson
+
+    def column_map(rows):
+        return module.to_json({'success': True, 'deals': [dict(zip(module.DEAL_COLUMNS, row)) for row in rows]})
+
+    def column_map_stdlib(rows):
+        module.orjson = None
+        try:
+            return column_map(rows)
+        finally:
+            module.orjson = orjson
+
+    print(f"orjson: {'available' if orjson else 'not installed'}")
+    for count in [int(value) for value in args.rows.split(',')]:
+        decimal_rows = make_rows(count, numeric_as_float=False)
+        float_rows = make_rows(count, numeric_as_float=True)
+        assert json.loads(legacy(decimal_rows)) == json.loads(column_map(float_rows))
+
+        baseline = best_of(args.repeat, legacy, decimal_rows)
+        print(f"{count} rows")
+        print(f"  legacy loop + json.dumps          {baseline:8.1f}ms")
+        for name, func, rows in (
+            ('column map, Decimal via default', column_map, decimal_rows),
+            ('column map, float8 from SQL', column_map, float_rows),
+            ('column map, float8, stdlib json', column_map_stdlib, float_rows),
+        ):
+            elapsed = best_of(args.repeat, func, rows)
+            print(f"  {name:<34}{elapsed:8.1f}ms  x{baseline / elapsed:.1f}")
+
+
+if __name__ == '__main__':
+    main()
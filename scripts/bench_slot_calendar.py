@@ -0,0 +1,117 @@
+'''
+Business: Benchmark get-active-offers slot computation: old per-slot string loop, per-offer bitmaps, one-pass book
+Args: --sizes (offer counts, default 1000,10000,100000), --days (calendar horizon), --reservations, --seed
+Returns: Prints time to compute available slots for all offers with each approach
+'''
+import argparse
+import importlib.util
+import random
+import time
+from datetime import date, time as dt_time, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+OFFICES = 48
+
+
+def load_get_active_offers():
+    """Import backend/get-active-offers/index.py as a module"""
+    spec = importlib.util.spec_from_file_location('get_active_offers', BACKEND_DIR / 'get-active-offers' / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_offer(rng: random.Random, today: date, days: int):
+    """Offer window, its offices and validity range"""
+    start = rng.randrange(8 * 60, 20 * 60, 15)
+    end = min(start + rng.choice((60, 120, 240, 480)), 24 * 60 - 15)
+    offices = rng.sample(range(1, OFFICES + 1), rng.randint(1, 3))
+    valid_until = today + timedelta(days=rng.randrange(days))
+    return dt_time(start // 60, start % 60), dt_time(end // 60, end % 60), offices, valid_until
+
+
+def legacy_slots(time_start, time_end, office_ids, reserved, day, now_time):
+    """Old algorithm: walk the window and format a string key per slot and office"""
+    slots = []
+    minutes, end = time_start.hour * 60 + time_start.minute, time_end.hour * 60 + time_end.minute
+    while minutes < end:
+        slot = dt_time(minutes // 60, minutes % 60)
+        if slot > now_time and not any(f"{day}|{slot.strftime('%H:%M')}|{oid}" in reserved for oid in office_ids):
+            slots.append(slot.strftime('%H:%M'))
+        minutes += 15
+    return slots
+
+
+def run_legacy(offers, reservations, today, now_time):
+    """Old loop with HH:MM|office string keys"""
+    reserved = {f"{d}|{t.strftime('%H:%M')}|{oid}" for d, t, oid in reservations}
+    total = 0
+    for time_start, time_end, office_ids, valid_until in offers:
+        day = today
+        while day <= valid_until:
+            total += len(legacy_slots(time_start, time_end, office_ids, reserved, day,
+                                      now_time if day == today else dt_time(0, 0)))
+            day += timedelta(days=1)
+    return total
+
+
+def run_per_offer(module, offers, reservations, today, last_day, today_mask):
+    """Bitmaps, but every offer computes its own window, busy union and labels"""
+    busy = module.build_busy_calendar(reservations)
+    total = 0
+    for time_start, time_end, office_ids, valid_until in offers:
+        window = module.window_mask(time_start, time_end)
+        for day in module.offer_days(None, valid_until, today, last_day):
+            free = window & today_mask if day == today else window
+            for office_id in office_ids:
+                free &= ~busy.get((office_id, day), 0)
+            total += len(module.mask_to_slots(free))
+    return total
+
+
+def run_book(module, offers, reservations, today, last_day, today_mask):
+    """What the handler does: one pass over the whole book"""
+    busy = module.build_busy_calendar(reservations)
+    entries = [(time_start, time_end, office_ids, None, valid_until)
+               for time_start, time_end, office_ids, valid_until in offers]
+    book = module.compute_book_slots(entries, busy, today, last_day, today_mask)
+    return sum(len(slots) for days in book for _, slots in days)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--reservations', type=int, default=3_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    module = load_get_active_offers()
+    today = date(2026, 1, 1)
+    last_day = today + timedelta(days=args.days - 1)
+    now_time = dt_time(12, 7)
+    today_mask = module.slots_after(now_time.hour * 3600 + now_time.minute * 60)
+
+    for size in [int(value) for value in args.sizes.split(',')]:
+        rng = random.Random(args.seed)
+        offers = [random_offer(rng, today, args.days) for _ in range(size)]
+        reservations = [
+            (today + timedelta(days=rng.randrange(args.days)), dt_time(rng.randrange(8, 24), rng.choice((0, 15, 30, 45))),
+             rng.randrange(1, OFFICES + 1))
+            for _ in range(args.reservations)
+        ]
+
+        print(f"{size} offers, {args.days} days, {args.reservations} reservations")
+        for name, run in (
+            ('legacy loop', lambda: run_legacy(offers, reservations, today, now_time)),
+            ('per-offer bitmaps', lambda: run_per_offer(module, offers, reservations, today, last_day, today_mask)),
+            ('one-pass book', lambda: run_book(module, offers, reservations, today, last_day, today_mask)),
+        ):
+            started = time.perf_counter()
+            total = run()
+            print(f"  {name:<18} {(time.perf_counter() - started) * 1000:9.1f}ms  {total} slots")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+'''
+Business: Check that get-active-offers lists an offer on exactly the days match-offers can match it,
+          for every combination of NULL, past, current and future valid_from/valid_until
+Args: --days (listing horizon, default 3)
+Returns: Prints the disagreeing cases; exit code 1 when the two functions disagree with each other or with the rule
+'''
+import argparse
+import sys
+from datetime import date, datetime, time, timedelta
+
+import bench_endpoints
+
+
+def expected_days(valid_from, valid_until, today: date, last_day: date) -> list:
+    """The rule: NULL valid_from - already started, NULL valid_until - today only"""
+    first = max(valid_from or today, today)
+    last = min(valid_until or today, last_day)
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=3)
+    args = parser.parse_args()
+
+    listing = bench_endpoints.load_function('get-active-offers')
+    matching = bench_endpoints.load_function('match-offers')
+    today = date.today()
+    last_day = today + timedelta(days=args.days - 1)
+    created = datetime.combine(today - timedelta(days=1), time(9))
+    choices = [None] + [today + timedelta(days=offset) for offset in (-2, -1, 0, 1, 2)]
+
+    failures = []
+    for valid_from in choices:
+        for valid_until in choices:
+            expected = expected_days(valid_from, valid_until, today, last_day)
+            listed = listing.offer_days(valid_from, valid_until, today, last_day)
+            # Строка в порядке OFFER_COLUMNS; объявление создано вчера, чтобы NULL valid_until
+            # не совпадал с днём создания
+            entry = matching.BookEntry.from_row((1, 1, 'sell', 100, 90, 'Москва', [], time(10), time(11), None,
+                                                 created, False, 'active', valid_from, valid_until))
+            matchable = entry.valid_on(today)
+            if listed != expected or matchable != (today in expected):
+                failures.append(f"  valid_from={valid_from} valid_until={valid_until}: expected {list(map(str, expected))}, "
+                                f"get-active-offers {list(map(str, listed))}, match-offers {'matches' if matchable else 'skips'} today")
+
+    if failures:
+        print('\n'.join(failures))
+        sys.exit(1)
+    print(f"{len(choices) ** 2} validity cases agree", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
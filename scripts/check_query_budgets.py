@@ -0,0 +1,99 @@
+'''
+Business: Fail when a handler runs more SQL statements than its budget or repeats one statement per row (N+1)
+Args: --database label=DSN (repeat, smallest dataset first; default DATABASE_URL), --requests, --only,
+      --skip-writes, --budgets (JSON, default scripts/query_budgets.json), --seed
+Returns: Prints per-scenario query counts for every dataset; exit code 1 with the offending statements on any violation
+'''
+import argparse
+import json
+import os
+import random
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import bench_endpoints
+import db_instrumentation
+
+BUDGETS_PATH = Path(__file__).resolve().parent / 'query_budgets.json'
+
+
+def profile_scenario(name: str, ctx: dict, requests: int) -> list:
+    """Statements of every request of a scenario, after one warm-up call"""
+    function, _, build_event = bench_endpoints.SCENARIOS[name]
+    module = bench_endpoints.load_function(function)
+    if hasattr(module, 'requests'):
+        module.requests = bench_endpoints.OfflineRequests
+    module.handler(build_event(ctx), SimpleNamespace(request_id='warmup'))
+    runs = []
+    for _ in range(requests):
+        db_instrumentation.start_request()
+        module.handler(build_event(ctx), SimpleNamespace(request_id='budget'))
+        runs.append(db_instrumentation.finish_request())
+    return runs
+
+
+def describe(statements: list) -> str:
+    return '\n'.join(f"      {statement.duration_ms:7.2f}ms rows={statement.rowcount:<6} {statement.sql[:160]}"
+                     for statement in statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database', action='append', default=[], help='label=DSN, smallest dataset first')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--skip-writes', action='store_true')
+    parser.add_argument('--budgets', default=str(BUDGETS_PATH))
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    config = json.loads(Path(args.budgets).read_text())
+    budgets = config['budgets']
+    default_repeats = config.get('default_max_repeats', 2)
+    databases = [value.split('=', 1) for value in args.database] or [['default', os.environ.get('DATABASE_URL')]]
+    if any(not dsn for _, dsn in databases):
+        raise SystemExit('Pass --database label=DSN or set DATABASE_URL')
+    selected = args.only.split(',') if args.only else list(budgets)
+    if args.skip_writes:
+        selected = [name for name in selected if not bench_endpoints.SCENARIOS[name][1]]
+
+    db_instrumentation.install()
+    failures = []
+    peak = {}
+    for label, dsn in databases:
+        os.environ['DATABASE_URL'] = dsn
+        ctx = bench_endpoints.sample_context(dsn, random.Random(args.seed))
+        print(f"{label}")
+        for name in selected:
+            budget = budgets[name]
+            max_repeats = budget.get('max_repeats', default_repeats)
+            ctx['rng'] = random.Random(f"{args.seed}:{name}")
+            runs = profile_scenario(name, ctx, args.requests)
+            worst = max(runs, key=len)
+            worst_repeat = max(runs, key=lambda run: max(db_instrumentation.repeated(run).values(), default=0))
+            repeats = max(db_instrumentation.repeated(worst_repeat).values(), default=0)
+            problems = []
+            if len(worst) > budget['max_queries']:
+                problems.append((f"{len(worst)} statements, budget {budget['max_queries']}", worst))
+            if repeats > max_repeats:
+                problems.append((f"one statement ran {repeats} times in a request, limit {max_repeats} (per-row query?)",
+                                 worst_repeat))
+            # Число запросов не должно расти вместе с объёмом данных
+            if name in peak and len(worst) > peak[name][1]:
+                problems.append((f"{len(worst)} statements vs {peak[name][1]} on {peak[name][0]}: grows with data", worst))
+            peak[name] = (label, max(len(worst), peak.get(name, (label, 0))[1]))
+            print(f"  {'FAIL' if problems else 'ok':<5}{name:<26} max {len(worst):>3} / {budget['max_queries']:<3}"
+                  f" repeats {repeats} / {max_repeats}")
+            for message, statements in problems:
+                failures.append(f"{label} {name}: {message}\n{describe(statements)}")
+
+    if failures:
+        print('\nQuery budget violations:', file=sys.stderr)
+        for failure in failures:
+            print(f"  {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
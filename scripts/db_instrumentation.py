@@ -0,0 +1,171 @@
+'''
+Business: Record every SQL statement a handler runs: fingerprint, duration and row count per request
+Args: Library for scripts: install() wraps psycopg2.connect and psycopg.connect, start_request()/finish_request()
+      bracket one handler call
+Returns: finish_request() gives the list of Statement records of the current thread's request; query and params
+         keep the statement as executed so it can be re-run under EXPLAIN
+'''
+import hashlib
+import importlib
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+
+Statement = namedtuple('Statement', 'fingerprint sql duration_ms rowcount query params', defaults=(None, None))
+
+_local = threading.local()
+_installed = False
+
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'%\(\w+\)s|%s|\$\d+')
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(sql) -> str:
+    """Statement text with literals and parameters replaced by ?, so per-row variants of a query look the same"""
+    if isinstance(sql, bytes):
+        sql = sql.decode()
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    text = _COMMENTS.sub(' ', sql)
+    text = _STRINGS.sub('?', text)
+    text = _PLACEHOLDERS.sub('?', text)
+    text = _NUMBERS.sub('?', text)
+    text = _LISTS.sub('(?)', text)
+    return _SPACES.sub(' ', text).strip().lower()
+
+
+def fingerprint(sql) -> str:
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:12]
+
+
+def _record(sql, started: float, cursor=None, params=None):
+    statements = getattr(_local, 'statements', None)
+    if statements is None:
+        return
+    rowcount = getattr(cursor, 'rowcount', -1) if cursor is not None else -1
+    statements.append(Statement(fingerprint(sql), normalize(sql), (time.perf_counter() - started) * 1000, rowcount,
+                                sql, params))
+
+
+def _params(args: tuple, kwargs: dict):
+    """Query parameters of an execute call, positional or passed as vars= (psycopg2) / params= (psycopg 3)"""
+    if args:
+        return args[0]
+    return kwargs.get('vars', kwargs.get('params'))
+
+
+class InstrumentedCursor:
+    """Cursor proxy that records execute/executemany/copy_expert"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, *args, **kwargs)
+        finally:
+            _record(sql, started, self._cursor, _params(args, kwargs))
+
+    def executemany(self, sql, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, *args, **kwargs)
+        finally:
+            _record(sql, started, self._cursor)
+
+    def copy_expert(self, sql, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.copy_expert(sql, *args, **kwargs)
+        finally:
+            _record(sql, started, self._cursor)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        if name == '_cursor':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+
+class InstrumentedConnection:
+    """Connection proxy handing out instrumented cursors (psycopg2 and psycopg 3)"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def execute(self, sql, *args, **kwargs):
+        started = time.perf_counter()
+        cursor = None
+        try:
+            cursor = self._conn.execute(sql, *args, **kwargs)
+            return cursor
+        finally:
+            _record(sql, started, cursor, _params(args, kwargs))
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name == '_conn':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+
+def install():
+    """Wrap psycopg2.connect and psycopg.connect once; handlers call them at request time, so all connections are seen"""
+    global _installed
+    if _installed:
+        return
+    for driver_name in ('psycopg2', 'psycopg'):
+        try:
+            driver = importlib.import_module(driver_name)
+        except ImportError:
+            continue
+        connect = driver.connect
+        driver.connect = lambda *args, _connect=connect, **kwargs: InstrumentedConnection(_connect(*args, **kwargs))
+    _installed = True
+
+
+def start_request():
+    _local.statements = []
+
+
+def finish_request() -> list:
+    statements = getattr(_local, 'statements', None) or []
+    _local.statements = None
+    return statements
+
+
+def repeated(statements: list) -> Counter:
+    """How many times each fingerprint ran in one request; more than a couple means a per-row query"""
+    return Counter(statement.fingerprint for statement in statements)
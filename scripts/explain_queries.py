@@ -0,0 +1,196 @@
+'''
+Business: Capture the SQL each benchmark scenario runs, EXPLAIN ANALYZE it on a seeded database and flag
+          sequential scans, expensive plan nodes and on-disk sorts, with suggested indexes
+Args: --database DSN (default DATABASE_URL), --only, --skip-writes, --requests, --seed, --min-rows,
+      --node-share, --snapshot-dir (default scripts/query_plans), --check
+Returns: Prints findings per scenario and writes one plan-shape snapshot per scenario; with --check exit code 1
+         when a snapshot changed instead of rewriting it
+'''
+import argparse
+import difflib
+import os
+import random
+import re
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import bench_endpoints
+import db_instrumentation
+
+SNAPSHOT_DIR = Path(__file__).resolve().parent / 'query_plans'
+EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete', 'values')
+# Условия в Filter вида "(col = ...)" или "((col)::text = ...)": равенства идут в индекс первыми, диапазоны после
+CONDITION = re.compile(r'\(+(?:\w+\.)?(\w+)\)?(?:::[\w ]+?)?\s+(=|<=|>=|<|>|~~)\s')
+SQL_WORDS = {'and', 'or', 'not', 'any', 'all', 'null', 'true', 'false', 'now', 'current_date', 'lower', 'upper'}
+
+
+def capture(name: str, ctx: dict, requests: int) -> list:
+    """First execution of every distinct statement a scenario runs, in order, after one warm-up call"""
+    function, _, build_event = bench_endpoints.SCENARIOS[name]
+    module = bench_endpoints.load_function(function)
+    if hasattr(module, 'requests'):
+        module.requests = bench_endpoints.OfflineRequests
+    module.handler(build_event(ctx), SimpleNamespace(request_id='warmup'))
+    seen = {}
+    for _ in range(requests):
+        db_instrumentation.start_request()
+        module.handler(build_event(ctx), SimpleNamespace(request_id='explain'))
+        for statement in db_instrumentation.finish_request():
+            seen.setdefault(statement.fingerprint, statement)
+    return list(seen.values())
+
+
+def explain(conn, statement) -> dict:
+    """EXPLAIN (ANALYZE, BUFFERS) inside a transaction that is rolled back, so write statements change nothing"""
+    query = statement.query
+    if hasattr(query, 'as_string'):
+        query = query.as_string(getattr(conn, '_conn', conn))
+    elif isinstance(query, bytes):
+        query = query.decode()
+    cur = conn.cursor()
+    try:
+        cur.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query, statement.params)
+        return cur.fetchone()[0][0]
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def walk(node: dict, depth: int = 0):
+    yield node, depth
+    for child in node.get('Plans', []):
+        yield from walk(child, depth + 1)
+
+
+def own_time(node: dict) -> float:
+    """Time spent in the node itself: its total over all loops minus that of its children"""
+    total = node.get('Actual Total Time', 0) * node.get('Actual Loops', 1)
+    children = sum(child.get('Actual Total Time', 0) * child.get('Actual Loops', 1) for child in node.get('Plans', []))
+    return max(total - children, 0.0)
+
+
+def suggest_index(node: dict) -> str:
+    """Index over the filtered columns of a sequential scan, equality columns first; a starting point for review"""
+    equality, ranges = [], []
+    for column, operator in CONDITION.findall(node.get('Filter', '')):
+        if column.lower() in SQL_WORDS or column.isdigit() or column in equality or column in ranges:
+            continue
+        (equality if operator == '=' else ranges).append(column)
+    columns = equality + ranges[:1]
+    if not columns:
+        return ''
+    return f"CREATE INDEX CONCURRENTLY ON {node['Relation Name']}({', '.join(columns)});"
+
+
+def findings(plan: dict, min_rows: int, node_share: float) -> list:
+    """Human readable problems of one analyzed plan"""
+    execution = plan.get('Execution Time', 0.0)
+    problems = []
+    for node, _ in walk(plan['Plan']):
+        kind = node['Node Type']
+        if kind == 'Seq Scan':
+            loops = node.get('Actual Loops', 1)
+            scanned = (node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)) * loops
+            if scanned >= min_rows:
+                message = f"Seq Scan on {node['Relation Name']}: {scanned} rows read, {node.get('Actual Rows', 0) * loops} kept"
+                index = suggest_index(node)
+                problems.append(message + (f"\n        suggest: {index}" if index else ''))
+        if 'external' in node.get('Sort Method', ''):
+            problems.append(f"Sort spilled to disk ({node.get('Sort Space Used')} kB): raise work_mem or sort by an index")
+        spent = own_time(node)
+        if execution and spent >= 1.0 and spent >= node_share * execution:
+            target = node.get('Relation Name') or node.get('Index Name') or ''
+            problems.append(f"{kind}{' on ' + target if target else ''} takes {spent:.1f} of {execution:.1f} ms")
+    return problems
+
+
+def plan_shape(plan: dict) -> str:
+    """Plan tree without costs, timings and literal values: it only changes when the chosen plan does"""
+    lines = []
+    for node, depth in walk(plan['Plan']):
+        parts = [node['Node Type']]
+        if node.get('Relation Name'):
+            parts.append(f"on {node['Relation Name']}")
+        if node.get('Index Name'):
+            parts.append(f"using {node['Index Name']}")
+        for key in ('Index Cond', 'Recheck Cond', 'Hash Cond', 'Merge Cond', 'Join Filter', 'Filter'):
+            if node.get(key):
+                parts.append(f"[{key}: {db_instrumentation.normalize(node[key])}]")
+        lines.append('  ' * depth + ' '.join(parts))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database', default=os.environ.get('DATABASE_URL'), help='seeded database, see seed_data.py')
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--skip-writes', action='store_true')
+    parser.add_argument('--requests', type=int, default=5, help='calls per scenario to collect statements from')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--min-rows', type=int, default=1000, help='report sequential scans reading at least this many rows')
+    parser.add_argument('--node-share', type=float, default=0.5, help='report nodes taking this share of execution time')
+    parser.add_argument('--snapshot-dir', default=str(SNAPSHOT_DIR))
+    parser.add_argument('--check', action='store_true', help='compare with the snapshots instead of writing them')
+    args = parser.parse_args()
+
+    if not args.database:
+        raise SystemExit('Pass --database DSN or set DATABASE_URL')
+    os.environ['DATABASE_URL'] = args.database
+    selected = args.only.split(',') if args.only else list(bench_endpoints.SCENARIOS)
+    if args.skip_writes:
+        selected = [name for name in selected if not bench_endpoints.SCENARIOS[name][1]]
+
+    import psycopg2
+
+    db_instrumentation.install()
+    ctx = bench_endpoints.sample_context(args.database, random.Random(args.seed))
+    conn = psycopg2.connect(args.database)
+    snapshot_dir = Path(args.snapshot_dir)
+    changed = []
+    flagged = 0
+    try:
+        for name in selected:
+            ctx['rng'] = random.Random(f"{args.seed}:{name}")
+            statements = capture(name, ctx, args.requests)
+            print(name)
+            sections = []
+            for statement in statements:
+                if statement.query is None or statement.sql.split(' ', 1)[0] not in EXPLAINABLE:
+                    continue
+                try:
+                    plan = explain(conn, statement)
+                except psycopg2.Error as e:
+                    print(f"  {statement.fingerprint} could not be explained: {str(e).strip()}")
+                    continue
+                problems = findings(plan, args.min_rows, args.node_share)
+                flagged += len(problems)
+                print(f"  {'!!' if problems else 'ok'} {statement.fingerprint} {plan.get('Execution Time', 0):8.2f}ms"
+                      f"  {statement.sql[:120]}")
+                for problem in problems:
+                    print(f"      {problem}")
+                sections.append(f"-- {statement.fingerprint} {statement.sql}\n{plan_shape(plan)}\n")
+
+            snapshot = '\n'.join(sections)
+            path = snapshot_dir / f"{name}.plan"
+            previous = path.read_text() if path.exists() else ''
+            if snapshot == previous:
+                continue
+            if args.check:
+                changed.append(name)
+                sys.stdout.writelines(difflib.unified_diff(previous.splitlines(True), snapshot.splitlines(True),
+                                                           f"{path} (snapshot)", f"{path} (now)"))
+            else:
+                snapshot_dir.mkdir(parents=True, exist_ok=True)
+                path.write_text(snapshot)
+    finally:
+        conn.close()
+
+    print(f"\n{flagged} findings", file=sys.stderr)
+    if changed:
+        print(f"Plans changed for {', '.join(changed)}; rerun without --check to accept", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
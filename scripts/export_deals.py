@@ -0,0 +1,69 @@
+'''
+Business: Export deals as CSV or NDJSON straight from the database, with flat memory use for any history size
+Args: --format csv/ndjson, --date-from/--date-to (YYYY-MM-DD), --user-id, --status, --deal-type, --fields,
+      --output (default stdout); DATABASE_URL in the environment
+Returns: Writes the export and prints row count and elapsed time to stderr
+'''
+import argparse
+import importlib.util
+import os
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+
+def load_admin_get_deals():
+    """Import backend/admin-get-deals/index.py as a module"""
+    spec = importlib.util.spec_from_file_location('admin_get_deals', BACKEND_DIR / 'admin-get-deals' / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--format', choices=('csv', 'ndjson'), default='csv')
+    parser.add_argument('--date-from')
+    parser.add_argument('--date-to')
+    parser.add_argument('--user-id')
+    parser.add_argument('--status')
+    parser.add_argument('--deal-type')
+    parser.add_argument('--fields')
+    parser.add_argument('--output', help='file path, stdout when omitted')
+    args = parser.parse_args()
+
+    module = load_admin_get_deals()
+    fields = module.parse_fields(args.fields)
+    conditions, values = module.parse_filters({
+        'date_from': args.date_from, 'date_to': args.date_to, 'user_id': args.user_id,
+        'status': args.status, 'deal_type': args.deal_type
+    })
+
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    started = time.perf_counter()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    target = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        rows = counted(module.iter_deal_rows(conn, fields, conditions, values))
+        for chunk in module.export_chunks(rows, fields, args.format):
+            target.write(chunk)
+    finally:
+        if args.output:
+            target.close()
+        conn.close()
+    print(f"{count} deals exported in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
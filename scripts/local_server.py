@@ -0,0 +1,197 @@
+'''
+Business: Serve every backend/<function>/index.py handler from one local WSGI server for load testing
+Args: --host, --port, --workers (forked processes sharing the socket), --preload (import all handlers before fork),
+      --cold (re-import the handler on every request); DATABASE_URL and other handler env in the environment
+Returns: Runs until interrupted; GET / lists functions, /<function>/... is translated into the cloud event format
+'''
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+STATUS_TEXT = {200: 'OK', 201: 'Created', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request',
+               401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+               409: 'Conflict', 413: 'Payload Too Large', 429: 'Too Many Requests', 500: 'Internal Server Error',
+               502: 'Bad Gateway'}
+
+
+def discover_functions() -> dict:
+    """Function name -> index.py path for every backend directory that has a handler"""
+    return {path.parent.name: path for path in sorted(BACKEND_DIR.glob('*/index.py'))}
+
+
+def load_handler(name: str, path: Path):
+    """Import a function module under a unique name and return its handler"""
+    spec = importlib.util.spec_from_file_location(f"fn_{name.replace('-', '_')}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.handler
+
+
+class Router:
+    """WSGI app: /<function>/<rest> -> handler(event, context), modules stay warm per worker unless cold=True"""
+
+    def __init__(self, functions: dict, cold: bool):
+        self.functions = functions
+        self.cold = cold
+        self.handlers = {}
+
+    def preload(self):
+        for name, path in self.functions.items():
+            self.handlers[name] = load_handler(name, path)
+
+    def after_fork(self):
+        """Preloaded modules share the parent's INSTANCE_ID; give each worker its own so handler-metrics keeps them apart"""
+        for handler in self.handlers.values():
+            if 'INSTANCE_ID' in handler.__globals__:
+                handler.__globals__['INSTANCE_ID'] = uuid.uuid4().hex[:16]
+
+    def make_event(self, environ) -> dict:
+        """HTTP request in the shape the cloud gateway passes to handlers"""
+        headers = {key[5:].replace('_', '-').title(): value for key, value in environ.items() if key.startswith('HTTP_')}
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        raw = environ['wsgi.input'].read(length) if length else b''
+        try:
+            body, is_base64 = raw.decode('utf-8'), False
+        except UnicodeDecodeError:
+            body, is_base64 = base64.b64encode(raw).decode(), True
+        request_id = str(uuid.uuid4())
+        return {
+            'httpMethod': environ['REQUEST_METHOD'],
+            'path': environ.get('PATH_INFO', '/'),
+            'headers': headers,
+            'queryStringParameters': dict(parse_qsl(environ.get('QUERY_STRING', ''), keep_blank_values=True)),
+            'body': body,
+            'isBase64Encoded': is_base64,
+            'requestContext': {
+                'requestId': request_id,
+                'identity': {'sourceIp': environ.get('REMOTE_ADDR')},
+                'httpMethod': environ['REQUEST_METHOD']
+            }
+        }
+
+    def __call__(self, environ, start_response):
+        parts = environ.get('PATH_INFO', '/').strip('/').split('/', 1)
+        name = parts[0]
+        if not name:
+            return self.reply(start_response, 200, {'Content-Type': 'application/json'},
+                              json.dumps({'functions': sorted(self.functions)}).encode())
+        if name not in self.functions:
+            return self.reply(start_response, 404, {'Content-Type': 'application/json'},
+                              json.dumps({'error': f'Unknown function {name}'}).encode())
+
+        cold_start = self.cold or name not in self.handlers
+        started = time.perf_counter()
+        if cold_start:
+            self.handlers[name] = load_handler(name, self.functions[name])
+        event = self.make_event(environ)
+        context = SimpleNamespace(request_id=event['requestContext']['requestId'], function_name=name)
+        try:
+            response = self.handlers[name](event, context)
+        except Exception as e:
+            print(f"[{os.getpid()}] {name} raised {type(e).__name__}: {e}", file=sys.stderr)
+            response = {'statusCode': 502, 'headers': {'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': f'Handler raised {type(e).__name__}'})}
+
+        body = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            payload = base64.b64decode(body)
+        else:
+            payload = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        headers = {key: str(value) for key, value in (response.get('headers') or {}).items()}
+        headers['X-Cold-Start'] = '1' if cold_start else '0'
+        headers['X-Handler-Ms'] = f"{(time.perf_counter() - started) * 1000:.2f}"
+        headers['X-Worker-Pid'] = str(os.getpid())
+        return self.reply(start_response, int(response.get('statusCode', 200)), headers, payload)
+
+    @staticmethod
+    def reply(start_response, status: int, headers: dict, payload: bytes):
+        headers = {key: value for key, value in headers.items() if key.lower() != 'content-length'}
+        headers['Content-Length'] = str(len(payload))
+        start_response(f"{status} {STATUS_TEXT.get(status, 'Status')}", list(headers.items()))
+        return [payload]
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(listener: socket.socket, router: Router, verbose: bool):
+    """Accept loop of one worker on the shared listening socket"""
+    server = WSGIServer(listener.getsockname(), QuietHandler if not verbose else WSGIRequestHandler,
+                        bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    # Без server_bind(): сокет уже открыт родителем, заполняем то, что он выставил бы сам
+    server.server_name, server.server_port = listener.getsockname()[:2]
+    server.setup_environ()
+    server.set_app(router)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--preload', action='store_true', help='import every handler before forking workers')
+    parser.add_argument('--cold', action='store_true', help='re-import the handler on every request')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    functions = discover_functions()
+    router = Router(functions, cold=args.cold)
+    if args.preload:
+        router.preload()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(1024)
+    print(f"{len(functions)} functions on http://{args.host}:{args.port}/<function>/ with {args.workers} workers"
+          f"{', cold' if args.cold else ', preloaded' if args.preload else ''}", file=sys.stderr)
+
+    if args.workers <= 1:
+        serve(listener, router, args.verbose)
+        return
+
+    children = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            router.after_fork()
+            serve(listener, router, args.verbose)
+            os._exit(0)
+        children.append(pid)
+
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    main()
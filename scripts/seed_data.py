@@ -0,0 +1,301 @@
+'''
+Business: Bulk-load deterministic synthetic users, offices, offers, offer_time_slots, reservations and deals via COPY
+Args: --users, --offers, --reservations, --deals, --history-days, --seed, --today (anchor date),
+      --csv-dir (write CSV files instead of loading); DATABASE_URL in the environment when loading
+Returns: Prints rows and time per table; ids continue after the current MAX(id) so existing rows are kept
+'''
+import argparse
+import csv
+import io
+import itertools
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+CITIES = ['Москва', 'Кемерово', 'Новокузнецк', 'Новосибирск', 'Томск', 'Барнаул', 'Красноярск', 'Омск']
+STREETS = ['Ленина', 'Советская', 'Мира', 'Кирова', 'Гагарина', 'Пушкина', 'Победы', 'Садовая']
+FIRST_NAMES = ['Иван', 'Алексей', 'Мария', 'Ольга', 'Дмитрий', 'Анна', 'Сергей', 'Елена', 'Павел', 'Наталья']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов']
+OFFICES_PER_CITY = 6
+# Заглушка вместо bcrypt-хэша: под сгенерированными пользователями войти нельзя
+PASSWORD_HASH = '!seed'
+
+OFFER_STATUSES = (('active', 60), ('inactive', 15), ('completed', 20), ('reserved', 5))
+RESERVATION_STATUSES = (('pending', 10), ('confirmed', 45), ('rejected', 15), ('expired', 30))
+DEAL_STATUSES = (('completed', 70), ('cancelled', 15), ('pending', 15))
+
+TABLE_COLUMNS = {
+    'users': ('id', 'name', 'email', 'phone', 'password_hash', 'created_at', 'updated_at', 'username',
+              'first_name', 'last_name', 'role', 'blocked'),
+    'offices': ('id', 'city', 'name', 'normalized_name'),
+    'offers': ('id', 'user_id', 'offer_type', 'amount', 'rate', 'meeting_time', 'status', 'created_at', 'updated_at',
+               'city', 'offices', 'office_ids', 'time_start', 'time_end', 'valid_from', 'valid_until', 'expires_at',
+               'is_anonymous', 'anonymous_name', 'anonymous_phone'),
+    'offer_time_slots': ('offer_id', 'slot_time', 'is_reserved', 'reserved_by', 'reserved_at'),
+    'reservations': ('id', 'offer_id', 'buyer_user_id', 'meeting_office', 'meeting_office_id', 'meeting_date',
+                     'meeting_time', 'amount', 'status', 'created_at', 'expires_at', 'confirmed_at', 'rejected_at'),
+    'deals': ('id', 'user_id', 'deal_type', 'amount', 'rate', 'total', 'status', 'partner_name', 'created_at',
+              'updated_at', 'offer_id', 'meeting_office', 'meeting_time'),
+}
+
+
+class CopyStream:
+    """File-like object over a row generator: copy_expert pulls CSV bytes lazily, nothing is materialized"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator='\n')
+        self.pending = b''
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.pending) < size:
+            batch = list(itertools.islice(self.rows, 1000))
+            if not batch:
+                break
+            self.writer.writerows(batch)
+            self.count += len(batch)
+            self.pending += self.buffer.getvalue().encode()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        if size < 0:
+            data, self.pending = self.pending, b''
+        else:
+            data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def weighted(rng: random.Random, choices) -> str:
+    return rng.choices([name for name, _ in choices], weights=[weight for _, weight in choices])[0]
+
+
+def skewed_index(rng: random.Random, size: int) -> int:
+    """Index skewed towards the start: the first 10% of users (or offers) get about 40% of the activity"""
+    return min(int(size * rng.random() ** 2.5), size - 1)
+
+
+def pg_array(values) -> str:
+    """Postgres array literal for COPY csv"""
+    return '{' + ','.join('"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for value in values) + '}'
+
+
+def hhmm(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class Generator:
+    """Deterministic rows per table; each table has its own RNG so resizing one table does not reshuffle the others"""
+
+    def __init__(self, args, id_base: dict, today: date, existing_offices=()):
+        self.args = args
+        self.id_base = id_base
+        self.today = today
+        self.now = datetime.combine(today, datetime.min.time()) + timedelta(hours=12)
+        # Офисы уже заведённых городов переиспользуются: (city, normalized_name) уникален
+        self.offices = [office for office in existing_offices if office[1] in CITIES]
+        self.offers = []
+
+    def rng(self, table: str) -> random.Random:
+        return random.Random(f"{self.args.seed}:{table}")
+
+    def user_id(self, rng: random.Random) -> int:
+        return self.id_base['users'] + 1 + skewed_index(rng, self.args.users)
+
+    def users(self):
+        rng = self.rng('users')
+        for number in range(1, self.args.users + 1):
+            user_id = self.id_base['users'] + number
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            created = self.now - timedelta(days=self.args.history_days * rng.random() ** 0.5, seconds=rng.randrange(86400))
+            yield (user_id, f"{first} {last}", f"seed{user_id}@example.test", f"+7000{user_id:07d}", PASSWORD_HASH,
+                   created, created, f"{first.lower()}{user_id}", first, last, 'user', rng.random() < 0.01)
+
+    def offices_rows(self):
+        office_id = self.id_base['offices']
+        seeded_cities = {office[1] for office in self.offices}
+        for city in CITIES:
+            if city in seeded_cities:
+                continue
+            for number in range(1, OFFICES_PER_CITY + 1):
+                office_id += 1
+                name = f"Офис {number}, ул. {STREETS[(number + len(city)) % len(STREETS)]}, {number * 7}"
+                self.offices.append((office_id, city, name))
+                yield office_id, city, name, ' '.join(name.lower().replace('.', ' ').replace(',', ' ').split())
+
+    def offers_rows(self):
+        rng = self.rng('offers')
+        by_city = {city: [office for office in self.offices if office[1] == city] for city in CITIES}
+        for number in range(1, self.args.offers + 1):
+            offer_id = self.id_base['offers'] + number
+            city = CITIES[min(int(rng.expovariate(0.6)), len(CITIES) - 1)]
+            offices = rng.sample(by_city[city], rng.randint(1, min(3, len(by_city[city]))))
+            offer_type = rng.choice(('buy', 'sell'))
+            status = weighted(rng, OFFER_STATUSES)
+            start = rng.randrange(8 * 60, 20 * 60, 15)
+            end = min(start + rng.choice((60, 120, 180, 240, 480)), 24 * 60 - 15)
+            amount = rng.randrange(100, 20000, 50)
+            if status in ('active', 'reserved'):
+                valid_from = self.today - timedelta(days=rng.randrange(2))
+                valid_until = self.today + timedelta(days=rng.randrange(7))
+                created = datetime.combine(valid_from, datetime.min.time()) + timedelta(minutes=rng.randrange(start))
+            else:
+                created = self.now - timedelta(days=rng.uniform(1, self.args.history_days))
+                valid_from = created.date()
+                valid_until = valid_from + timedelta(days=rng.randrange(3))
+            anonymous = offer_type == 'buy' and rng.random() < 0.03
+            self.offers.append((offer_id, start, end, [office[0] for office in offices], [office[2] for office in offices],
+                                valid_from, valid_until, amount, offer_type, status))
+            yield (offer_id, self.user_id(rng), offer_type, amount, f"{rng.gauss(95.0, 1.5):.2f}", hhmm(start), status,
+                   created, created, city, pg_array(office[2] for office in offices),
+                   pg_array(office[0] for office in offices), hhmm(start), hhmm(end), valid_from, valid_until,
+                   datetime.combine(valid_until + timedelta(days=1), datetime.min.time()),
+                   anonymous, f"Гость {offer_id}" if anonymous else None, f"+7001{offer_id:07d}" if anonymous else None)
+
+    def slots_rows(self):
+        rng = self.rng('offer_time_slots')
+        for offer_id, start, end, *_ in self.offers:
+            for minutes in range(start, end, 15):
+                reserved = rng.random() < 0.05
+                yield (offer_id, hhmm(minutes), reserved, self.user_id(rng) if reserved else None,
+                       self.now - timedelta(minutes=rng.randrange(600)) if reserved else None)
+
+    def reservations_rows(self):
+        rng = self.rng('reservations')
+        if not self.offers:
+            return
+        for number in range(1, self.args.reservations + 1):
+            offer_id, start, end, office_ids, office_names, valid_from, valid_until, amount, _, _ = \
+                self.offers[skewed_index(rng, len(self.offers))]
+            status = weighted(rng, RESERVATION_STATUSES)
+            office = rng.randrange(len(office_ids))
+            span = (valid_until - valid_from).days
+            meeting_date = valid_from + timedelta(days=rng.randint(0, span))
+            if status == 'pending':
+                meeting_date = max(meeting_date, self.today)
+                created = self.now - timedelta(seconds=rng.randrange(150))
+            else:
+                created = datetime.combine(meeting_date, datetime.min.time()) - timedelta(hours=rng.uniform(0, 24))
+            expires = created + timedelta(minutes=3)
+            yield (self.id_base['reservations'] + number, offer_id, self.user_id(rng), office_names[office],
+                   office_ids[office], meeting_date, hhmm(rng.randrange(start, end, 15)),
+                   min(amount, rng.randrange(100, 20000, 50)), status, created, expires,
+                   created + timedelta(seconds=rng.randrange(170)) if status == 'confirmed' else None,
+                   created + timedelta(seconds=rng.randrange(170)) if status == 'rejected' else None)
+
+    def deals_rows(self):
+        rng = self.rng('deals')
+        for number in range(1, self.args.deals + 1):
+            # Рост оборота: свежих сделок больше, чем старых
+            created = self.now - timedelta(days=self.args.history_days * (1 - rng.random() ** 0.5),
+                                           seconds=rng.randrange(86400))
+            amount = rng.randrange(100, 20000, 50)
+            rate = round(rng.gauss(95.0, 1.5), 2)
+            offer = self.offers[rng.randrange(len(self.offers))] if self.offers and rng.random() < 0.3 else None
+            yield (self.id_base['deals'] + number, self.user_id(rng), rng.choice(('buy', 'sell')), amount, f"{rate:.2f}",
+                   f"{amount * rate:.2f}", weighted(rng, DEAL_STATUSES), f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                   created, created + timedelta(minutes=rng.randrange(120)), offer[0] if offer else None,
+                   offer[4][0] if offer else None, hhmm(offer[1]) if offer else None)
+
+    def tables(self):
+        return (('users', self.users), ('offices', self.offices_rows), ('offers', self.offers_rows),
+                ('offer_time_slots', self.slots_rows), ('reservations', self.reservations_rows),
+                ('deals', self.deals_rows))
+
+
+def write_csv(directory: Path, table: str, rows) -> int:
+    stream = CopyStream(rows)
+    with open(directory / f"{table}.csv", 'wb') as target:
+        while True:
+            data = stream.read(1 << 16)
+            if not data:
+                break
+            target.write(data)
+    return stream.count
+
+
+def copy_table(cur, table: str, rows) -> int:
+    stream = CopyStream(rows)
+    cur.copy_expert(f"COPY {table} ({', '.join(TABLE_COLUMNS[table])}) FROM STDIN WITH (FORMAT csv)", stream, size=1 << 16)
+    return stream.count
+
+
+def finish_load(cur):
+    """Sequences past the new ids, user counters from the new deals, cache versions bumped, fresh statistics"""
+    for table, columns in TABLE_COLUMNS.items():
+        if 'id' in columns:
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+    cur.execute("""
+        UPDATE users u
+        SET completed_deals = d.deals_count,
+            completed_volume = d.volume
+        FROM (
+            SELECT user_id, COUNT(*) AS deals_count, COALESCE(SUM(amount), 0) AS volume
+            FROM deals
+            WHERE status = 'completed'
+            GROUP BY user_id
+        ) d
+        WHERE u.id = d.user_id
+    """)
+    cur.execute("UPDATE cache_versions SET version = version + 1, updated_at = NOW()")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--offers', type=int, default=50_000)
+    parser.add_argument('--reservations', type=int, default=100_000)
+    parser.add_argument('--deals', type=int, default=500_000)
+    parser.add_argument('--history-days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--today', type=date.fromisoformat, default=date.today(),
+                        help='anchor date, pass it explicitly for byte-identical CSV output across days')
+    parser.add_argument('--csv-dir', help='write <table>.csv files here instead of loading into DATABASE_URL')
+    args = parser.parse_args()
+
+    if args.csv_dir:
+        directory = Path(args.csv_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        generator = Generator(args, {table: 0 for table in TABLE_COLUMNS}, args.today)
+        for table, rows in generator.tables():
+            started = time.perf_counter()
+            count = write_csv(directory, table, rows())
+            print(f"{table:<18} {count:>9} rows  {time.perf_counter() - started:6.2f}s")
+        return
+
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    id_base = {}
+    for table in TABLE_COLUMNS:
+        cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        id_base[table] = cur.fetchone()[0]
+    cur.execute("SELECT id, city, name FROM offices ORDER BY id")
+
+    generator = Generator(args, id_base, args.today, cur.fetchall())
+    try:
+        for table, rows in generator.tables():
+            started = time.perf_counter()
+            count = copy_table(cur, table, rows())
+            print(f"{table:<18} {count:>9} rows  {time.perf_counter() - started:6.2f}s")
+        finish_load(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    conn.autocommit = True
+    cur = conn.cursor()
+    for table in TABLE_COLUMNS:
+        cur.execute(f"ANALYZE {table}")
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+Business: Copy the tracing, metrics, replica and offer validity helpers from scripts/handler_runtime.py into backend functions
+          (functions are deployed one directory at a time, so each index.py carries its own copy)
+Args: --check (compare instead of writing), --only (comma separated function names)
+Returns: Rewrites the generated block of each backend/<function>/index.py; with --check prints the difference and
+         exits with code 1 when a copy was edited by hand or the source changed without a sync
+'''
+import argparse
+import difflib
+import re
+import sys
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = SCRIPTS_DIR.parent / 'backend'
+SOURCE = SCRIPTS_DIR / 'handler_runtime.py'
+
+BEGIN = '# >>> generated by scripts/sync_handler_runtime.py from scripts/handler_runtime.py, do not edit'
+END = '# <<< end of generated block'
+
+# Необязательная секция попадает в обработчик, только если код вне блока использует одно из этих имён
+OPTIONAL_SECTIONS = {
+    'debug': {'debug_sampled'},
+    'db': {'traced_connect', 'read_connection'},
+    'replica': {'read_connection'},
+    'http': {'traced_http'},
+    'validity': {'offer_validity'}
+}
+SECTION = re.compile(r'^# @section (\w+)\n', re.M)
+DRIVER = re.compile(r'^import (psycopg2?)$', re.M)
+
+
+def load_sections() -> dict:
+    """Section name -> source text, in the order of handler_runtime.py"""
+    parts = SECTION.split(SOURCE.read_text())
+    return {name: text.strip('\n') for name, text in zip(parts[1::2], parts[2::2])}
+
+
+def render(sections: dict, function: str, outside: str) -> str:
+    """Generated block for one handler: the sections its own code uses, for the driver it imports"""
+    used = set(re.findall(r'\w+', outside))
+    names = [name for name in sections if name not in OPTIONAL_SECTIONS or used & OPTIONAL_SECTIONS[name]]
+    text = '\n\n\n'.join(sections[name] for name in names)
+    text = text.replace("TRACE_FUNCTION = '<function>'", f"TRACE_FUNCTION = '{function}'")
+    driver = DRIVER.search(outside)
+    if driver and driver.group(1) == 'psycopg':
+        text = re.sub(r'\bpsycopg2\b', 'psycopg', text)
+    return f"{BEGIN}\n{text}\n{END}"
+
+
+def synced(path: Path, sections: dict) -> str:
+    """The file's text with its generated block rebuilt; raises ValueError when the markers are missing"""
+    text = path.read_text()
+    begin = text.find(BEGIN + '\n')
+    end = text.find(END + '\n', begin)
+    if begin < 0 or end < 0:
+        raise ValueError(f'{path.relative_to(BACKEND_DIR.parent)}: no generated block markers')
+    end += len(END)
+    outside = text[:begin] + text[end:]
+    return text[:begin] + render(sections, path.parent.name, outside) + text[end:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--check', action='store_true', help='report copies that differ instead of rewriting them')
+    parser.add_argument('--only', help='comma separated function names')
+    args = parser.parse_args()
+
+    sections = load_sections()
+    paths = sorted(BACKEND_DIR.glob('*/index.py'))
+    if args.only:
+        paths = [path for path in paths if path.parent.name in args.only.split(',')]
+
+    checked, changed = 0, []
+    for path in paths:
+        text = path.read_text()
+        # Функции без декоратора traced (handler-metrics) блок не используют
+        if '@traced' not in text:
+            continue
+        checked += 1
+        try:
+            new_text = synced(path, sections)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        if new_text == text:
+            continue
+        changed.append(path.parent.name)
+        if args.check:
+            name = str(path.relative_to(BACKEND_DIR.parent))
+            sys.stdout.writelines(difflib.unified_diff(text.splitlines(True), new_text.splitlines(True),
+                                                       f"{name} (copy)", f"{name} (generated)"))
+        else:
+            path.write_text(new_text)
+
+    if not changed:
+        print(f"{checked} functions in sync with {SOURCE.name}", file=sys.stderr)
+    elif args.check:
+        print(f"Out of sync: {', '.join(changed)}; edit {SOURCE.name} and run without --check", file=sys.stderr)
+        sys.exit(1)
+    else:
+        print(f"Updated {', '.join(changed)}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
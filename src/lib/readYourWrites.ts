@@ -0,0 +1,60 @@
+// Read-your-writes for handlers that read from the database replica.
+// After any successful non-GET call to a backend function, GET calls to the replica-routed
+// functions within the window carry X-Last-Write-Age (ms since that write), so the function
+// reads from the primary until the replica has caught up. Other functions never get the header:
+// their CORS preflight does not allow it. Outside the window no header and no preflight.
+import funcUrls from '../../backend/func2url.json';
+
+const FUNCTIONS_HOST = 'functions.poehali.dev';
+// Functions that call read_connection() on the backend and list X-Last-Write-Age in CORS
+const REPLICA_ROUTED_URLS = [
+  funcUrls['get-active-offers'],
+  funcUrls['get-all-offers'],
+  funcUrls['get-user-offers'],
+  funcUrls['get-user-deals'],
+  funcUrls['admin-get-deals'],
+  funcUrls['get-all-users'],
+  funcUrls['get-statistics'],
+];
+const WINDOW_MS = 30_000;
+const STORAGE_KEY = 'lastWriteAt';
+
+// sessionStorage keeps the mark across a reload right after a write
+const readLastWrite = (): number | null => {
+  const value = Number(sessionStorage.getItem(STORAGE_KEY));
+  return value > 0 ? value : null;
+};
+
+const requestUrl = (input: RequestInfo | URL): string =>
+  typeof input === 'string' ? input : input instanceof URL ? input.href : input.url;
+
+const isReplicaRouted = (url: string): boolean =>
+  REPLICA_ROUTED_URLS.some((functionUrl) => url === functionUrl || url.startsWith(`${functionUrl}?`) || url.startsWith(`${functionUrl}/`));
+
+export const installReadYourWrites = () => {
+  const originalFetch = window.fetch.bind(window);
+
+  window.fetch = async (input: RequestInfo | URL, init?: RequestInit) => {
+    const url = requestUrl(input);
+    if (!url.includes(FUNCTIONS_HOST)) {
+      return originalFetch(input, init);
+    }
+
+    const method = (init?.method || (input instanceof Request ? input.method : 'GET')).toUpperCase();
+    const lastWriteAt = readLastWrite();
+    if (method === 'GET' && lastWriteAt !== null && isReplicaRouted(url)) {
+      const age = Math.max(Date.now() - lastWriteAt, 0);
+      if (age < WINDOW_MS) {
+        const headers = new Headers(init?.headers || (input instanceof Request ? input.headers : undefined));
+        headers.set('X-Last-Write-Age', String(age));
+        init = { ...init, headers };
+      }
+    }
+
+    const response = await originalFetch(input, init);
+    if (method !== 'GET' && method !== 'OPTIONS' && response.ok) {
+      sessionStorage.setItem(STORAGE_KEY, String(Date.now()));
+    }
+    return response;
+  };
+};